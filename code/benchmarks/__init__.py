@@ -0,0 +1,5 @@
+"""
+Benchmarks for the gadget building blocks. Run from the code/ directory, e.g.
+
+python -m benchmarks.pipeline_benchmark
+"""
@@ -0,0 +1,74 @@
+"""
+Compares per-frame inference with micro-batched inference on the EDSR model.
+
+python -m benchmarks.batching_benchmark --frames 64 --batch-sizes 1 2 4 8
+"""
+
+import argparse
+import logging
+import time
+
+import torch
+
+from modules import batching
+from modules.schemas.edsr_sr import EdsrDimensions, EdsrModel
+
+from tools import stand_in_models
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched inference.")
+    parser.add_argument("--frames", "-n", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--deadline", type=float, default=0.005)
+    parser.add_argument(
+        "--parameters", default="", help="Directory with the real parameter files."
+    )
+    parser.add_argument("--model-name", default=stand_in_models.EDSR_STAND_IN)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)
+    stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+
+    device = torch.device("cpu")
+    model = EdsrModel(device, args_dict["model_name"])
+
+    frames = [
+        (index, torch.rand(EdsrDimensions.input_dimensions))
+        for index in range(args_dict["frames"])
+    ]
+
+    with torch.no_grad():
+        reference = [model.perform_inference(tensor) for _, tensor in frames]
+
+        for batch_size in args_dict["batch_sizes"]:
+            micro_batcher = batching.MicroBatcher(
+                model, batch_size, args_dict["deadline"]
+            )
+
+            start = time.perf_counter()
+            outputs = list(micro_batcher.run(iter(frames)))
+            elapsed = time.perf_counter() - start
+
+            assert [key for key, _ in outputs] == [key for key, _ in frames]
+            max_error = max(
+                float((output - expected).abs().max())
+                for (_, output), expected in zip(outputs, reference)
+            )
+
+            print(
+                f"Batch size {batch_size}: {len(frames) / elapsed:.1f} frames/s, "
+                f"{1e3 * elapsed / len(frames):.2f} ms/frame, "
+                f"max abs difference to per-frame inference {max_error:.2e}"
+            )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Compares raw MLC frames with zlib compressed keyframes only and with
+keyframes plus int16 deltas (MLCSocketmaker compression), over a cine series
+of a moving Shepp-Logan phantom with and without noise, sent to the test
+receiver (which decodes them) over TCP loopback throttled to a given
+bandwidth. The send time is carried in the SlicePositionSagittal field of
+each frame. Checks every decoded image is the image sent, and reports the
+compression ratio, the encode time per frame and the end-to-end latency.
+
+python -m benchmarks.compression_benchmark --bandwidths 0 100 20 --frames 40
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from modules.phantom import shepp_logan
+from modules.schemas.mlc_tracking import MLCFramePacker, MLCSocketmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "test"))
+
+from mlc_receiver import MLCReceiver  # noqa: E402
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sdim", type=int, default=256)
+    parser.add_argument("--frames", "-n", type=int, default=40)
+    parser.add_argument(
+        "--interval", type=float, default=0.05, help="Seconds between frames."
+    )
+    parser.add_argument(
+        "--bandwidths",
+        type=float,
+        nargs="+",
+        default=[0, 100, 20],
+        help="Link bandwidths in Mbit/s (0: unthrottled loopback).",
+    )
+    parser.add_argument(
+        "--noise",
+        type=float,
+        nargs="+",
+        default=[0, 20],
+        help="Standard deviation of the image noise (of 4096).",
+    )
+    parser.add_argument("--keyframe-interval", type=int, default=30)
+    parser.add_argument("--level", type=int, default=1)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+class ThrottledSocket:
+    """
+    Wraps an accepted socket so that data is read no faster than it would
+    arrive over a link of the given bandwidth.
+    """
+
+    CHUNK = 1 << 14
+
+    def __init__(self, client, bandwidth: float) -> None:
+        """
+        :param client: the accepted socket.
+        :param bandwidth: the link bandwidth in bytes per second.
+        """
+        self.client = client
+        self.bandwidth = bandwidth
+        self.link_free = 0.0  # When the link has sent the bytes read so far.
+
+    def recv_into(self, view: memoryview) -> int:
+        received = self.client.recv_into(view[: self.CHUNK])
+        now = time.perf_counter()
+        self.link_free = max(self.link_free, now) + received / self.bandwidth
+        if self.link_free > now:
+            time.sleep(self.link_free - now)
+
+        return received
+
+    def sendall(self, data) -> None:
+        self.client.sendall(data)
+        return None
+
+
+class ThrottledReceiver(MLCReceiver):
+    def __init__(self, bandwidth: float, **kwargs) -> None:
+        """
+        :param bandwidth: the link bandwidth in bytes per second (0: not
+            throttled).
+        """
+        super().__init__("localhost", 0, **kwargs)
+        self.bandwidth = bandwidth
+
+    def receive(self, client, max_frames: int = None) -> None:
+        if self.bandwidth:
+            client = ThrottledSocket(client, self.bandwidth)
+
+        return super().receive(client, max_frames)
+
+
+def cine_frames(sdim: int, count: int, noise: float) -> list:
+    """
+    uint16 magnitude frames (as packed) of a phantom moving with a breathing
+    period of 20 frames, with Gaussian noise.
+    """
+    random = np.random.default_rng(0)
+    frames = []
+    for index in range(count):
+        shift = (0.02 * np.sin(2 * np.pi * index / 20), 0.0)
+        image = 2000.0 * shepp_logan(sdim, shift)
+        image += noise * random.standard_normal(image.shape)
+        frames.append(np.clip(image, 0, 4095).astype(np.uint16))
+
+    return frames
+
+
+def run(frames: list, bandwidth: float, options: dict, interval: float) -> dict:
+    """
+    Sends the frames every interval seconds and returns the latencies, the
+    compression statistics and the number of decoded images that differ from
+    the image sent.
+    """
+    sdim = frames[0].shape[0]
+    latencies = []
+    mismatches = []
+
+    def on_frame(counter, header, image):
+        latencies.append(time.perf_counter() - header["SlicePositionSagittal"])
+        mismatches.append(not np.array_equal(image, frames[counter]))
+
+    receiver = ThrottledReceiver(bandwidth, on_frame=on_frame)
+    thread = threading.Thread(target=receiver.serve, args=(1,), daemon=True)
+    thread.start()
+
+    packer = MLCFramePacker(sdim * sdim)
+    with MLCSocketmaker("localhost", receiver.port, **options) as MLCsm:
+        MLCsm.create_socketclient()
+        MLCsm.connect_socketclient()
+
+        next_send = time.perf_counter()
+        for image in frames:
+            time.sleep(max(next_send - time.perf_counter(), 0.0))
+            next_send += interval
+
+            header = (time.perf_counter(), 0.0, 0.0, 5.0, 0.0, 1.0, 1.0, sdim, sdim)
+            MLCsm.send_packed_struct(packer.pack(header, image))
+
+    thread.join(timeout=60)
+    receiver.close()
+    assert len(latencies) == len(frames), "Frames were lost"
+
+    return {
+        "latencies": np.asarray(latencies),
+        "statistics": MLCsm.compression_statistics,
+        "mismatches": sum(mismatches),
+    }
+
+
+def main():
+    args_dict = parse_cmd_args()
+    sdim = args_dict["sdim"]
+    modes = {
+        "raw": {},
+        "zlib keyframes": {"compression": "zlib", "keyframe_interval": 1},
+        "zlib deltas": {
+            "compression": "zlib",
+            "keyframe_interval": args_dict["keyframe_interval"],
+        },
+    }
+
+    for noise in args_dict["noise"]:
+        frames = cine_frames(sdim, args_dict["frames"], noise)
+        for bandwidth in args_dict["bandwidths"]:
+            link = f"{bandwidth:g} Mbit/s" if bandwidth else "loopback"
+            for label, options in modes.items():
+                options = dict(options, compression_level=args_dict["level"])
+                results = run(
+                    frames, bandwidth * 1e6 / 8, options, args_dict["interval"]
+                )
+                statistics = results["statistics"]
+                if statistics.frames:
+                    encoding = (
+                        f"{statistics.ratio:5.2f}x, encode "
+                        f"{1e3 * np.median(statistics.encode_times):5.2f} ms"
+                    )
+                else:
+                    encoding = f"{1.0:5.2f}x, encode {0.0:5.2f} ms"
+                p50, p95 = 1e3 * np.percentile(results["latencies"], [50, 95])
+                print(
+                    f"{sdim}x{sdim} noise {noise:>3g} {link:>12} {label:>14}: "
+                    f"{encoding}, latency p50 {p50:7.2f} ms, p95 {p95:7.2f} ms, "
+                    f"{results['mismatches']} decoded images differ"
+                )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
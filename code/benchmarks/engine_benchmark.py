@@ -0,0 +1,175 @@
+"""
+Compares the inference engines of the EDSR and bicubic models on CPU with
+the plain TorchScript path: checks their outputs agree within tolerance and
+reports the per-frame latency, speedup and memory allocated by torch per
+frame (allocations made inside ONNX Runtime are not seen). The ONNX models
+are exported first if missing (ONNX Runtime is skipped if onnxruntime is not
+installed).
+
+python -m benchmarks.engine_benchmark --frames 50 --intra-op-threads 4
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+
+from modules import model_utils
+from modules.schemas.bicubic_sr import BICUBIC_ENGINES, BicubicDimensions
+from modules.schemas.edsr_sr import EDSR_ENGINES, EdsrDimensions
+
+from tools import export_onnx, stand_in_models
+
+# (model, inference engines, input dimensions)
+MODELS = (
+    ("edsr", EDSR_ENGINES, EdsrDimensions),
+    ("bicubic", BICUBIC_ENGINES, BicubicDimensions),
+)
+
+# (label, inference engine, engine options), compared against the first
+# (plain TorchScript) engine.
+ENGINES = (
+    ("torchscript", "torchscript", {}),
+    ("optimised", "torchscript", {"optimise": True}),
+    (
+        "optimised channels-last",
+        "torchscript",
+        {"optimise": True, "channels_last": True},
+    ),
+    ("onnxruntime", "onnxruntime", {}),
+    ("bfloat16", "torchscript", {"precision": "bfloat16"}),
+    ("float16", "torchscript", {"precision": "float16"}),
+)
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the inference engines.")
+    parser.add_argument("--frames", "-n", type=int, default=50)
+    parser.add_argument("--warm-up", type=int, default=5)
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-5,
+        help="Maximum error relative to the output range (full precision).",
+    )
+    parser.add_argument(
+        "--parameters", default="", help="Directory with the real parameter files."
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def time_inference(model, frames: list, warm_up: int) -> tuple:
+    """
+    Returns the outputs for the frames and the per-frame latencies (seconds).
+
+    :param model: the loaded model.
+    :param frames: the input tensors.
+    :param warm_up: number of untimed frames run first.
+    """
+    for frame in frames[:warm_up]:
+        model.perform_inference(frame)
+
+    outputs, latencies = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        output = model.perform_inference(frame)
+        latencies.append(time.perf_counter() - start)
+        outputs.append(output.clone())  # Engines may reuse their output buffers.
+
+    return outputs, np.asarray(latencies)
+
+
+def allocated_memory(model, frame: torch.Tensor) -> int:
+    """
+    Bytes allocated by torch operators during the inference of one frame.
+
+    :param model: the loaded model.
+    :param frame: the input tensor.
+    """
+    with torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True
+    ) as profiler:
+        model.perform_inference(frame)
+
+    return sum(max(event.self_cpu_memory_usage, 0) for event in profiler.key_averages())
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)
+    directory = stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+
+    device = torch.device("cpu")
+    thread_options = {
+        "intra_op_threads": args_dict["intra_op_threads"],
+        "inter_op_threads": args_dict["inter_op_threads"],
+    }
+    model_utils.set_thread_counts(**thread_options)
+    print(
+        f"intra-op threads: {torch.get_num_threads()}, "
+        f"inter-op threads: {torch.get_num_interop_threads()}"
+    )
+
+    try:
+        import onnxruntime
+    except ImportError:
+        onnxruntime = None
+        print("onnxruntime is not installed, skipping the ONNX Runtime engine.")
+
+    for name, engines, dimensions in MODELS:
+        torch.manual_seed(0)
+        frames = [
+            torch.rand(dimensions.input_dimensions) for _ in range(args_dict["frames"])
+        ]
+        reference = None
+
+        for label, engine, engine_options in ENGINES:
+            model_class, model_name = engines[engine]
+            if engine == "onnxruntime":
+                if onnxruntime is None:
+                    continue
+                if not os.path.exists(os.path.join(directory, model_name)):
+                    export_onnx.export(name, directory)
+
+            model = model_class(device, model_name, **engine_options, **thread_options)
+            outputs, latencies = time_inference(model, frames, args_dict["warm_up"])
+
+            if reference is None:
+                reference, reference_latency = outputs, np.median(latencies)
+
+            output_range = max(
+                float(expected.max() - expected.min()) for expected in reference
+            )
+            relative_error = (
+                max(
+                    float((output - expected).abs().max())
+                    for output, expected in zip(outputs, reference)
+                )
+                / output_range
+            )
+            if model.precision == "float32":
+                tolerance = args_dict["tolerance"]
+            else:
+                tolerance = model.precision_tolerance
+            if engine_options.get("precision", "float32") != model.precision:
+                label = f"{label} (float32 fallback)"
+
+            print(
+                f"{name:>8} {label:>30}: p50 {1e3 * np.median(latencies):7.2f} ms, "
+                f"p95 {1e3 * np.percentile(latencies, 95):7.2f} ms, "
+                f"speedup {reference_latency / np.median(latencies):5.2f}x, "
+                f"allocated {allocated_memory(model, frames[0]) / 2**20:6.2f} MiB, "
+                f"relative error {relative_error:.2e} "
+                f"({'ok' if relative_error <= tolerance else 'MISMATCH'})"
+            )
+
+
+if __name__ == "__main__":
+    main()
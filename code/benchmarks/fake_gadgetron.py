@@ -0,0 +1,164 @@
+"""
+Stand-ins for the Gadgetron side of a gadget, so the gadgets' main functions
+can be driven on CPU outside the Gadgetron container:
+
+FakeConnection: iterable of ImageArray acquisitions (a Shepp-Logan phantom
+    with a small per-repetition shift), with the header fields read by the
+    gadgets and parser and a send() recording when each image comes back.
+DrainReceiver: local stand-in for the MLC tracking software, reading and
+    discarding everything sent to it.
+"""
+
+import socket
+import threading
+import time
+import typing
+
+import numpy as np
+
+import ismrmrd
+from gadgetron.types.image_array import ImageArray
+
+from modules import phantom
+
+
+class _Namespace:
+    def __init__(self, **fields) -> None:
+        self.__dict__.update(fields)
+
+
+class FakeConnection:
+    """
+    Iterable stand-in for gadgetron.external.connection.Connection. Yields
+    one ImageArray per repetition (complex64 data of shape
+    (sdim, sdim, 1, 1, 1, 1, 1) scaled like the Gadgetron ScaleGadget output)
+    and records the time each acquisition is yielded and each image is sent
+    back, so per-frame latency can be measured (images come back in order).
+    """
+
+    def __init__(
+        self,
+        repetitions: int,
+        sdim: int = 64,
+        fov: tuple = (512.0, 256.0, 5.0),
+        frame_rate: float = 0.0,
+        motion: float = 0.05,
+    ) -> None:
+        """
+        :param repetitions: number of acquisitions to yield.
+        :param sdim: the matrix size of the acquisitions.
+        :param fov: field of view (x, y, z) in mm (x includes 2x oversampling).
+        :param frame_rate: acquisitions per second (0: as fast as consumed).
+        :param motion: amplitude of the phantom's periodic shift (fraction of FOV).
+        """
+        field_of_view = _Namespace(x=fov[0], y=fov[1], z=fov[2])
+        matrix_size = _Namespace(x=sdim, y=sdim, z=1)
+        self.header = _Namespace(
+            encoding=[
+                _Namespace(
+                    encodedSpace=_Namespace(fieldOfView_mm=field_of_view),
+                    reconSpace=_Namespace(matrixSize=matrix_size),
+                )
+            ]
+        )
+        self.repetitions = repetitions
+        self.sdim = sdim
+        self.frame_rate = frame_rate
+        self.motion = motion
+        self.acquisitions = [self.make_acquisition(index) for index in range(16)]
+        self.yield_times = []
+        self.send_times = []
+
+    def make_acquisition(self, repetition: int) -> ImageArray:
+        acquisition_header = ismrmrd.AcquisitionHeader()
+        acquisition_header.position[0] = 0.0
+        acquisition_header.position[1] = 0.0
+        acquisition_header.position[2] = 10.0 * repetition
+        acquisition_header.read_dir[0] = 1.0
+        acquisition_header.phase_dir[1] = 1.0
+        acq_headers = np.empty((1, 1, 1, 1, 1), dtype=object)
+        acq_headers[0, 0, 0, 0, 0] = acquisition_header
+
+        return ImageArray(
+            data=phantom.acquisition_data(self.sdim, repetition, self.motion),
+            acq_headers=acq_headers,
+        )
+
+    def __iter__(self) -> typing.Iterator[ImageArray]:
+        start = time.perf_counter()
+
+        for repetition in range(self.repetitions):
+            if self.frame_rate > 0:
+                delay = start + repetition / self.frame_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.yield_times.append(time.perf_counter())
+            yield self.acquisitions[repetition % len(self.acquisitions)]
+
+    def send(self, item) -> None:
+        self.send_times.append(time.perf_counter())
+        return None
+
+    @property
+    def latencies(self) -> np.ndarray:
+        """
+        Seconds between yielding each acquisition and its image being sent.
+        """
+        frames = min(len(self.yield_times), len(self.send_times))
+
+        return np.asarray(self.send_times[:frames]) - np.asarray(
+            self.yield_times[:frames]
+        )
+
+
+class DrainReceiver:
+    """
+    Local stand-in for the MLC tracking software. Accepts connections on a
+    port and discards what it receives, counting the bytes. Intended to work
+    in a context manager.
+    """
+
+    def __init__(self, hostname: str = "localhost", port: int = 0) -> None:
+        """
+        :param hostname: the address to listen on.
+        :param port: the port to listen on (0: any free port, see self.port).
+        """
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((hostname, port))
+        self.server.listen()
+        self.server.settimeout(0.1)
+        self.hostname, self.port = self.server.getsockname()
+        self.bytes_received = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        buffer = bytearray(1 << 20)
+        while not self._stop_event.is_set():
+            try:
+                client, _ = self.server.accept()
+            except socket.timeout:
+                continue
+
+            with client:
+                client.settimeout(0.1)
+                while not self._stop_event.is_set():
+                    try:
+                        received = client.recv_into(buffer)
+                    except socket.timeout:
+                        continue
+                    if not received:
+                        break
+                    self.bytes_received += received
+
+    def __enter__(self) -> "DrainReceiver":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self._stop_event.set()
+        self._thread.join()
+        self.server.close()
+        return None
@@ -0,0 +1,146 @@
+"""
+Runs each gadget's main end to end on CPU, driven by a fake Gadgetron
+connection yielding Shepp-Logan acquisitions, with the tracking gadgets
+sending to a local MLC receiver. Reports throughput, per-frame latency
+(acquisition yielded to image sent back), memory and per-stage medians for
+the passthrough, bicubic and EDSR variants with tracking off and on.
+
+python -m benchmarks.gadget_benchmark --frames 100 --frame-rate 0
+"""
+
+import os
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")  # CPU only, before torch loads.
+
+import argparse
+import importlib
+import logging
+import resource
+import time
+import warnings
+
+import numpy as np
+
+from modules import instrumentation
+
+from benchmarks.fake_gadgetron import DrainReceiver, FakeConnection
+from tools import stand_in_models
+
+# (variant, gadget module without tracking, gadget module with tracking)
+VARIANTS = (
+    ("passthrough", "passthroughGadget", "trackingGadget"),
+    ("bicubic", "bicubicGadget", "bicubicTrackingGadget"),
+    ("edsr", "edsrGadget", "edsrTrackingGadget"),
+)
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the gadgets end to end.")
+    parser.add_argument("--frames", "-n", type=int, default=100)
+    parser.add_argument("--warm-up", type=int, default=5)
+    parser.add_argument(
+        "--frame-rate",
+        type=float,
+        default=0.0,
+        help="Acquisition rate of the fake scanner (0: as fast as possible).",
+    )
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        default=[variant for variant, _, _ in VARIANTS],
+        choices=[variant for variant, _, _ in VARIANTS],
+    )
+    parser.add_argument(
+        "--parameters", default="", help="Directory with the real parameter files."
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def resident_memory() -> int:
+    """
+    Current resident set size of the process, in bytes.
+    """
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def run_gadget(gadget_name: str, args_dict: dict, receiver: DrainReceiver) -> dict:
+    """
+    Runs the main of one gadget module over a fake connection and returns the
+    results of the timed run (a shorter warm-up run precedes it).
+
+    :param gadget_name: the gadget module (e.g., "edsrTrackingGadget").
+    :param args_dict: the command line arguments.
+    :param receiver: the local MLC receiver the tracking gadgets send to.
+    """
+    gadget = importlib.import_module(gadget_name)
+    gadget.METRICS_EXPORT_PATH = None
+    if hasattr(gadget, "MLC_SOCKET_OPTIONS"):
+        gadget.MLC_SOCKET_OPTIONS = dict(
+            gadget.MLC_SOCKET_OPTIONS, hostname=receiver.hostname, port=receiver.port
+        )
+
+    gadget.main(FakeConnection(args_dict["warm_up"]))
+    instrumentation.METRICS.reset()
+
+    connection = FakeConnection(args_dict["frames"], frame_rate=args_dict["frame_rate"])
+    bytes_before = receiver.bytes_received
+    memory_before = resident_memory()
+
+    start = time.perf_counter()
+    gadget.main(connection)
+    elapsed = time.perf_counter() - start
+
+    latencies = connection.latencies
+
+    return {
+        "frames": len(connection.send_times),
+        "throughput": len(connection.send_times) / elapsed,
+        "latency": np.percentile(latencies, [50, 95, 99]),
+        "memory_delta": resident_memory() - memory_before,
+        "mlc_bytes": receiver.bytes_received - bytes_before,
+        "stages": instrumentation.METRICS.snapshot(),
+    }
+
+
+def report(gadget_name: str, results: dict) -> None:
+    p50, p95, p99 = 1e3 * results["latency"]
+    print(
+        f"{gadget_name:>22}: {results['frames']} frames, "
+        f"{results['throughput']:7.1f} frames/s, latency p50 {p50:6.2f} ms, "
+        f"p95 {p95:6.2f} ms, p99 {p99:6.2f} ms, "
+        f"RSS delta {results['memory_delta'] / 2**20:+.1f} MiB, "
+        f"MLC {results['mlc_bytes'] / 2**20:.1f} MiB sent"
+    )
+    stages = ", ".join(
+        f"{stage} {1e3 * summary['p50']:.2f}"
+        for stage, summary in sorted(results["stages"].items())
+    )
+    print(f"{'':>24}stage p50 (ms): {stages}")
+    return None
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)  # The gadgets log every frame.
+    warnings.simplefilter("ignore", (DeprecationWarning, FutureWarning))
+    stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+
+    with DrainReceiver() as receiver:
+        for variant, gadget_name, tracking_gadget_name in VARIANTS:
+            if variant not in args_dict["variants"]:
+                continue
+
+            for name in (gadget_name, tracking_gadget_name):
+                report(name, run_gadget(name, args_dict, receiver))
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    print(f"Peak RSS: {peak_memory:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Measures the overhead of timing a stage with the instrumentation module.
+
+python -m benchmarks.instrumentation_benchmark --samples 1000000
+"""
+
+import argparse
+import time
+
+from modules import instrumentation
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark stage timing overhead.")
+    parser.add_argument("--samples", "-n", type=int, default=1000000)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def main():
+    args_dict = parse_cmd_args()
+    samples = args_dict["samples"]
+    metrics = instrumentation.Metrics()
+
+    start = time.perf_counter()
+    for _ in range(samples):
+        pass
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(samples):
+        with metrics.time("stage"):
+            pass
+    timed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(samples):
+        metrics.record("stage", 1000)
+    recorded = time.perf_counter() - start
+
+    print(f"metrics.time overhead: {1e6 * (timed - baseline) / samples:.2f} us/stage")
+    print(f"metrics.record overhead: {1e6 * (recorded - baseline) / samples:.2f} us")
+    print(metrics.to_prometheus())
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
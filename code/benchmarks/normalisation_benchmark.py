@@ -0,0 +1,179 @@
+"""
+Compares the percentile and min-max normalisation helpers of
+normalisation_utils (np.percentile on a host copy; min_max_scaling with two
+reductions and temporary tensors) with the on-device estimates (kthvalue,
+histogram), the streaming PercentileScaleTracker (histogram estimate every
+few frames, smoothed with a moving average) and the in-place
+min_max_scaling_, over a simulated cine series with a drifting intensity. Reports the per-frame latency, the
+bytes allocated by torch per frame and the scale error relative to
+np.percentile of every frame.
+
+python -m benchmarks.normalisation_benchmark --sizes 64 128 256 --frames 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from modules import normalisation, normalisation_utils
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--frames", "-n", type=int, default=200)
+    parser.add_argument("--percentile", type=float, default=95)
+    parser.add_argument("--momentum", type=float, default=0.5)
+    parser.add_argument("--refresh-intervals", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument(
+        "--device", default="cuda:0" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def cine_frames(sdim: int, count: int, device: torch.device) -> list:
+    """
+    Magnitude frames of a moving disc on a noisy background, with the
+    intensity drifting by +-10% over the series.
+    """
+    grid = torch.linspace(-1, 1, sdim, device=device)
+    y, x = torch.meshgrid(grid, grid, indexing="ij")
+    frames = []
+    for i in range(count):
+        centre = 0.3 * np.sin(2 * np.pi * i / 50)
+        disc = ((x - centre) ** 2 + y**2 < 0.25).float()
+        noise = torch.rand(sdim, sdim, device=device)
+        drift = 1 + 0.1 * np.sin(2 * np.pi * i / count)
+        frames.append((1000 * drift * (disc + 0.2 * noise)).reshape(1, 1, sdim, sdim))
+
+    return frames
+
+
+def allocated_per_frame(function, frame: torch.Tensor) -> int:
+    with torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True
+    ) as profiler:
+        function(frame)
+
+    return sum(max(event.self_cpu_memory_usage, 0) for event in profiler.events())
+
+
+def run(function, frames: list) -> tuple:
+    """
+    Returns the per-frame time and the scale of every frame.
+    """
+    function(frames[0])  # Warm up.
+    scales = []
+    start = time.perf_counter()
+    for frame in frames:
+        scales.append(function(frame))
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / len(frames)
+
+    return elapsed, np.array([float(scale) for scale in scales])
+
+
+def main():
+    args_dict = parse_cmd_args()
+    device = torch.device(args_dict["device"])
+    percentile = args_dict["percentile"]
+
+    for sdim in args_dict["sizes"]:
+        frames = cine_frames(sdim, args_dict["frames"], device)
+        exact = np.array(
+            [
+                normalisation_utils.retrieve_percentile_scale_val(frame, percentile)
+                for frame in frames
+            ]
+        )
+
+        def numpy_percentile(frame: torch.Tensor) -> float:
+            scale_val = normalisation_utils.retrieve_percentile_scale_val(
+                frame, percentile
+            )
+            normalisation_utils.divide_tensor_by_scale_val(frame, scale_val)
+            return scale_val
+
+        def on_device(method: str):
+            def normalise(frame: torch.Tensor) -> torch.Tensor:
+                scale_val = normalisation_utils.retrieve_percentile_scale_tensor(
+                    frame, percentile, method
+                )
+                normalisation_utils.divide_tensor_by_scale_val(frame, scale_val)
+                return scale_val
+
+            return normalise
+
+        def streaming(refresh_interval: int):
+            tracker = normalisation.PercentileScaleTracker(
+                percentile,
+                momentum=args_dict["momentum"],
+                refresh_interval=refresh_interval,
+            )
+
+            def normalise(frame: torch.Tensor) -> torch.Tensor:
+                if frame is frames[0]:
+                    tracker.reset()  # A new series (or the warm-up).
+                normalisation_class = normalisation.PercentileNormalisation(
+                    frame, tracker
+                )
+                normalisation_class.apply_normalisation()
+                return normalisation_class.scale_val
+
+            return normalise
+
+        variants = {
+            "np.percentile": numpy_percentile,
+            "kthvalue": on_device("kthvalue"),
+            "histogram": on_device("histogram"),
+        }
+        for refresh_interval in args_dict["refresh_intervals"]:
+            label = f"streaming 1/{refresh_interval} ema {args_dict['momentum']}"
+            variants[label] = streaming(refresh_interval)
+
+        for label, function in variants.items():
+            elapsed, scales = run(function, frames)
+            error = np.abs(scales - exact) / exact
+            allocated = allocated_per_frame(function, frames[0])
+            print(
+                f"{sdim:>4}x{sdim:<4} {label:>30}: {1e3 * elapsed:.3f} ms/frame, "
+                f"{allocated / 2**10:7.1f} KiB allocated, scale error max "
+                f"{error.max():.2e} mean {error.mean():.2e}"
+            )
+
+        scaled = [frame.clone() for frame in frames]
+        expected = normalisation_utils.min_max_scaling(frames[0], 0, 1)
+        assert torch.equal(
+            expected, normalisation_utils.min_max_scaling_(scaled[0].clone(), 0, 1)
+        )
+
+        def out_of_place(frame: torch.Tensor) -> torch.Tensor:
+            return normalisation_utils.min_max_scaling(frame, 0, 1)
+
+        def in_place(frame: torch.Tensor) -> torch.Tensor:
+            return normalisation_utils.min_max_scaling_(frame, 0, 1)
+
+        for label, function in {
+            "min_max_scaling": out_of_place,
+            "min_max_scaling_ (in place)": in_place,
+        }.items():
+            start = time.perf_counter()
+            for frame in scaled:
+                function(frame)
+            elapsed = (time.perf_counter() - start) / len(scaled)
+            allocated = allocated_per_frame(function, scaled[0])
+            print(
+                f"{sdim:>4}x{sdim:<4} {label:>30}: {1e3 * elapsed:.3f} ms/frame, "
+                f"{allocated / 2**10:7.1f} KiB allocated, bit-identical"
+            )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
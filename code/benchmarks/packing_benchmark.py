@@ -0,0 +1,112 @@
+"""
+Compares the original per-field struct packing of MLC frames with
+MLCFramePacker, checking the output is byte-identical, and the per-frame cost
+of a full MLCStructmaker with and without the packer cache.
+
+python -m benchmarks.packing_benchmark --sizes 64 256 512
+"""
+
+import argparse
+import struct
+import time
+
+import numpy as np
+
+from modules.schemas.mlc_tracking import (
+    MLCFramePacker,
+    MLCPackerCache,
+    MLCStructmaker,
+)
+
+HEADER = (1.0, 2.0, 3.0, 5.0, 0.0, 1.0, 1.0, 256, 256)
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark MLC frame packing.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 512])
+    parser.add_argument("--repeats", "-r", type=int, default=50)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def pack_original(image: np.ndarray) -> bytes:
+    """
+    The packing used before MLCFramePacker: a struct with one H per pixel.
+    """
+    image_data = np.absolute(image.ravel()).astype(np.int16)
+    image_size = len(image_data)
+    packer = struct.Struct(2 * "I" + 7 * "d" + 2 * "i" + image_size * "H")
+
+    return packer.pack(MLCStructmaker.HEADERSIZE, 2 * image_size, *HEADER, *image_data)
+
+
+def make_structmaker(image: np.ndarray, packer_cache: MLCPackerCache) -> memoryview:
+    acquisition_data = {
+        "SlicePositionSagittal": 1.0,
+        "SlicePositionCoronal": 2.0,
+        "SlicePositionTransverse": 3.0,
+        "Width": image.shape[0],
+        "Height": image.shape[1],
+    }
+    connection_data = {"FOVX": 512.0, "FOVY": 256.0, "FOVZ": 5.0}
+    structmaker_class = MLCStructmaker(
+        acquisition_data,
+        connection_data,
+        image,
+        upsample_ratio=1,
+        packer_cache=packer_cache,
+    )
+
+    return structmaker_class.pack_struct()
+
+
+def time_per_frame(function, image: np.ndarray, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(image)
+
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    args_dict = parse_cmd_args()
+
+    for sdim in args_dict["sizes"]:
+        image = (4096 * np.random.rand(sdim, sdim, 1, 1)).astype(np.float32)
+        packer = MLCFramePacker(sdim * sdim)
+
+        def pack_buffer(image: np.ndarray) -> memoryview:
+            return packer.pack(HEADER, image)
+
+        assert bytes(pack_buffer(image)) == pack_original(image)
+
+        original = time_per_frame(pack_original, image, args_dict["repeats"])
+        buffered = time_per_frame(pack_buffer, image, args_dict["repeats"])
+
+        print(
+            f"{sdim}x{sdim}: original {1e3 * original:.3f} ms/frame, "
+            f"buffer {1e3 * buffered:.3f} ms/frame ({original / buffered:.0f}x), "
+            "byte-identical"
+        )
+
+        packer_cache = MLCPackerCache()
+        uncached = time_per_frame(
+            lambda image: make_structmaker(image, None), image, args_dict["repeats"]
+        )
+        cached = time_per_frame(
+            lambda image: make_structmaker(image, packer_cache),
+            image,
+            args_dict["repeats"],
+        )
+
+        print(
+            f"{sdim}x{sdim}: MLCStructmaker uncached {1e3 * uncached:.3f} ms/frame, "
+            f"cached {1e3 * cached:.3f} ms/frame, {packer_cache}"
+        )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compares the sequential gadget loop with the pipelined executor on CPU.
+
+The stages mirror edsrTrackingGadget: a magnitude/rotation pretransform, a
+small convolutional network standing in for the EDSR model, a posttransform,
+MLC struct packing and a send whose latency is simulated with a sleep (as a
+socket send releases the GIL in the same way).
+
+python -m benchmarks.pipeline_benchmark --frames 200 --queue-depth 2
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from modules import pipeline
+from modules.schemas.mlc_tracking import MLCStructmaker
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the pipelined executor.")
+    parser.add_argument("--frames", "-n", type=int, default=200)
+    parser.add_argument("--queue-depth", "-q", type=int, default=2)
+    parser.add_argument(
+        "--send-latency",
+        type=float,
+        default=2e-3,
+        help="Simulated socket send time per frame (seconds).",
+    )
+    parser.add_argument(
+        "--frame-rate",
+        type=float,
+        default=0.0,
+        help="Acquisition rate of the simulated scanner (0: as fast as possible).",
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def build_stages(send_latency: float) -> list:
+    torch.set_num_threads(1)  # Leave cores for the other stages.
+
+    network = torch.nn.Sequential(
+        torch.nn.Conv2d(1, 16, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(16, 16, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(16, 16, 3, padding=1),
+        torch.nn.PixelShuffle(4),
+    ).eval()
+
+    acquisition_data = {
+        "SlicePositionSagittal": 0.0,
+        "SlicePositionCoronal": 0.0,
+        "SlicePositionTransverse": 0.0,
+        "Width": 64,
+        "Height": 64,
+    }
+    connection_data = {"FOVX": 256.0, "FOVY": 256.0, "FOVZ": 5.0}
+
+    def pretransform(data):
+        magnitude = np.absolute(data.reshape(data.shape[0], data.shape[1]))
+        return torch.from_numpy(np.rot90(magnitude, 2).copy())[None, None]
+
+    def infer(tensor_data):
+        with torch.no_grad():
+            return network(tensor_data)
+
+    def posttransform(tensor_data):
+        return tensor_data.reshape(256, 256, 1, 1).numpy()
+
+    def pack(image):
+        structmaker_class = MLCStructmaker(
+            dict(acquisition_data), dict(connection_data), image, upsample_ratio=4
+        )
+        return structmaker_class.pack_struct()
+
+    def send(packed_struct):
+        time.sleep(send_latency)
+
+    return [
+        ("pretransform", pretransform),
+        ("inference", infer),
+        ("posttransform", posttransform),
+        ("pack", pack),
+        ("send", send),
+    ]
+
+
+def paced(frames: list, frame_rate: float):
+    """
+    Yields the frames at the given rate, like acquisitions arriving from the
+    scanner. Latency is measured from the moment a frame is yielded.
+    """
+    start = time.perf_counter()
+
+    for index, frame in enumerate(frames):
+        if frame_rate > 0:
+            delay = start + index / frame_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        yield frame
+
+
+def main():
+    args_dict = parse_cmd_args()
+    stages = build_stages(args_dict["send_latency"])
+
+    frames = [
+        (1000 * np.random.rand(64, 64, 1, 1)).astype(np.complex64)
+        for _ in range(args_dict["frames"])
+    ]
+
+    pipeline.SequentialExecutor(stages).run(frames[:10])  # Warm-up.
+
+    sequential = pipeline.SequentialExecutor(stages).run(
+        paced(frames, args_dict["frame_rate"])
+    )
+    pipelined = pipeline.PipelinedExecutor(
+        stages, queue_depth=args_dict["queue_depth"]
+    ).run(paced(frames, args_dict["frame_rate"]))
+
+    print(f"Sequential: {sequential.summary()}")
+    print(f"Pipelined (queue depth {args_dict['queue_depth']}): {pipelined.summary()}")
+    print(f"Throughput speedup: {pipelined.throughput / sequential.throughput:.2f}x")
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
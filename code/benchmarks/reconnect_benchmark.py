@@ -0,0 +1,238 @@
+"""
+Restarts the MLC tracking software in the middle of a stream and checks the
+feed recovers: a test receiver (test/mlc_receiver.py, in a separate Python
+process) is killed after the first frames and a new one is started on the
+same port, while an MLCSocketmaker with reconnect enabled keeps sending, for
+synchronous and asynchronous sends of raw and zlib compressed frames. Each
+frame carries its number in the SlicePositionSagittal field. Checks every
+frame sent once the new connection is up arrives, in order, and decodes to
+the image sent (compressed again if compression is on), and reports the
+time to reconnect and the frames dropped.
+
+python -m benchmarks.reconnect_benchmark --frames 60
+"""
+
+import argparse
+import os
+import pickle
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from modules.phantom import shepp_logan
+from modules.schemas.mlc_tracking import MLCFramePacker, MLCSocketmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "test"))
+
+from mlc_receiver import MLCReceiver  # noqa: E402
+
+MODES = {
+    "sync raw": {},
+    "sync zlib": {"compression": "zlib"},
+    "async raw": {"asynchronous": True},
+    "async zlib": {"asynchronous": True, "compression": "zlib"},
+}
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modes", nargs="+", default=list(MODES))
+    parser.add_argument("--sdim", type=int, default=64)
+    parser.add_argument(
+        "--frames", "-n", type=int, default=60, help="Frames sent after the restart."
+    )
+    parser.add_argument(
+        "--frames-before", type=int, default=30, help="Frames sent before the kill."
+    )
+    parser.add_argument(
+        "--downtime", type=float, default=0.5, help="Seconds without a receiver."
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.01, help="Seconds between frames."
+    )
+    parser.add_argument("--timeout", type=float, default=10.0)
+    # Used by the benchmark to start a receiver.
+    parser.add_argument("--receive", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--results", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def make_image(sdim: int, number: int) -> np.ndarray:
+    """
+    The uint16 image of frame number (a phantom moving with a period of 20
+    frames), made the same way by the sender and the receiver.
+    """
+    shift = (0.02 * np.sin(2 * np.pi * number / 20), 0.0)
+
+    return (2000.0 * shepp_logan(sdim, shift)).astype(np.uint16)
+
+
+def run_receiver(args_dict: dict) -> None:
+    """
+    Receives the frames of one connection, printing the port once listening,
+    and pickles the frame numbers received, the number of decoded images
+    that differ from the image sent and the number of compressed frames to
+    the results path.
+    """
+    sdim = args_dict["sdim"]
+    numbers = []
+    mismatches = 0
+
+    def on_frame(counter, header, image):
+        nonlocal mismatches
+        number = int(header["SlicePositionSagittal"])
+        numbers.append(number)
+        mismatches += not np.array_equal(image, make_image(sdim, number))
+
+    with MLCReceiver("localhost", args_dict["port"], sdim, on_frame) as receiver:
+        print(receiver.port, flush=True)
+        receiver.serve(max_connections=1)
+
+    with open(args_dict["results"], "wb") as results:
+        pickle.dump(
+            (numbers, mismatches, receiver.statistics.compressed_frames), results
+        )
+
+    return None
+
+
+def start_receiver(args_dict: dict, port: int, results_path: str) -> tuple:
+    """
+    Starts a receiver in a separate interpreter, as the MLC tracking software
+    would be, and returns the process and the port it listens on.
+    """
+    receiver = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.reconnect_benchmark", "--receive"]
+        + ["--sdim", str(args_dict["sdim"]), "--port", str(port)]
+        + ["--results", results_path],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    return receiver, int(receiver.stdout.readline())
+
+
+def run(options: dict, args_dict: dict) -> dict:
+    """
+    Streams to a receiver, kills it, streams while it is away, starts a new
+    one on the same port and streams until reconnected, then sends the
+    checked frames. Returns the results of the new receiver and the
+    connection statistics.
+    """
+    sdim, interval = args_dict["sdim"], args_dict["interval"]
+    results_path = os.path.join(tempfile.gettempdir(), f"mlc_reconnect_{os.getpid()}")
+    packer = MLCFramePacker(sdim * sdim)
+    number = 0
+
+    def send(socketmaker) -> None:
+        nonlocal number
+        header = (float(number), 0.0, 0.0, 5.0, 0.0, 1.0, 1.0, sdim, sdim)
+        socketmaker.send_packed_struct(packer.pack(header, make_image(sdim, number)))
+        number += 1
+        time.sleep(interval)
+        return None
+
+    first_receiver, port = start_receiver(args_dict, 0, results_path)
+    socketmaker = MLCSocketmaker(
+        "localhost",
+        port,
+        reconnect=True,
+        backoff_initial=0.05,
+        backoff_max=0.2,
+        overflow_policy="block",  # Only the restart may lose frames.
+        **options,
+    )
+    with socketmaker as MLCsm:
+        MLCsm.create_socketclient()
+        MLCsm.connect_socketclient()
+
+        for _ in range(args_dict["frames_before"]):
+            send(MLCsm)
+
+        first_receiver.send_signal(signal.SIGKILL)
+        first_receiver.wait()
+        first_receiver.stdout.close()
+
+        restart = time.perf_counter() + args_dict["downtime"]
+        while time.perf_counter() < restart:
+            send(MLCsm)
+
+        second_receiver, _ = start_receiver(args_dict, port, results_path)
+        restart = time.perf_counter()
+        while MLCsm.connection_statistics.connects < 2:
+            if time.perf_counter() - restart > args_dict["timeout"]:
+                second_receiver.kill()
+                raise TimeoutError("Did not reconnect to the new receiver")
+            send(MLCsm)
+        reconnect_time = time.perf_counter() - restart
+
+        # Frames queued before the reconnect may still arrive, so only the
+        # frames from here on are checked.
+        first_checked = number
+        for _ in range(args_dict["frames"]):
+            send(MLCsm)
+
+    # The receiver stops once the connection is closed.
+    second_receiver.wait(timeout=args_dict["timeout"])
+    second_receiver.stdout.close()
+
+    with open(results_path, "rb") as results:
+        numbers, mismatches, compressed = pickle.load(results)
+    os.unlink(results_path)
+
+    checked = [received for received in numbers if received >= first_checked]
+
+    return {
+        "received": len(checked),
+        "in_order": checked == list(range(first_checked, number)),
+        "mismatches": mismatches,
+        "raw": len(numbers) - compressed,
+        "reconnect_time": reconnect_time,
+        "statistics": MLCsm.connection_statistics,
+    }
+
+
+def main():
+    args_dict = parse_cmd_args()
+    if args_dict["receive"]:
+        run_receiver(args_dict)
+        return None
+
+    failures = 0
+    for mode in args_dict["modes"]:
+        results = run(MODES[mode], args_dict)
+        statistics = results["statistics"]
+        passed = (
+            results["received"] == args_dict["frames"]
+            and results["in_order"]
+            and results["mismatches"] == 0
+            and ("compression" not in MODES[mode] or results["raw"] == 0)
+        )
+        failures += not passed
+        print(
+            f"{mode:>10}: {'ok' if passed else 'FAILED'}, "
+            f"{results['received']}/{args_dict['frames']} frames after the restart "
+            f"({'in order' if results['in_order'] else 'out of order'}), "
+            f"{results['mismatches']} decoded images differ, {results['raw']} "
+            f"raw, reconnected "
+            f"{1e3 * results['reconnect_time']:.0f} ms after the restart, "
+            f"{statistics.dropped_while_disconnected} frames dropped while "
+            f"disconnected"
+        )
+
+    if failures:
+        sys.exit(f"{failures} of {len(args_dict['modes'])} modes failed")
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Compares sending the full image to the MLC tracking software with a fixed
+and a re-centred MLCRegionOfInterest, over a Shepp-Logan phantom with a
+bright target moving like a breathing motion. Checks the cropped payload is
+the window of the full payload and that the window can be located from the
+slice position sent, and reports the bytes per frame, the median pack
+(MLCStructmaker) and send (TCP loopback) time per frame and the smallest
+fraction of the target inside the window over the series.
+
+python -m benchmarks.roi_benchmark --sizes 64 256 --frames 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from modules.phantom import shepp_logan
+from modules.schemas.mlc_tracking import (
+    MLCFramePacker,
+    MLCPackerCache,
+    MLCRegionOfInterest,
+    MLCSocketmaker,
+    MLCStructmaker,
+)
+
+from benchmarks.fake_gadgetron import DrainReceiver
+
+CONNECTION_DATA = {"FOVX": 512.0, "FOVY": 256.0, "FOVZ": 5.0}
+ORIENTATION_DATA = {"ReadDirection": (1.0, 0.0, 0.0), "PhaseDirection": (0.0, 1.0, 0.0)}
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--frames", "-n", type=int, default=200)
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=0.375,
+        help="Width and height of the window, as a fraction of the image size.",
+    )
+    parser.add_argument(
+        "--amplitude",
+        type=float,
+        default=0.3,
+        help="Amplitude of the target motion, as a fraction of the FOV.",
+    )
+    parser.add_argument("--momentum", type=float, default=0.5)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def moving_target(sdim: int, count: int, amplitude: float) -> tuple:
+    """
+    Returns the frames (float32, as sent by the SR gadgets) of a phantom with
+    a bright disc moving along the first axis, and the masks of the disc.
+    """
+    phantom = shepp_logan(sdim)
+    coordinates = np.linspace(-1.0, 1.0, sdim)
+    first, second = np.meshgrid(coordinates, coordinates, indexing="ij")
+    frames, masks = [], []
+    for index in range(count):
+        centre = 2 * amplitude * np.sin(2 * np.pi * index / 40)
+        mask = (first - centre) ** 2 + (second - 0.1) ** 2 < 0.08**2
+        frames.append((1000.0 * (phantom + 2.0 * mask)).astype(np.float32))
+        masks.append(mask)
+
+    return frames, masks
+
+
+def make_structmaker(image: np.ndarray, packer_cache, region_of_interest):
+    acquisition_data = {
+        "SlicePositionSagittal": 0.0,
+        "SlicePositionCoronal": 0.0,
+        "SlicePositionTransverse": 10.0,
+        "Width": image.shape[0],
+        "Height": image.shape[1],
+    }
+
+    return MLCStructmaker(
+        acquisition_data,
+        dict(CONNECTION_DATA),
+        image,
+        upsample_ratio=1,
+        packer_cache=packer_cache,
+        region_of_interest=region_of_interest,
+        orientation_data=ORIENTATION_DATA,
+    )
+
+
+def locate_window(header: tuple, shape: tuple) -> tuple:
+    """
+    Returns the origin of the window in the image, from the slice position
+    and size in the header (as the tracker would place it).
+    """
+    _, _, _, _, _, voxel_size_x, voxel_size_y, width, height = header
+    offsets = (
+        -header[0] / voxel_size_x,  # The read direction is the first axis.
+        -header[1] / voxel_size_y,  # The phase direction is the second axis.
+    )
+
+    return tuple(
+        int(round(offset - (length - limit) / 2))
+        for offset, length, limit in zip(offsets, (width, height), shape)
+    )
+
+
+def run(frames: list, masks: list, region_of_interest, port: int) -> dict:
+    """
+    Packs and sends every frame. Returns the bytes per frame, the median pack
+    and send time per frame, and the smallest fraction of the target sent.
+    """
+    packer_cache = MLCPackerCache()
+    full_packer_cache = MLCPackerCache()
+    pack_times, send_times = [], []
+    coverage = 1.0
+    with MLCSocketmaker("localhost", port) as MLCsm:
+        MLCsm.create_socketclient()
+        MLCsm.connect_socketclient()
+        for image, mask in zip(frames, masks):
+            start = time.perf_counter()
+            structmaker_class = make_structmaker(
+                image, packer_cache, region_of_interest
+            )
+            packed_struct = structmaker_class.pack_struct()
+            pack_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            MLCsm.send_packed_struct(packed_struct)
+            send_times.append(time.perf_counter() - start)
+
+            row, column = locate_window(structmaker_class.header, image.shape)
+            width, height = structmaker_class.header[-2:]
+            assert (row, column) == structmaker_class.image_origin
+
+            full = make_structmaker(image, full_packer_cache, None).pack_struct()
+            full_image = np.frombuffer(
+                full[MLCFramePacker.HEADER.size :], np.uint16
+            ).reshape(image.shape)
+            window = np.frombuffer(
+                packed_struct[MLCFramePacker.HEADER.size :], np.uint16
+            )
+            assert np.array_equal(
+                window.reshape(width, height),
+                full_image[row : row + width, column : column + height],
+            )
+
+            inside = mask[row : row + width, column : column + height].sum()
+            coverage = min(coverage, inside / mask.sum())
+
+    return {
+        "bytes": len(packed_struct),
+        "pack": np.median(pack_times),
+        "send": np.median(send_times),
+        "coverage": coverage,
+    }
+
+
+def main():
+    args_dict = parse_cmd_args()
+
+    with DrainReceiver() as receiver:
+        for sdim in args_dict["sizes"]:
+            frames, masks = moving_target(
+                sdim, args_dict["frames"], args_dict["amplitude"]
+            )
+            window = max(1, int(round(args_dict["window"] * sdim)))
+            variants = {
+                "full image": None,
+                f"fixed {window}x{window}": MLCRegionOfInterest((window, window)),
+                f"re-centred {window}x{window}": MLCRegionOfInterest(
+                    (window, window), recentre=True, momentum=args_dict["momentum"]
+                ),
+            }
+
+            full = None
+            for label, region_of_interest in variants.items():
+                results = run(frames, masks, region_of_interest, receiver.port)
+                if full is None:
+                    full = results
+                print(
+                    f"{sdim:>4}x{sdim:<4} {label:>18}: "
+                    f"{results['bytes']:7d} bytes/frame "
+                    f"({results['bytes'] / full['bytes']:6.1%}), pack "
+                    f"{1e6 * results['pack']:6.1f} us "
+                    f"({results['pack'] / full['pack']:6.1%}), send "
+                    f"{1e6 * results['send']:6.1f} us "
+                    f"({results['send'] / full['send']:6.1%}), target sent "
+                    f"{results['coverage']:6.1%} (worst frame)"
+                )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
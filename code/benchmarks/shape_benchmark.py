@@ -0,0 +1,66 @@
+"""
+Runs the bicubic and EDSR gadgets over a sequence of scans with different
+matrix sizes (as when switching protocols between scans), each scan a new
+fake Gadgetron connection. Reports the start-up time of each scan (main
+called to first image sent back) and its per-frame latency, showing that a
+matrix size is only warmed up the first time it is seen.
+
+python -m benchmarks.shape_benchmark --matrix-sizes 64 128 64 96 128
+"""
+
+import os
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")  # CPU only, before torch loads.
+
+import argparse
+import importlib
+import logging
+import time
+import warnings
+
+import numpy as np
+
+from benchmarks.fake_gadgetron import FakeConnection
+from tools import stand_in_models
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", "-n", type=int, default=10)
+    parser.add_argument(
+        "--matrix-sizes", type=int, nargs="+", default=[64, 128, 64, 96, 128]
+    )
+    parser.add_argument("--gadgets", nargs="+", default=["bicubicGadget", "edsrGadget"])
+    parser.add_argument(
+        "--parameters", default="", help="Directory with the real parameter files."
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)  # The gadgets log every frame.
+    warnings.simplefilter("ignore", (DeprecationWarning, FutureWarning))
+    stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+
+    for gadget_name in args_dict["gadgets"]:
+        gadget = importlib.import_module(gadget_name)
+        gadget.METRICS_EXPORT_PATH = None
+
+        for scan, matrix_size in enumerate(args_dict["matrix_sizes"]):
+            connection = FakeConnection(args_dict["frames"], sdim=matrix_size)
+
+            start = time.perf_counter()
+            gadget.main(connection)
+
+            print(
+                f"{gadget_name:>14} scan {scan} {matrix_size:>4}x{matrix_size:<4}: "
+                f"start-up {1e3 * (connection.send_times[0] - start):8.2f} ms, "
+                f"latency p50 {1e3 * np.median(connection.latencies):7.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Compares the original per-frame staging of the EDSR gadget (copy of the
+Gadgetron array, numpy to torch, magnitude, rotation, and the host copy of
+the inferred image) with the staging buffer pool, around a stand-in output.
+Checks the pretransformed tensors are bit-identical and reports the per-frame
+latency, the bytes allocated per frame by torch (profiler) and numpy
+(tracemalloc), and the pool allocations in the steady state.
+
+python -m benchmarks.staging_benchmark --sizes 64 128 --frames 200
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+
+from modules import staging
+from modules.schemas.edsr_sr import EdsrPretransformations, EdsrPosttransformations
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--frames", "-n", type=int, default=200)
+    parser.add_argument(
+        "--device", default="cuda:0" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def stage_original(data: np.ndarray, output: torch.Tensor, device) -> tuple:
+    """
+    The staging used before the pool: a copy of the Gadgetron array and new
+    tensors for every step.
+    """
+    data_cp = np.copy(data)
+    image = EdsrPretransformations(data_cp, device).pretransform()
+    image_inferred = EdsrPosttransformations(output).posttransform()
+
+    return image, image_inferred
+
+
+def stage_pooled(data: np.ndarray, output: torch.Tensor, device, buffer_pool) -> tuple:
+    image = EdsrPretransformations(data, device, buffer_pool).pretransform()
+    image_inferred = EdsrPosttransformations(output, buffer_pool).posttransform()
+
+    return image, image_inferred
+
+
+def allocated_per_frame(function, data: np.ndarray) -> tuple:
+    """
+    Bytes allocated by torch (sum of the profiled allocations) and by numpy
+    (tracemalloc peak) while staging one frame.
+    """
+    with torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True
+    ) as profiler:
+        function(data)
+    torch_bytes = sum(
+        max(event.self_cpu_memory_usage, 0) for event in profiler.key_averages()
+    )
+
+    tracemalloc.start()
+    function(data)
+    _, numpy_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return torch_bytes, numpy_bytes
+
+
+def time_per_frame(function, frames: list) -> float:
+    start = time.perf_counter()
+    for data in frames:
+        function(data)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+    return (time.perf_counter() - start) / len(frames)
+
+
+def main():
+    args_dict = parse_cmd_args()
+    device = torch.device(args_dict["device"])
+
+    for sdim in args_dict["sizes"]:
+        shape = (sdim, sdim, 1, 1, 1, 1, 1)
+        frames = [
+            (4096 * np.random.rand(*shape) + 4096j * np.random.rand(*shape)).astype(
+                np.complex64
+            )
+            for _ in range(8)
+        ] * (args_dict["frames"] // 8)
+        output = torch.rand(1, 1, 4 * sdim, 4 * sdim, device=device)
+        buffer_pool = staging.StagingBufferPool()
+
+        def original(data: np.ndarray) -> tuple:
+            return stage_original(data, output, device)
+
+        def pooled(data: np.ndarray) -> tuple:
+            return stage_pooled(data, output, device, buffer_pool)
+
+        for data in frames[:8]:
+            expected, _ = original(data)
+            image, _ = pooled(data)
+            assert torch.equal(expected, image)
+
+        allocations = buffer_pool.allocations
+        original_time = time_per_frame(original, frames)
+        pooled_time = time_per_frame(pooled, frames)
+        steady_allocations = (buffer_pool.allocations - allocations) / len(frames)
+
+        original_torch, original_numpy = allocated_per_frame(original, frames[0])
+        pooled_torch, pooled_numpy = allocated_per_frame(pooled, frames[0])
+
+        print(
+            f"{sdim}x{sdim} on {device}: original {1e3 * original_time:.3f} "
+            f"ms/frame, {original_torch / 2**10:.1f} KiB torch + "
+            f"{original_numpy / 2**10:.1f} KiB numpy allocated; pooled "
+            f"{1e3 * pooled_time:.3f} ms/frame, {pooled_torch / 2**10:.1f} KiB "
+            f"torch + {pooled_numpy / 2**10:.1f} KiB numpy allocated, "
+            f"{steady_allocations:.0f} pool allocations/frame "
+            f"({original_time / pooled_time:.1f}x), bit-identical"
+        )
+        print(f"{'':>10}{buffer_pool}")
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compares whole-image EDSR inference of larger matrices (e.g., 128x128 and
+192x192) with tiled inference on CPU: reports the per-frame latency, the
+peak memory allocated by torch during a frame and the error of the blended
+output relative to the output range of the whole-image inference.
+
+python -m benchmarks.tiling_benchmark --matrix-sizes 128 192 --tile-sizes 64 96
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import torch
+
+from modules import model_utils
+from modules.schemas.edsr_sr import EDSR_ENGINES
+
+from tools import stand_in_models
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--warm-up", type=int, default=2)
+    parser.add_argument("--matrix-sizes", type=int, nargs="+", default=[128, 192])
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[64, 96])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--tile-batch-size", type=int, default=4)
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument(
+        "--parameters", default="", help="Directory with the real parameter files."
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def time_inference(model, frames: list, warm_up: int) -> tuple:
+    """
+    Returns the output for the first frame and the per-frame latencies.
+
+    :param model: the loaded model.
+    :param frames: the input tensors.
+    :param warm_up: number of untimed frames run first.
+    """
+    with torch.no_grad():
+        for frame in frames[:warm_up]:
+            model.perform_inference(frame)
+
+        latencies = []
+        for frame in frames:
+            start = time.perf_counter()
+            model.perform_inference(frame)
+            latencies.append(time.perf_counter() - start)
+
+        output = model.perform_inference(frames[0])
+
+    return output, np.asarray(latencies)
+
+
+def peak_memory(model, frame: torch.Tensor) -> int:
+    """
+    Peak bytes allocated by torch during the inference of one frame, from the
+    profiled allocations and frees in chronological order.
+
+    :param model: the loaded model.
+    :param frame: the input tensor.
+    """
+    with torch.no_grad(), torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True
+    ) as profiler:
+        model.perform_inference(frame)
+
+    allocated = peak = 0
+    for event in sorted(profiler.events(), key=lambda event: event.time_range.start):
+        allocated += event.self_cpu_memory_usage
+        peak = max(peak, allocated)
+
+    return peak
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)
+    stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+    model_utils.set_thread_counts(args_dict["intra_op_threads"])
+
+    model_class, model_name = EDSR_ENGINES["torchscript"]
+    device = torch.device("cpu")
+    whole_image = model_class(device, model_name)
+
+    for matrix_size in args_dict["matrix_sizes"]:
+        torch.manual_seed(0)
+        frames = [
+            torch.rand(1, 1, matrix_size, matrix_size)
+            for _ in range(args_dict["frames"])
+        ]
+
+        reference, latencies = time_inference(whole_image, frames, args_dict["warm_up"])
+        output_range = float(reference.max() - reference.min())
+        print(
+            f"{matrix_size:>4}x{matrix_size:<4} {'whole image':>22}: "
+            f"p50 {1e3 * np.median(latencies):8.2f} ms, "
+            f"peak {peak_memory(whole_image, frames[0]) / 2**20:7.2f} MiB"
+        )
+
+        for tile_size in args_dict["tile_sizes"]:
+            for overlap in args_dict["overlaps"]:
+                if tile_size >= matrix_size or overlap >= tile_size:
+                    continue
+
+                tiled = model_class(
+                    device,
+                    model_name,
+                    tile_size=tile_size,
+                    tile_overlap=overlap,
+                    tile_batch_size=args_dict["tile_batch_size"],
+                )
+                output, latencies = time_inference(tiled, frames, args_dict["warm_up"])
+                error = (output - reference).abs()
+
+                label = f"tiles {tile_size} overlap {overlap}"
+                print(
+                    f"{matrix_size:>4}x{matrix_size:<4} {label:>22}: "
+                    f"p50 {1e3 * np.median(latencies):8.2f} ms, "
+                    f"peak {peak_memory(tiled, frames[0]) / 2**20:7.2f} MiB, "
+                    f"relative error max {float(error.max()) / output_range:.2e} "
+                    f"mean {float(error.mean()) / output_range:.2e}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares the original transformation of the tracking gadget (copy of the
+Gadgetron array, reshape, rot90, then ravel, magnitude and int16 conversion
+when packing) with the planned one (one strided view, materialised with a
+single fused magnitude and conversion into a preallocated payload). Checks
+the outputs are bit-identical and reports the per-frame time and the bytes
+allocated per frame (tracemalloc, which numpy reports its arrays to).
+
+python -m benchmarks.transformation_benchmark --sizes 64 256 512
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from modules import transformation_utils
+from modules.schemas.base_image_array import BaseImageArrayTransformations
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 512])
+    parser.add_argument("--repeats", "-r", type=int, default=200)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def transform_original(data: np.ndarray) -> np.ndarray:
+    """
+    The transformation and payload conversion used before TransformationPlan.
+    """
+    data_cp = np.copy(data)
+    transformed_data = transformation_utils.reshape_numpy(data_cp, data_cp.shape[:4])
+    transformed_data = transformation_utils.rotate_numpy(
+        transformed_data, num_rotation=2, axes=(0, 1)
+    )
+
+    return np.absolute(transformed_data.ravel()).astype(np.int16)
+
+
+def allocated_per_frame(function, data: np.ndarray) -> int:
+    """
+    Peak bytes allocated (and freed or kept) while transforming one frame.
+    """
+    function(data)  # Allocate any lazily created buffers first.
+
+    tracemalloc.start()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+def time_per_frame(function, data: np.ndarray, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(data)
+
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    args_dict = parse_cmd_args()
+
+    for sdim in args_dict["sizes"]:
+        shape = (sdim, sdim, 1, 1, 1, 1, 1)
+        data = (4096 * np.random.rand(*shape) + 4096j * np.random.rand(*shape)).astype(
+            np.complex64
+        )
+        payload = np.empty(sdim * sdim, dtype=np.int16)
+        plan = transformation_utils.TransformationPlan(magnitude=True)
+
+        def transform_planned(data: np.ndarray) -> np.ndarray:
+            image = BaseImageArrayTransformations(data).transform()
+
+            return plan.materialise(image, out=payload)
+
+        original = transform_original(data)
+        planned = transform_planned(data)
+        assert np.array_equal(original, planned.ravel())
+        assert original.tobytes() == planned.tobytes()
+
+        original_time = time_per_frame(transform_original, data, args_dict["repeats"])
+        planned_time = time_per_frame(transform_planned, data, args_dict["repeats"])
+
+        print(
+            f"{sdim}x{sdim}: original {1e3 * original_time:.3f} ms/frame, "
+            f"{allocated_per_frame(transform_original, data) / 2**10:.1f} KiB "
+            f"allocated; planned {1e3 * planned_time:.3f} ms/frame, "
+            f"{allocated_per_frame(transform_planned, data) / 2**10:.1f} KiB "
+            f"allocated ({original_time / planned_time:.1f}x), bit-identical"
+        )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Compares the MLC tracking transports with the same frame format: TCP
+loopback and an AF_UNIX stream socket (MLCSocketmaker) and the shared memory
+ring (MLCSharedMemorySocketmaker), each received by the matching receiver of
+test/mlc_receiver.py in a separate Python process. The send time is carried in the
+SlicePositionSagittal field of each frame (time.perf_counter is the same
+monotonic clock in both processes). Reports the one-way latency of frames
+sent at a fixed interval, and the throughput of frames sent back to back
+(the shared memory ring does not block the sender, so a slower receiver
+misses frames instead).
+
+python -m benchmarks.transport_benchmark --sizes 64 256 --frames 500
+"""
+
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+import numpy as np
+
+from modules.schemas.mlc_tracking import (
+    MLCFramePacker,
+    MLCSharedMemorySocketmaker,
+    MLCSocketmaker,
+)
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "test"))
+
+from mlc_receiver import MLCReceiver, MLCSharedMemoryReceiver  # noqa: E402
+
+TRANSPORTS = ("tcp", "unix", "shm")
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--transports", nargs="+", default=list(TRANSPORTS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--frames", "-n", type=int, default=500)
+    parser.add_argument(
+        "--interval", type=float, default=0.002, help="Seconds between frames."
+    )
+    parser.add_argument("--slot-count", type=int, default=8)
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1e-4,
+        help="Shared memory receiver sleep between polls (0 spins).",
+    )
+    # Used by the benchmark to start the receiver of one run.
+    parser.add_argument("--receive", choices=TRANSPORTS, help=argparse.SUPPRESS)
+    parser.add_argument("--address", help=argparse.SUPPRESS)
+    parser.add_argument("--results", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def run_receiver(args_dict: dict) -> None:
+    """
+    Receives the frames of one sender, printing the port once listening, and
+    pickles (latencies, statistics) to the results path.
+    """
+    transport, address, sdim = (
+        args_dict["receive"],
+        args_dict["address"],
+        args_dict["sizes"][0],
+    )
+    latencies = array("d")
+
+    def on_frame(counter, header, image):
+        latencies.append(time.perf_counter() - header["SlicePositionSagittal"])
+
+    if transport == "shm":
+        receiver = MLCSharedMemoryReceiver(
+            address,
+            sdim,
+            on_frame,
+            slot_count=args_dict["slot_count"],
+            poll_interval=args_dict["poll_interval"],
+        )
+    elif transport == "unix":
+        receiver = MLCReceiver(sdim=sdim, on_frame=on_frame, socket_path=address)
+    else:
+        receiver = MLCReceiver("localhost", 0, sdim, on_frame)
+
+    with receiver:
+        print(None if transport == "shm" else receiver.port, flush=True)
+        if transport == "shm":
+            receiver.serve(args_dict["frames"], timeout=1.0)
+        else:
+            receiver.serve(max_connections=1)
+
+    with open(args_dict["results"], "wb") as results:
+        pickle.dump((np.frombuffer(latencies), receiver.statistics), results)
+
+    return None
+
+
+def send_frames(socketmaker, sdim: int, frames: int, interval: float) -> float:
+    """
+    Sends frames (stamped with their send time) every interval seconds, or
+    back to back if interval is 0. Returns the mean send call time.
+    """
+    packer = MLCFramePacker(sdim * sdim, buffer_count=2)
+    image = (4096 * np.random.rand(sdim, sdim)).astype(np.complex64)
+    for _ in range(2):
+        packer.pack((0.0, 0.0, 0.0, 5.0, 0.0, 1.0, 1.0, sdim, sdim), image)
+
+    send_time = 0.0
+    next_send = time.perf_counter()
+    for _ in range(frames):
+        # Sleep, not spin, so the receiver can run on a machine with few cores.
+        time.sleep(max(next_send - time.perf_counter(), 0.0))
+        next_send += interval
+
+        start = time.perf_counter()
+        index = packer.pack_header((start, 0.0, 0.0, 5.0, 0.0, 1.0, 1.0, sdim, sdim))
+        socketmaker.send_packed_struct(packer.frames[index])
+        send_time += time.perf_counter() - start
+
+    return send_time / frames
+
+
+def run(transport: str, sdim: int, interval: float, args_dict: dict) -> tuple:
+    # A separate interpreter, as the MLC tracking software would be (it also
+    # keeps the shared memory ring out of this process's resource tracker).
+    address = {
+        "tcp": None,
+        "unix": os.path.join(
+            tempfile.gettempdir(), f"mlc_benchmark_{os.getpid()}.sock"
+        ),
+        "shm": f"mlc_benchmark_{os.getpid()}",
+    }[transport]
+    results_path = os.path.join(tempfile.gettempdir(), f"mlc_benchmark_{os.getpid()}")
+    with subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.transport_benchmark"]
+        + ["--receive", transport, "--address", str(address)]
+        + ["--sizes", str(sdim), "--frames", str(args_dict["frames"])]
+        + ["--slot-count", str(args_dict["slot_count"])]
+        + ["--poll-interval", str(args_dict["poll_interval"])]
+        + ["--results", results_path],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True,
+    ) as receiver:
+        port = receiver.stdout.readline().strip()
+
+        if transport == "shm":
+            socketmaker = MLCSharedMemorySocketmaker(address, reconnect=False)
+        elif transport == "unix":
+            socketmaker = MLCSocketmaker(socket_path=address)
+        else:
+            socketmaker = MLCSocketmaker("localhost", int(port))
+
+        with socketmaker:
+            socketmaker.create_socketclient()
+            socketmaker.connect_socketclient()
+            start = time.perf_counter()
+            send_time = send_frames(socketmaker, sdim, args_dict["frames"], interval)
+
+        receiver.wait(timeout=60)
+
+    with open(results_path, "rb") as results:
+        latencies, statistics = pickle.load(results)
+    os.unlink(results_path)
+
+    return start, send_time, latencies, statistics
+
+
+def main():
+    args_dict = parse_cmd_args()
+    if args_dict["receive"] is not None:
+        run_receiver(args_dict)
+        return None
+
+    for sdim in args_dict["sizes"]:
+        for transport in args_dict["transports"]:
+            _, send_time, latencies, _ = run(
+                transport, sdim, args_dict["interval"], args_dict
+            )
+            # From the first send to the last arrival (a socket receive can
+            # hold several frames).
+            start, _, _, statistics = run(transport, sdim, 0.0, args_dict)
+            elapsed = statistics.last_arrival - start
+            print(
+                f"{sdim:>4}x{sdim:<4} {transport:>4}: latency p50 "
+                f"{1e6 * np.median(latencies):7.1f} us, p99 "
+                f"{1e6 * np.percentile(latencies, 99):7.1f} us, send "
+                f"{1e6 * send_time:6.1f} us; back to back "
+                f"{statistics.frames / elapsed:8.0f} frames/s, "
+                f"{statistics.bytes_received / 2**20 / elapsed:7.1f} MiB/s, "
+                f"{statistics.missed_frames} missed"
+            )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
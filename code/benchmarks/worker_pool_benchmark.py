@@ -0,0 +1,137 @@
+"""
+Compares in-process EDSR (or bicubic) inference with the out-of-process
+InferenceWorkerPool for 1 to N workers: pretransformed frames are submitted
+through the shared memory ring as fast as the workers take them, and the
+outputs are posttransformed in the calling process. Checks every output
+matches the in-process output of the same frame (i.e., the order is kept)
+and reports the throughput, the per-frame latency and the speed-up over
+in-process inference. Scaling needs a multi-core machine: each worker gets
+an equal share of the cores.
+
+python -m benchmarks.worker_pool_benchmark --workers 1 2 4 --frames 100
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+
+from modules import worker_pool
+from modules.schemas.bicubic_sr import BICUBIC_ENGINES, BicubicDimensions
+from modules.schemas.edsr_sr import (
+    EDSR_ENGINES,
+    EdsrDimensions,
+    EdsrPosttransformations,
+)
+
+from tools import stand_in_models
+
+MODELS = {
+    "edsr": (EDSR_ENGINES["torchscript"], EdsrDimensions),
+    "bicubic": (BICUBIC_ENGINES["torchscript"], BicubicDimensions),
+}
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", choices=list(MODELS), default="edsr")
+    parser.add_argument("--frames", "-n", type=int, default=100)
+    parser.add_argument("--matrix-size", type=int, default=64)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1})
+    )
+    parser.add_argument(
+        "--parameters", default="", help="Directory with the real parameter files."
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def posttransform(image_inferred: torch.Tensor) -> np.ndarray:
+    # Copied out of the output slot, as the gadget does when sending.
+    return np.copy(EdsrPosttransformations(image_inferred).posttransform())
+
+
+def run_in_process(model, frames: list) -> tuple:
+    outputs = []
+    latencies = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for frame in frames:
+            start_frame = time.perf_counter()
+            outputs.append(posttransform(model.perform_inference(frame)))
+            latencies.append(time.perf_counter() - start_frame)
+
+    return time.perf_counter() - start, latencies, outputs
+
+
+def run_pool(pool: worker_pool.InferenceWorkerPool, frames: list) -> tuple:
+    outputs = []
+    latencies = []
+    submit_times = {}
+
+    def source():
+        for index, frame in enumerate(frames):
+            submit_times[index] = time.perf_counter()
+            yield index, frame
+
+    start = time.perf_counter()
+    for index, image_inferred in pool.run(source()):
+        outputs.append((index, posttransform(image_inferred)))
+        latencies.append(time.perf_counter() - submit_times[index])
+
+    return time.perf_counter() - start, latencies, outputs
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)
+    stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+
+    (model_class, model_name), dimensions_class = MODELS[args_dict["model"]]
+    matrix_size = args_dict["matrix_size"]
+    dimensions = dimensions_class.from_matrix_size((matrix_size, matrix_size))
+    torch.manual_seed(0)
+    frames = [
+        torch.rand(dimensions.input_dimensions) for _ in range(args_dict["frames"])
+    ]
+
+    model = model_class(torch.device("cpu"), model_name)
+    model.prepare(dimensions.input_dimensions)
+    elapsed, latencies, expected = run_in_process(model, frames)
+    baseline = len(frames) / elapsed
+    print(
+        f"{os.cpu_count()} cores, {args_dict['model']} {matrix_size}x{matrix_size}"
+        f"\n{'in-process':>12}: {baseline:7.1f} frames/s, "
+        f"latency p50 {1e3 * np.median(latencies):7.2f} ms"
+    )
+
+    for worker_count in args_dict["workers"]:
+        with worker_pool.InferenceWorkerPool(
+            model_class, model_name, dimensions, worker_count
+        ) as pool:
+            run_pool(pool, frames[: 2 * worker_count])  # Warm up every worker.
+            elapsed, latencies, outputs = run_pool(pool, frames)
+
+        assert [index for index, _ in outputs] == list(range(len(frames)))
+        error = max(
+            float(np.abs(output - expected[index]).max()) for index, output in outputs
+        )
+        assert error < 1e-3 * float(np.abs(expected[0]).max())
+
+        throughput = len(frames) / elapsed
+        print(
+            f"{worker_count:>4} workers: {throughput:7.1f} frames/s, "
+            f"latency p50 {1e3 * np.median(latencies):7.2f} ms "
+            f"({throughput / baseline:.2f}x), in order, max error {error:.1e}"
+        )
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import logging
+
+import ismrmrd
+import gadgetron
+
+from modules import inference_service, instrumentation
+
+# Unix socket of the inference daemon (inferenceDaemon.py), which keeps the
+# Bicubic model loaded and warm between scans. If the daemon is not running, the
+# frames are processed in-process by bicubicGadget instead.
+INFERENCE_SOCKET_PATH = inference_service.DEFAULT_SOCKET_PATH
+
+# Per-stage latency histograms are written here every METRICS_EXPORT_INTERVAL
+# seconds ("prometheus" text or "json"). Set the path to None to disable.
+METRICS_EXPORT_PATH = "/tmp/bicubicDaemonGadget_metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+METRICS_EXPORT_FORMAT = "prometheus"
+
+
+def main(connection):
+    logging.basicConfig(level=logging.DEBUG)
+
+    try:
+        client = inference_service.InferenceClient("bicubic", INFERENCE_SOCKET_PATH)
+    except OSError as error:
+        logging.warning(
+            f"Inference daemon unavailable at {INFERENCE_SOCKET_PATH} ({error}), "
+            "running the model in-process."
+        )
+        import bicubicGadget
+
+        return bicubicGadget.main(connection)
+
+    metrics = instrumentation.METRICS
+
+    with client, instrumentation.MetricsExporter(
+        METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL, METRICS_EXPORT_FORMAT
+    ):
+        for acquisition in connection:
+            with metrics.time("inference_service"):
+                image_inferred = client.process(acquisition.data)
+
+            with metrics.time("gadgetron_send"):
+                image_to_send = ismrmrd.image.Image.from_array(
+                    image_inferred, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
+                )
+
+                connection.send(image_to_send)
@@ -1,46 +1,150 @@
-import time
-import logging
-import os
-
-import numpy as np
-import torch
-
-import ismrmrd
-import gadgetron
-
-from modules.schemas.bicubic_sr import (
-    BicubicModel,
-    BicubicPretransformations,
-    BicubicPosttransformations,
-)
-
-
-def main(connection):
-    logging.basicConfig(level=logging.DEBUG)
-
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
-    logging.debug(f"Device used for inference: {device}")
-
-    model = BicubicModel(device, "64_to_256_bicubic_interpolation_JIT.pt")
-
-    for acquisition in connection:
-        data = acquisition.data
-
-        data_cp = np.copy(data)
-
-        pretransformation_class = BicubicPretransformations(data_cp, device)
-
-        image = pretransformation_class.pretransform()
-
-        image_inferred = model.perform_inference(image)
-
-        posttransformation_class = BicubicPosttransformations(image_inferred)
-
-        image_inferred = posttransformation_class.posttransform()
-
-        image_to_send = ismrmrd.image.Image.from_array(
-            image_inferred, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
-        )
-
-        connection.send(image_to_send)
+import contextlib
+import time
+import logging
+import os
+
+import numpy as np
+import torch
+
+import ismrmrd
+import gadgetron
+
+from modules import batching, instrumentation, staging, worker_pool
+
+from modules.schemas.bicubic_sr import (
+    BICUBIC_ENGINES,
+    BicubicDimensions,
+    BicubicPretransformations,
+    BicubicPosttransformations,
+)
+
+# Opt-in micro-batching (e.g., for multi-slice or offline reprocessing). Up to
+# MICRO_BATCH_SIZE frames are inferred together, waiting at most
+# MICRO_BATCH_DEADLINE seconds for the batch to fill. 1 disables batching.
+MICRO_BATCH_SIZE = 1
+MICRO_BATCH_DEADLINE = 0.005
+
+# Out-of-process inference (see worker_pool): INFERENCE_WORKERS processes each
+# load the model and infer frames exchanged through shared memory, so
+# inference does not compete with the gadget for the GIL. The workers are
+# started (and load the model) for every connection, and need sys.executable
+# to be a Python interpreter. 0 infers in the gadget process.
+INFERENCE_WORKERS = 0
+
+# Inference engine of the bicubic model (see BICUBIC_ENGINES): "torchscript",
+# or "onnxruntime" for the ONNX model made by tools/export_onnx.py (runs on the
+# CPU).
+INFERENCE_ENGINE = "torchscript"
+
+# Inference engine options of the model (see Model). optimise: freeze the
+# model, apply optimize_for_inference and run every forward under
+# torch.inference_mode. channels_last: use the channels-last memory format
+# (optimised model only). intra_op_threads/inter_op_threads: torch thread
+# counts (None keeps the torch defaults), also used by ONNX Runtime.
+# graph_optimisation: ONNX Runtime graph optimisation level. precision:
+# "float32", or "bfloat16"/"float16" autocast (EDSR only, enabled only if it
+# passes the start-up accuracy self-check within precision_tolerance).
+ENGINE_OPTIONS = {
+    "optimise": False,
+    "channels_last": False,
+    "intra_op_threads": None,
+    "inter_op_threads": None,
+    "graph_optimisation": "all",
+    "precision": "float32",
+    "precision_tolerance": 1e-2,
+}
+
+# Per-stage latency histograms are written here every METRICS_EXPORT_INTERVAL
+# seconds ("prometheus" text or "json"). Set the path to None to disable.
+METRICS_EXPORT_PATH = "/tmp/bicubicGadget_metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+METRICS_EXPORT_FORMAT = "prometheus"
+
+
+def main(connection):
+    logging.basicConfig(level=logging.DEBUG)
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+    logging.debug(f"Device used for inference: {device}")
+
+    model_class, model_name = BICUBIC_ENGINES[INFERENCE_ENGINE]
+
+    dimensions = BicubicDimensions.from_header(connection.header)
+
+    if INFERENCE_WORKERS == 0:
+        model = model_class(device, model_name, **ENGINE_OPTIONS)
+
+        # Warm the model up for the matrix size of this connection (once per
+        # shape). Frames of another size are warmed up when first seen.
+        model.prepare(dimensions.input_dimensions)
+
+    metrics = instrumentation.METRICS
+
+    def pretransformed():
+        for acquisition in connection:
+            buffer_pool.start_frame()
+
+            with metrics.time("pretransform"):
+                pretransformation_class = BicubicPretransformations(
+                    acquisition.data, device, buffer_pool
+                )
+
+                image = pretransformation_class.pretransform()
+
+            yield acquisition, image
+
+    def inferred():
+        for acquisition, image in pretransformed():
+            with metrics.time("inference"):
+                image_inferred = model.perform_inference(image)
+
+            yield acquisition, image_inferred
+
+    with instrumentation.MetricsExporter(
+        METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL, METRICS_EXPORT_FORMAT
+    ), contextlib.ExitStack() as exit_stack:
+        if INFERENCE_WORKERS > 0:
+            inference_workers = exit_stack.enter_context(
+                worker_pool.InferenceWorkerPool(
+                    model_class,
+                    model_name,
+                    dimensions,
+                    INFERENCE_WORKERS,
+                    device=device,
+                    engine_options=ENGINE_OPTIONS,
+                )
+            )
+            frames = inference_workers.run(pretransformed())
+            frames_in_flight = inference_workers.max_in_flight
+        elif MICRO_BATCH_SIZE > 1:
+            micro_batcher = batching.MicroBatcher(
+                model, MICRO_BATCH_SIZE, MICRO_BATCH_DEADLINE
+            )
+            frames = micro_batcher.run(pretransformed())
+            frames_in_flight = micro_batcher.max_in_flight
+        else:
+            frames = inferred()
+            frames_in_flight = 1
+
+        # Preallocated (pinned) staging tensors reused across frames, one per
+        # frame that can be between pretransform and send at once. Reusing a
+        # tensor still in flight raises instead of corrupting the frame.
+        buffer_pool = staging.StagingBufferPool(buffer_count=frames_in_flight)
+
+        for acquisition, image_inferred in frames:
+            with metrics.time("posttransform"):
+                posttransformation_class = BicubicPosttransformations(
+                    image_inferred, buffer_pool
+                )
+
+                image_inferred = posttransformation_class.posttransform()
+
+            with metrics.time("gadgetron_send"):
+                image_to_send = ismrmrd.image.Image.from_array(
+                    image_inferred, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
+                )
+
+                connection.send(image_to_send)
+
+            buffer_pool.finish_frame()
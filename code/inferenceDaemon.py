@@ -0,0 +1,133 @@
+"""
+Long-lived inference daemon. Loads and warms up the super-resolution models
+once, then serves the thin gadget clients (edsrDaemonGadget,
+bicubicDaemonGadget) over a local Unix socket, so a new scan only pays the
+IPC round trip instead of the model load and warm-up.
+
+python inferenceDaemon.py --models edsr bicubic
+"""
+
+import argparse
+import logging
+
+import torch
+
+from modules import inference_service, instrumentation
+
+from modules.schemas.bicubic_sr import (
+    BICUBIC_ENGINES,
+    BicubicPretransformations,
+    BicubicPosttransformations,
+)
+from modules.schemas.edsr_sr import (
+    EDSR_ENGINES,
+    EdsrPretransformations,
+    EdsrPosttransformations,
+)
+
+# (inference engines, pretransformation class, posttransformation class)
+MODELS = {
+    "edsr": (EDSR_ENGINES, EdsrPretransformations, EdsrPosttransformations),
+    "bicubic": (
+        BICUBIC_ENGINES,
+        BicubicPretransformations,
+        BicubicPosttransformations,
+    ),
+}
+
+# Inference engine of each model (see EDSR_ENGINES and BICUBIC_ENGINES).
+INFERENCE_ENGINES = {"edsr": "torchscript", "bicubic": "torchscript"}
+
+# Inference engine options of the model (see Model). optimise: freeze the
+# model, apply optimize_for_inference and run every forward under
+# torch.inference_mode. channels_last: use the channels-last memory format
+# (optimised model only). intra_op_threads/inter_op_threads: torch thread
+# counts (None keeps the torch defaults), also used by ONNX Runtime.
+# graph_optimisation: ONNX Runtime graph optimisation level. precision:
+# "float32", or "bfloat16"/"float16" autocast (EDSR only, enabled only if it
+# passes the start-up accuracy self-check within precision_tolerance).
+# tile_size: infer matrices larger than tile_size x tile_size (e.g., 128x128
+# or 192x192) in tiles overlapping by tile_overlap pixels, at most
+# tile_batch_size tiles at once, blended back together (EDSR only, None
+# disables tiling).
+ENGINE_OPTIONS = {
+    "optimise": False,
+    "channels_last": False,
+    "intra_op_threads": None,
+    "inter_op_threads": None,
+    "graph_optimisation": "all",
+    "precision": "float32",
+    "precision_tolerance": 1e-2,
+    "tile_size": None,
+    "tile_overlap": 8,
+    "tile_batch_size": 4,
+}
+
+# Per-stage latency histograms are written here every METRICS_EXPORT_INTERVAL
+# seconds ("prometheus" text or "json"). Set the path to None to disable.
+METRICS_EXPORT_PATH = "/tmp/inferenceDaemon_metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+METRICS_EXPORT_FORMAT = "prometheus"
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Run the inference daemon.")
+    parser.add_argument(
+        "--socket", default=inference_service.DEFAULT_SOCKET_PATH, dest="socket_path"
+    )
+    parser.add_argument(
+        "--models", nargs="+", default=list(MODELS), choices=list(MODELS)
+    )
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def create_handler(name: str, device: torch.device):
+    """
+    Loads and warms up a model, and returns the function mapping the
+    acquisition data to the posttransformed image.
+
+    :param name: the model to serve (a key of MODELS).
+    :param device: device to run inference on.
+    """
+    engines, pretransformation, posttransformation = MODELS[name]
+    model_class, model_name = engines[INFERENCE_ENGINES[name]]
+    model = model_class(device, model_name, **ENGINE_OPTIONS)
+    metrics = instrumentation.METRICS
+
+    def handler(data):
+        with metrics.time(f"{name}_pretransform"):
+            image = pretransformation(data, device).pretransform()
+
+        with metrics.time(f"{name}_inference"):
+            image_inferred = model.perform_inference(image)
+
+        with metrics.time(f"{name}_posttransform"):
+            return posttransformation(image_inferred).posttransform()
+
+    return handler
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.INFO)
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+    logging.info(f"Device used for inference: {device}")
+
+    handlers = {name: create_handler(name, device) for name in args_dict["models"]}
+
+    with instrumentation.MetricsExporter(
+        METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL, METRICS_EXPORT_FORMAT
+    ), inference_service.InferenceServer(handlers, args_dict["socket_path"]) as server:
+        logging.info(f"Serving {list(handlers)} on {args_dict['socket_path']}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+In this module, the micro-batching helper used for opt-in batched inference
+is stored. Pretransformed frames are collected until either max_batch_size
+frames are waiting or the deadline (measured from the first waiting frame)
+has passed, then they are run through the model as one batch and split back
+into per-acquisition outputs, in arrival order.
+"""
+
+import queue
+import threading
+import time
+import typing
+
+from modules import instrumentation, model
+
+_SENTINEL = object()  # Marks the end of the source.
+
+
+class MicroBatcher:
+    """
+    Groups (key, tensor) pairs from a source into batches for
+    Model.perform_batch_inference. The key (typically the acquisition) is
+    passed through untouched so the caller can pair it with its output.
+    """
+
+    __slots__ = "model", "max_batch_size", "deadline"
+
+    def __init__(
+        self, model: model.Model, max_batch_size: int = 4, deadline: float = 0.005
+    ) -> None:
+        """
+        :param model: the loaded model to run inference with.
+        :param max_batch_size: Maximum number of frames in one batch.
+        :param deadline: Maximum time (seconds) the first frame of a batch
+            waits for the batch to fill up.
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}")
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.deadline = deadline
+
+    @property
+    def max_in_flight(self) -> int:
+        """
+        The most frames taken from the source and not yet consumed at once:
+        2 * max_batch_size waiting in the inbox, one held by the reader thread
+        (being pretransformed, or blocked on the full inbox) and max_batch_size
+        in the batch being inferred and yielded, plus one of headroom. Pools of
+        per-frame buffers (e.g., StagingBufferPool) need at least this many.
+        """
+        return 3 * self.max_batch_size + 2
+
+    def run(self, source: typing.Iterable[tuple]) -> typing.Iterator[tuple]:
+        """
+        Yields (key, inferred_tensor) for every (key, tensor) of the source, in
+        order. The source is consumed in a background thread so the deadline
+        also holds while the source is blocked waiting for the next acquisition.
+
+        :param source: An iterable of (key, pretransformed tensor) pairs.
+        """
+        inbox = queue.Queue(maxsize=2 * self.max_batch_size)
+        stop_event = threading.Event()
+        errors = []
+
+        def put(item) -> bool:
+            # Poll so a consumer that stopped early cannot leave us blocked forever.
+            while not stop_event.is_set():
+                try:
+                    inbox.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def reader() -> None:
+            try:
+                for item in source:
+                    if not put(item):
+                        return None
+            except BaseException as error:
+                errors.append(error)
+            finally:
+                put(_SENTINEL)
+
+        threading.Thread(target=reader, name="micro-batcher", daemon=True).start()
+
+        try:
+            finished = False
+
+            while not finished:
+                item = inbox.get()
+                if item is _SENTINEL:
+                    break
+
+                batch = [item]
+                flush_time = time.perf_counter() + self.deadline
+
+                while len(batch) < self.max_batch_size:
+                    remaining = flush_time - time.perf_counter()
+                    try:
+                        item = inbox.get(timeout=max(remaining, 0.0))
+                    except queue.Empty:
+                        break
+
+                    if item is _SENTINEL:
+                        finished = True
+                        break
+
+                    batch.append(item)
+
+                keys = [key for key, _ in batch]
+                with instrumentation.METRICS.time("batch_inference"):
+                    outputs = self.model.perform_batch_inference(
+                        [tensor for _, tensor in batch]
+                    )
+
+                yield from zip(keys, outputs)
+        finally:
+            # Also when the consumer stops early, so the reader is not left
+            # blocked on the full inbox.
+            stop_event.set()
+
+        if errors:
+            raise errors[0]
@@ -1,33 +1,84 @@
-"""
-In this module, the input and output dimensions for each neural network
-are stored. Simply make a dataclass and store the dimensional data.
-
-input_dimensions: the dimensions expected for the neural network application.
-output_dimensions: the dimensions expected to be sent back to Gadgetron.
-"""
-
-from dataclasses import dataclass
-
-
-@dataclass
-class Dimensions:
-    """
-    Generic dimensions class.
-    """
-
-    __slots__ = "input_dimensions", "output_dimensions"
-    input_dimensions: tuple
-    output_dimensions: tuple
-
-
-def test():
-    class TestDimensions(Dimensions):
-        input_dimensions: tuple = (1, 2, 3, 4)
-        output_dimensions: tuple = (5, 6, 7, 8)
-
-    assert TestDimensions.input_dimensions == (1, 2, 3, 4)
-    assert TestDimensions.output_dimensions == (5, 6, 7, 8)
-
-
-if __name__ == "__main__":
-    test()
+"""
+In this module, the input and output dimensions for each neural network
+are stored. Simply make a dataclass and store the dimensional data.
+
+input_dimensions: the dimensions expected for the neural network application.
+output_dimensions: the dimensions expected to be sent back to Gadgetron.
+
+The class attributes are the default (trained) dimensions. Dimensions for
+another matrix size, keeping the same upsampling ratio, are resolved per
+connection from the acquisition header (from_header) or per frame from the
+acquisition data (from_matrix_size).
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class Dimensions:
+    """
+    Generic dimensions class.
+    """
+
+    __slots__ = "input_dimensions", "output_dimensions"
+    input_dimensions: tuple
+    output_dimensions: tuple
+
+    @property
+    def upsample_ratio(self) -> int:
+        """
+        Ratio of the output to the input matrix size.
+        """
+        return self.output_dimensions[0] // self.input_dimensions[-2]
+
+    @classmethod
+    def from_matrix_size(cls, matrix_size: tuple) -> "Dimensions":
+        """
+        Dimensions for an acquisition of the given matrix size, with the
+        upsampling ratio of the default dimensions of the class.
+
+        :param matrix_size: the (x, y) matrix size, i.e., the first two
+            dimensions of the acquisition data.
+        """
+        x, y = (int(size) for size in matrix_size)
+        upsample_ratio = cls.output_dimensions[0] // cls.input_dimensions[-2]
+
+        return cls(
+            input_dimensions=cls.input_dimensions[:-2] + (x, y),
+            output_dimensions=(x * upsample_ratio, y * upsample_ratio)
+            + cls.output_dimensions[2:],
+        )
+
+    @classmethod
+    def from_header(cls, header) -> "Dimensions":
+        """
+        Dimensions for the reconstructed matrix size of the first encoding of
+        the ISMRMRD header (connection.header).
+
+        :param header: the ISMRMRD header of the connection.
+        """
+        matrix_size = header.encoding[0].reconSpace.matrixSize
+
+        return cls.from_matrix_size((matrix_size.x, matrix_size.y))
+
+
+def test():
+    class TestDimensions(Dimensions):
+        input_dimensions: tuple = (1, 2, 3, 4)
+        output_dimensions: tuple = (5, 6, 7, 8)
+
+    assert TestDimensions.input_dimensions == (1, 2, 3, 4)
+    assert TestDimensions.output_dimensions == (5, 6, 7, 8)
+
+    class TestSuperResolutionDimensions(Dimensions):
+        input_dimensions: tuple = (1, 1, 64, 64)
+        output_dimensions: tuple = (256, 256, 1, 1)
+
+    resolved = TestSuperResolutionDimensions.from_matrix_size((128, 96))
+    assert resolved.input_dimensions == (1, 1, 128, 96)
+    assert resolved.output_dimensions == (512, 384, 1, 1)
+    assert resolved.upsample_ratio == 4
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,231 @@
+"""
+In this module, the local inference service is stored: a long-lived daemon
+(see inferenceDaemon.py) loads and warms up the models once, and short-lived
+gadget processes forward their acquisition data to it over a Unix socket and
+get back the posttransformed image. This module only depends on numpy, so the
+thin gadget clients start without importing torch.
+
+Every message is a fixed header followed by the raw array bytes:
+
+name: the handler to run (request), or "ok"/"error" (response).
+dtype: the numpy dtype string of the array (e.g., "<c8").
+ndim, shape: the shape of the array (at most MAX_DIMENSIONS dimensions).
+
+An error response carries the error message as a uint8 array.
+"""
+
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import typing
+
+import numpy as np
+
+DEFAULT_SOCKET_PATH = "/tmp/superresolution_inference.sock"
+MAX_DIMENSIONS = 8
+MESSAGE_HEADER = struct.Struct(f"=16s16sI{MAX_DIMENSIONS}Q")
+
+
+class InferenceServiceError(RuntimeError):
+    """
+    Raised by the client when the daemon failed to process a frame.
+    """
+
+
+def send_array(sock: socket.socket, name: str, array: np.ndarray) -> None:
+    """
+    Sends the message header and the array bytes with vectored sends,
+    resuming after partial sends.
+
+    :param sock: the connected socket.
+    :param name: the handler name (request) or status (response).
+    :param array: the array to send.
+    """
+    if array.ndim > MAX_DIMENSIONS:
+        raise ValueError(f"Arrays of at most {MAX_DIMENSIONS} dimensions are supported")
+
+    array = np.ascontiguousarray(array)
+    shape = array.shape + (0,) * (MAX_DIMENSIONS - array.ndim)
+    header = MESSAGE_HEADER.pack(
+        name.encode(), array.dtype.str.encode(), array.ndim, *shape
+    )
+    buffers = [memoryview(header), memoryview(array.reshape(-1).view(np.uint8))]
+
+    while buffers:
+        sent = sock.sendmsg(buffers)
+
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+
+        if buffers and sent:
+            buffers[0] = buffers[0][sent:]
+    return None
+
+
+def recv_into(sock: socket.socket, buffer: memoryview) -> bool:
+    """
+    Fills the buffer from the socket. Returns False if the connection was
+    closed before any byte was received.
+
+    :param sock: the connected socket.
+    :param buffer: the buffer to fill.
+    """
+    received = 0
+    while received < len(buffer):
+        count = sock.recv_into(buffer[received:])
+        if not count:
+            if received == 0:
+                return False
+            raise ConnectionError("Connection closed in the middle of a message")
+        received += count
+
+    return True
+
+
+def recv_array(sock: socket.socket) -> typing.Optional[tuple]:
+    """
+    Receives one message straight into a new array. Returns (name, array),
+    or None if the connection was closed.
+
+    :param sock: the connected socket.
+    """
+    header = bytearray(MESSAGE_HEADER.size)
+    if not recv_into(sock, memoryview(header)):
+        return None
+
+    name, dtype, ndim, *shape = MESSAGE_HEADER.unpack(header)
+    array = np.empty(shape[:ndim], dtype=np.dtype(dtype.rstrip(b"\0").decode()))
+    if array.nbytes and not recv_into(
+        sock, memoryview(array.reshape(-1).view(np.uint8))
+    ):
+        raise ConnectionError("Connection closed in the middle of a message")
+
+    return name.rstrip(b"\0").decode(), array
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves frames from any number of gadget clients, one thread per client
+    connection. Each handler maps the acquisition data to the posttransformed
+    image; calls of the same handler are serialised (one model per handler).
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        handlers: typing.Dict[str, typing.Callable],
+        socket_path: str = DEFAULT_SOCKET_PATH,
+    ) -> None:
+        """
+        :param handlers: name to callable taking and returning a numpy array.
+        :param socket_path: path of the Unix socket to listen on.
+        """
+        self.handlers = handlers
+        self.handler_locks = {name: threading.Lock() for name in handlers}
+        self.socket_path = socket_path
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Left behind by a previous daemon.
+
+        super().__init__(socket_path, _InferenceRequestHandler)
+
+    def process(self, name: str, array: np.ndarray) -> np.ndarray:
+        with self.handler_locks[name]:
+            return self.handlers[name](array)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        return None
+
+
+class _InferenceRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        frames = 0
+        start = time.perf_counter()
+
+        while True:
+            message = recv_array(self.request)
+            if message is None:
+                break
+
+            name, array = message
+            try:
+                if name not in self.server.handlers:
+                    raise KeyError(f"Unknown handler '{name}'")
+                response = ("ok", self.server.process(name, array))
+            except Exception as error:
+                logging.error(f"Inference service '{name}' failed: {error}")
+                response = ("error", np.frombuffer(str(error).encode(), np.uint8))
+
+            send_array(self.request, *response)
+            frames += 1
+
+        logging.info(
+            f"Client disconnected after {frames} frames in "
+            f"{time.perf_counter() - start:.3f} s."
+        )
+        return None
+
+
+class InferenceClient:
+    """
+    Thin client of the inference daemon, used by the gadgets. Intended to
+    work in a context manager.
+    """
+
+    __slots__ = "name", "socket_path", "sock"
+
+    def __init__(
+        self, name: str, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 10.0
+    ) -> None:
+        """
+        :param name: the handler to use (e.g., "edsr").
+        :param socket_path: path of the daemon's Unix socket.
+        :param timeout: seconds to wait for the daemon to answer a frame.
+        """
+        self.name = name
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(socket_path)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def process(self, array: np.ndarray) -> np.ndarray:
+        """
+        Sends the acquisition data and returns the posttransformed image.
+
+        :param array: the acquisition data.
+        """
+        send_array(self.sock, self.name, array)
+
+        message = recv_array(self.sock)
+        if message is None:
+            raise ConnectionError("The inference daemon closed the connection")
+
+        status, response = message
+        if status != "ok":
+            raise InferenceServiceError(response.tobytes().decode())
+
+        return response
+
+    def close(self) -> None:
+        self.sock.close()
+        return None
+
+    def __enter__(self) -> "InferenceClient":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+        return None
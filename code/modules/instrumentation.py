@@ -0,0 +1,299 @@
+"""
+In this module, the lightweight per-stage instrumentation of the gadgets is
+stored. Stage durations are measured with time.perf_counter_ns and recorded
+into fixed-bucket, HDR-style histograms (no per-frame logging, no per-frame
+allocation beyond the timing context), which a MetricsExporter periodically
+dumps as a Prometheus text file or JSON.
+
+Typical use in a gadget:
+
+with instrumentation.METRICS.time("pack"):
+    packed_struct = structmaker_class.pack_struct()
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+_SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_MAX_EXPONENT = 40
+
+
+class Histogram:
+    """
+    Log-linear histogram of durations in nanoseconds. Each power of two is
+    split into 2**SUB_BUCKET_BITS linear sub-buckets, so recorded values are
+    resolved to within ~6 % up to MAX_EXPONENT (2**40 ns, ~18 minutes).
+    Recording is a few integer operations and one list increment.
+    """
+
+    SUB_BUCKET_BITS = _SUB_BUCKET_BITS
+    MAX_EXPONENT = _MAX_EXPONENT
+
+    __slots__ = "counts", "count", "total", "maximum"
+
+    def __init__(self) -> None:
+        self.counts = [0] * ((self.MAX_EXPONENT + 1) << self.SUB_BUCKET_BITS)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def record(self, value: int) -> None:
+        """
+        :param value: the duration in nanoseconds.
+        """
+        exponent = value.bit_length() - _SUB_BUCKET_BITS
+        if exponent <= 0:
+            index = value
+        elif exponent <= _MAX_EXPONENT:
+            index = (
+                (exponent << _SUB_BUCKET_BITS)
+                + (value >> (exponent - 1))
+                - _SUB_BUCKETS
+            )
+        else:
+            index = len(self.counts) - 1
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+        return None
+
+    def bucket_upper_bound(self, index: int) -> int:
+        """
+        The largest value (nanoseconds) recorded into a bucket.
+
+        :param index: the bucket index.
+        """
+        exponent, sub_bucket = divmod(index, 1 << self.SUB_BUCKET_BITS)
+        if exponent == 0:
+            return sub_bucket
+
+        return (((1 << self.SUB_BUCKET_BITS) + sub_bucket + 1) << (exponent - 1)) - 1
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Returns the upper bound (nanoseconds) of the bucket holding the given
+        percentile, capped at the maximum recorded value.
+
+        :param percentile: the percentile (e.g., 99).
+        """
+        if self.count == 0:
+            return 0
+
+        rank = max(1, int(round(percentile / 100 * self.count)))
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(self.bucket_upper_bound(index), self.maximum)
+
+        return self.maximum
+
+    def snapshot(self) -> dict:
+        """
+        Summary of the histogram, in seconds.
+        """
+        return {
+            "count": self.count,
+            "sum": self.total / 1e9,
+            "p50": self.percentile(50) / 1e9,
+            "p95": self.percentile(95) / 1e9,
+            "p99": self.percentile(99) / 1e9,
+            "max": self.maximum / 1e9,
+        }
+
+
+class _Timing:
+    """
+    Context manager recording the duration of its block into a histogram.
+    """
+
+    __slots__ = "histogram", "start"
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.histogram.record(time.perf_counter_ns() - self.start)
+
+
+class Metrics:
+    """
+    Process-wide collection of per-stage histograms.
+    """
+
+    __slots__ = "histograms", "lock"
+
+    def __init__(self) -> None:
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, stage: str) -> Histogram:
+        """
+        Returns the histogram of a stage, creating it on first use.
+
+        :param stage: the name of the stage (e.g., "inference").
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+
+        return histogram
+
+    def time(self, stage: str) -> _Timing:
+        """
+        Context manager timing its block as one sample of the stage.
+
+        :param stage: the name of the stage (e.g., "inference").
+        """
+        return _Timing(self.histogram(stage))
+
+    def record(self, stage: str, duration: int) -> None:
+        """
+        :param stage: the name of the stage (e.g., "inference").
+        :param duration: the duration in nanoseconds.
+        """
+        self.histogram(stage).record(duration)
+        return None
+
+    def snapshot(self) -> dict:
+        """
+        Summary of every stage, in seconds.
+        """
+        return {
+            stage: histogram.snapshot()
+            for stage, histogram in list(self.histograms.items())
+        }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms = {}
+        return None
+
+    def to_prometheus(self, prefix: str = "superresolution") -> str:
+        """
+        Renders the histograms in the Prometheus text exposition format, as a
+        summary per stage plus a gauge of the maximum.
+
+        :param prefix: prefix of the metric names.
+        """
+        name = f"{prefix}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of each gadget processing stage.",
+            f"# TYPE {name} summary",
+        ]
+        maxima = [
+            f"# HELP {name}_max Maximum duration of each gadget processing stage.",
+            f"# TYPE {name}_max gauge",
+        ]
+
+        for stage, summary in sorted(self.snapshot().items()):
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                lines.append(
+                    f'{name}{{stage="{stage}",quantile="{quantile}"}} '
+                    f"{summary[key]:.9f}"
+                )
+            lines.append(f'{name}_sum{{stage="{stage}"}} {summary["sum"]:.9f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {summary["count"]}')
+            maxima.append(f'{name}_max{{stage="{stage}"}} {summary["max"]:.9f}')
+
+        return "\n".join(lines + maxima) + "\n"
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+
+METRICS = Metrics()
+
+
+class MetricsExporter:
+    """
+    Periodically writes the metrics to a file from a background thread, in
+    Prometheus text format (e.g., for the node exporter textfile collector)
+    or JSON. The file is replaced atomically. Intended to work in a context
+    manager, which writes a final dump on exit.
+    """
+
+    FORMATS = ("prometheus", "json")
+
+    def __init__(
+        self,
+        path: typing.Optional[str],
+        interval: float = 10.0,
+        export_format: str = "prometheus",
+        metrics: Metrics = METRICS,
+    ) -> None:
+        """
+        :param path: file to write to. Nothing is exported if None.
+        :param interval: seconds between dumps.
+        :param export_format: "prometheus" or "json".
+        :param metrics: the metrics to export.
+        """
+        if export_format not in self.FORMATS:
+            raise ValueError(
+                f"export_format must be one of {self.FORMATS}, got {export_format}"
+            )
+
+        self.path = path
+        self.interval = interval
+        self.export_format = export_format
+        self.metrics = metrics
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def dump(self) -> None:
+        if self.path is None:
+            return None
+
+        if self.export_format == "prometheus":
+            text = self.metrics.to_prometheus()
+        else:
+            text = self.metrics.to_json()
+
+        temporary_path = f"{self.path}.tmp"
+        try:
+            with open(temporary_path, "w") as metrics_file:
+                metrics_file.write(text)
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            logging.warning(f"Could not export metrics to {self.path}: {error}")
+        return None
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.dump()
+
+    def start(self) -> None:
+        if self.path is not None and self._thread is None:
+            self._thread = threading.Thread(
+                target=self.run, name="metrics-exporter", daemon=True
+            )
+            self._thread.start()
+        return None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.dump()
+        return None
+
+    def __enter__(self) -> "MetricsExporter":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.stop()
+        return None
@@ -1,55 +1,360 @@
-import time
-import logging
-from abc import abstractmethod
-
-import torch
-
-from modules import model_utils
-
-
-class Model:
-    """
-    This base class is responsible for loading the model.
-    """
-
-    DOCKER = True  # Set this variable to True if using Docker container.
-    DOCKERPATH = "/opt/conda/envs/gadgetron/share/gadgetron/python"
-    MRLPATH = "parameters/"
-
-    __slots__ = "device", "model_name"
-
-    def __init__(self, device: torch.device, model_name: str) -> None:
-        """
-        :param device: device to run inference on.
-        :param model_name: name of the JIT compiled model.
-        """
-        self.device = device
-        self.model_name = model_name
-        self.load_model()
-        self.initialise_gpu(self.model)
-
-    def load_model(self) -> None:
-        """
-        Load the JIT compiled model (containing the trained parameters) onto the
-        GPU. Will display logging information confirming device loaded and time
-        taken to load.
-        """
-        start_model_load = time.time()
-
-        path_to_parameters = model_utils.configure_path_to_parameters(
-            Model.DOCKER, Model.DOCKERPATH, Model.MRLPATH, self.model_name
-        )
-
-        self.model = torch.jit.load(path_to_parameters, map_location=self.device).eval()
-
-        logging.debug(f"Model loaded! Time taken: {time.time()-start_model_load:.3f}")
-
-        return None
-
-    @abstractmethod
-    def initialise_gpu(self):
-        pass
-
-    @abstractmethod
-    def perform_inference(self):
-        pass
+import contextlib
+import inspect
+import os
+import threading
+import time
+import logging
+from abc import abstractmethod
+
+import torch
+
+from modules import model_registry, model_utils, onnx_engine, tiling
+
+
+class Model:
+    """
+    This base class is responsible for loading the model. Loaded models are
+    kept warm in the process-wide REGISTRY, so constructing a model again
+    (e.g., on the next Gadgetron connection) returns the already loaded and
+    warmed-up instance. Each distinct input shape is warmed up once, with its
+    preallocated buffers kept in shape_buffers (see prepare).
+    """
+
+    DOCKER = True  # Set this variable to True if using Docker container.
+    DOCKERPATH = "/opt/conda/envs/gadgetron/share/gadgetron/python"
+    MRLPATH = "parameters/"
+    REGISTRY = model_registry.MODEL_REGISTRY  # Set to None to always reload.
+    PRECISIONS = {
+        "float32": torch.float32,
+        "bfloat16": torch.bfloat16,
+        "float16": torch.float16,
+    }
+
+    __slots__ = (
+        "device",
+        "model_name",
+        "optimise",
+        "channels_last",
+        "intra_op_threads",
+        "inter_op_threads",
+        "graph_optimisation",
+        "precision",
+        "precision_tolerance",
+        "tiler",
+        "shape_buffers",
+        "shape_lock",
+        "footprint",
+        "_initialised",
+    )
+
+    def __new__(cls, device: torch.device, model_name: str, **engine_options):
+        """
+        :param device: device to run inference on.
+        :param model_name: name of the JIT compiled model.
+        :param engine_options: keyword arguments of the child class changing
+            how the model is loaded or run (part of the registry key).
+        """
+        if Model.REGISTRY is None:
+            return super().__new__(cls)
+
+        def load():
+            instance = super(Model, cls).__new__(cls)
+            instance.__init__(device, model_name, **engine_options)
+            return instance
+
+        path_to_parameters = model_utils.configure_path_to_parameters(
+            Model.DOCKER, Model.DOCKERPATH, Model.MRLPATH, model_name
+        )
+        # With the defaults filled in, so options left out and options given
+        # their default value share one loaded model.
+        options = inspect.signature(cls.__init__).bind(
+            None, device, model_name, **engine_options
+        )
+        options.apply_defaults()
+        key = (
+            cls,
+            path_to_parameters,
+            str(torch.device(device)),
+            tuple(options.arguments.items())[3:],  # After self, device and name.
+        )
+
+        return Model.REGISTRY.get(key, load)
+
+    def __init__(
+        self,
+        device: torch.device,
+        model_name: str,
+        optimise: bool = False,
+        channels_last: bool = False,
+        intra_op_threads: int = None,
+        inter_op_threads: int = None,
+        graph_optimisation: str = "all",
+        precision: str = "float32",
+        precision_tolerance: float = 1e-2,
+        tile_size: int = None,
+        tile_overlap: int = 8,
+        tile_batch_size: int = 4,
+    ) -> None:
+        """
+        :param device: device to run inference on.
+        :param model_name: name of the JIT compiled model, or of an exported
+            .onnx model to run with ONNX Runtime on the CPU instead.
+        :param optimise: freeze the model, apply optimize_for_inference and run
+            every forward under torch.inference_mode.
+        :param channels_last: convert the optimised model (and its inputs) to
+            the channels-last memory format.
+        :param intra_op_threads: torch intra-op thread count (process-wide).
+        :param inter_op_threads: torch inter-op thread count (process-wide, can
+            only be set before the first inter-op parallel work). Used as
+            the session thread counts for ONNX Runtime.
+        :param graph_optimisation: ONNX Runtime graph optimisation level
+            ("disable", "basic", "extended" or "all").
+        :param precision: "float32", or "bfloat16"/"float16" to run the model
+            under autocast. Reduced precision is only enabled if it passes a
+            self-check on a reference frame at start-up.
+        :param precision_tolerance: maximum error of the reduced precision
+            self-check, relative to the range of the full precision output.
+        :param tile_size: infer inputs larger than tile_size x tile_size in
+            overlapping tiles blended back together (None disables tiling).
+        :param tile_overlap: overlap between neighbouring tiles (input pixels).
+        :param tile_batch_size: maximum number of tiles inferred at once.
+        """
+        if getattr(self, "_initialised", False):
+            return None  # Already loaded instance from the registry.
+
+        self.device = device
+        self.model_name = model_name
+        self.optimise = optimise
+        self.channels_last = channels_last
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimisation = graph_optimisation
+        if precision not in self.PRECISIONS:
+            raise ValueError(
+                f"precision must be one of {list(self.PRECISIONS)}, got {precision}"
+            )
+        self.precision = precision
+        self.precision_tolerance = precision_tolerance
+        self.tiler = (
+            None
+            if tile_size is None
+            else tiling.TiledInference(tile_size, tile_overlap, tile_batch_size)
+        )
+        self.shape_buffers = {}
+        self.shape_lock = threading.Lock()
+        if not self.onnx:
+            model_utils.set_thread_counts(intra_op_threads, inter_op_threads)
+        self.load_model()
+        self.initialise_gpu(self.model)
+        if self.precision != "float32":
+            self.check_precision()
+        self._initialised = True
+
+    def load_model(self) -> None:
+        """
+        Load the JIT compiled model (containing the trained parameters) onto the
+        GPU. Will display logging information confirming device loaded and time
+        taken to load. An .onnx model is loaded into an ONNX Runtime session.
+        """
+        start_model_load = time.time()
+
+        path_to_parameters = model_utils.configure_path_to_parameters(
+            Model.DOCKER, Model.DOCKERPATH, Model.MRLPATH, self.model_name
+        )
+
+        if self.onnx:
+            self.model = onnx_engine.OnnxRuntimeModule(
+                path_to_parameters,
+                self.intra_op_threads,
+                self.inter_op_threads,
+                self.graph_optimisation,
+            )
+            self.footprint = os.path.getsize(path_to_parameters)
+
+            logging.debug(
+                f"Model loaded! Time taken: {time.time()-start_model_load:.3f}"
+            )
+
+            return None
+
+        self.model = torch.jit.load(
+            path_to_parameters, map_location=self.inference_device
+        ).eval()
+        # Packed (e.g., quantised) weights are not parameters, so fall back to
+        # the size of the parameter file.
+        self.footprint = model_utils.module_memory(self.model) or os.path.getsize(
+            path_to_parameters
+        )
+
+        if self.optimise:
+            self.model = model_utils.InferenceModule(self.model, self.channels_last)
+
+        logging.debug(f"Model loaded! Time taken: {time.time()-start_model_load:.3f}")
+
+        return None
+
+    @property
+    def inference_device(self) -> torch.device:
+        """
+        Device the model is loaded onto (the device of the inputs by default).
+        ONNX Runtime models run on the CPU.
+        """
+        if self.onnx:
+            return torch.device("cpu")
+
+        return self.device
+
+    @property
+    def onnx(self) -> bool:
+        """
+        Whether the model is an exported ONNX model run with ONNX Runtime.
+        """
+        return self.model_name.endswith(".onnx")
+
+    def autocast(self):
+        """
+        Context manager running the model in the selected precision.
+        """
+        if self.precision == "float32":
+            return contextlib.nullcontext()
+
+        return torch.autocast(
+            self.inference_device.type, dtype=self.PRECISIONS[self.precision]
+        )
+
+    def reference_inputs(self) -> tuple:
+        """
+        Inputs of the reference frame used by the reduced precision self-check,
+        or None if the model does not support reduced precision.
+        """
+        return None
+
+    def check_precision(self) -> None:
+        """
+        Compares the output of the model in reduced precision with the full
+        precision output on a reference frame, and falls back to float32 if
+        autocast is not supported or the error exceeds precision_tolerance.
+        """
+        inputs = self.reference_inputs()
+        error = None
+
+        if inputs is not None and not self.onnx:
+            try:
+                with torch.no_grad():
+                    reference = self.model(*inputs).float()
+                    with self.autocast():
+                        output = self.model(*inputs)
+                # Autocast is silently disabled for unsupported dtypes, and
+                # does not reach into frozen, optimised graphs.
+                enabled = output.dtype == self.PRECISIONS[self.precision]
+                output = output.float()
+            except RuntimeError as runtime_error:
+                logging.warning(f"{self.precision} inference failed: {runtime_error}")
+                enabled = False
+
+            if enabled:
+                output_range = float(reference.max() - reference.min()) or 1.0
+                error = float((output - reference).abs().max()) / output_range
+
+        if error is None or error > self.precision_tolerance:
+            logging.warning(
+                f"{self.precision} inference not enabled for {self.model_name}: "
+                + (
+                    "not supported."
+                    if error is None
+                    else f"relative error {error:.2e} exceeds "
+                    f"{self.precision_tolerance:.2e}."
+                )
+                + " Using float32."
+            )
+            self.precision = "float32"
+        else:
+            logging.info(
+                f"{self.precision} inference enabled for {self.model_name} "
+                f"(relative error {error:.2e})."
+            )
+        return None
+
+    def warm_up_dimensions(self, input_dimensions: tuple) -> tuple:
+        """
+        Dimensions of the warm-up input: a full batch of tiles when tiling,
+        the given input dimensions otherwise.
+
+        :param input_dimensions: the (N, C, H, W) input dimensions of the model.
+        """
+        if self.tiler is None:
+            return input_dimensions
+
+        return (
+            self.tiler.batch_size,
+            input_dimensions[1],
+            self.tiler.tile_size,
+            self.tiler.tile_size,
+        )
+
+    def prepare(self, input_dimensions: tuple) -> dict:
+        """
+        Returns the preallocated buffers of an input shape. The first time a
+        shape is seen (e.g., a new protocol's matrix size), its buffers are
+        allocated and the model is warmed up with a random input of that
+        shape, so later frames of that shape skip both.
+
+        :param input_dimensions: the (N, C, H, W) input dimensions.
+        """
+        input_dimensions = tuple(input_dimensions)
+        buffers = self.shape_buffers.get(input_dimensions)
+        if buffers is not None:
+            return buffers
+
+        with self.shape_lock:
+            buffers = self.shape_buffers.get(input_dimensions)
+            if buffers is None:
+                start_warm_up = time.perf_counter()
+                buffers = self.allocate_buffers(input_dimensions)
+                self.shape_buffers[input_dimensions] = buffers
+                with torch.no_grad():
+                    self.perform_inference(
+                        torch.rand(input_dimensions, device=self.device)
+                    )
+
+                logging.info(
+                    f"Warmed up {type(self).__name__} for input shape "
+                    f"{input_dimensions} in {time.perf_counter() - start_warm_up:.3f} s."
+                )
+
+        return buffers
+
+    def allocate_buffers(self, input_dimensions: tuple) -> dict:
+        """
+        Allocates the buffers reused by every inference of an input shape
+        (none by default).
+
+        :param input_dimensions: the (N, C, H, W) input dimensions.
+        """
+        return {}
+
+    def memory_footprint(self) -> int:
+        """
+        Memory (bytes) taken by the parameters and buffers of the model.
+        """
+        return self.footprint
+
+    @abstractmethod
+    def initialise_gpu(self):
+        pass
+
+    @abstractmethod
+    def perform_inference(self):
+        pass
+
+    def perform_batch_inference(self, input_batch: list) -> list:
+        """
+        Perform inference on several pretransformed, normalised input tensors
+        (each with a batch dimension of one) in a single call to the model. The
+        outputs are returned in the same order as the inputs.
+
+        :param input_batch: list of pretransformed input tensors.
+        """
+        image_superresolution = self.perform_inference(torch.cat(input_batch, dim=0))
+
+        return list(torch.split(image_superresolution, 1, dim=0))
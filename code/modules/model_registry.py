@@ -0,0 +1,155 @@
+"""
+In this module, the process-wide registry of loaded models is stored.
+Gadgetron calls a gadget's main once per connection, so without it every scan
+would load the JIT compiled model and warm it up again. Models are keyed by
+(model class, path to the parameters, device, engine options), kept warm
+across connections and evicted least recently used first once the total
+memory footprint exceeds the budget.
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+import typing
+
+import torch
+
+
+class ModelRegistry:
+    """
+    Thread-safe LRU registry of loaded models. A model is loaded at most
+    once at a time: concurrent requests for the same key wait for the first
+    load instead of loading the model again. Hits, misses, evictions and
+    load times are kept for monitoring.
+    """
+
+    __slots__ = (
+        "budget",
+        "maxsize",
+        "models",
+        "footprints",
+        "load_times",
+        "loading_locks",
+        "lock",
+        "hits",
+        "misses",
+        "evictions",
+    )
+
+    def __init__(self, budget: int = 4 * 2**30, maxsize: int = 4) -> None:
+        """
+        :param budget: memory budget (bytes) of the registered models. The
+            most recently used model is kept even if it exceeds the budget.
+        :param maxsize: maximum number of models kept.
+        """
+        self.budget = budget
+        self.maxsize = maxsize
+        self.models = OrderedDict()
+        self.footprints = {}
+        self.load_times = {}
+        self.loading_locks = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, factory: typing.Callable):
+        """
+        Returns the model registered under the key, loading it with the
+        factory on a miss.
+
+        :param key: (model class, path to the parameters, device, engine options).
+        :param factory: loads and warms up the model (called without arguments).
+        """
+        with self.lock:
+            instance = self.lookup(key)
+            if instance is not None:
+                return instance
+
+            loading_lock = self.loading_locks.setdefault(key, threading.Lock())
+
+        with loading_lock:
+            with self.lock:
+                instance = self.lookup(key)  # Loaded while we were waiting.
+                if instance is not None:
+                    return instance
+
+            try:
+                start_load = time.perf_counter()
+                instance = factory()
+                load_time = time.perf_counter() - start_load
+            finally:
+                with self.lock:
+                    self.loading_locks.pop(key, None)
+
+            with self.lock:
+                self.misses += 1
+                self.models[key] = instance
+                self.footprints[key] = instance.memory_footprint()
+                self.load_times[key] = load_time
+                self.evict()
+
+        logging.info(
+            f"Loaded {key[0].__name__} from {key[1]} on {key[2]} in {load_time:.3f} s "
+            f"({self.footprints[key] / 2**20:.1f} MiB). {self}"
+        )
+
+        return instance
+
+    def lookup(self, key: tuple):
+        """
+        Returns the registered model (marking it most recently used), or None.
+        Must be called with the lock held.
+
+        :param key: (model class, path to the parameters, device, engine options).
+        """
+        instance = self.models.get(key)
+        if instance is not None:
+            self.hits += 1
+            self.models.move_to_end(key)
+            logging.debug(f"Reusing warm {key[0].__name__} from {key[1]}. {self}")
+
+        return instance
+
+    def evict(self) -> None:
+        """
+        Evicts the least recently used models beyond the budget or maxsize.
+        Must be called with the lock held.
+        """
+        evicted = False
+        while len(self.models) > 1 and (
+            len(self.models) > self.maxsize
+            or sum(self.footprints.values()) > self.budget
+        ):
+            key, _ = self.models.popitem(last=False)
+            self.footprints.pop(key)
+            self.load_times.pop(key)
+            self.evictions += 1
+            evicted = True
+            logging.info(f"Evicted {key[0].__name__} from {key[1]} on {key[2]}.")
+
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.models.clear()
+            self.footprints.clear()
+            self.load_times.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            f"ModelRegistry(size={len(self.models)}, "
+            f"memory={sum(self.footprints.values()) / 2**20:.1f} MiB, "
+            f"hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+            f"load time={sum(self.load_times.values()):.3f} s)"
+        )
+
+
+MODEL_REGISTRY = ModelRegistry()
@@ -1,20 +1,98 @@
-import os
-
-
-def configure_path_to_parameters(
-    DOCKER: bool, DOCKERPATH: str, MRLPATH: str, model_name: str
-) -> str:
-    """
-    Provides the right path depending on whether Gadgetron is being run
-    for local/offline development (i.e., DOCKER=False) or online/real-time
-    deployment (i.e., DOCKER=True). Set the DOCKER variable in load.py.
-
-    :param DOCKER: is this running in the Docker container at the bunker?
-    :param model_name: name of the JIT compiled model.
-    """
-    if DOCKER:
-        path_to_parameters = os.path.join(DOCKERPATH, model_name)
-    else:
-        path_to_parameters = os.path.join(MRLPATH, model_name)
-
-    return path_to_parameters
+import logging
+import os
+
+import torch
+
+
+def configure_path_to_parameters(
+    DOCKER: bool, DOCKERPATH: str, MRLPATH: str, model_name: str
+) -> str:
+    """
+    Provides the right path depending on whether Gadgetron is being run
+    for local/offline development (i.e., DOCKER=False) or online/real-time
+    deployment (i.e., DOCKER=True). Set the DOCKER variable in load.py.
+
+    :param DOCKER: is this running in the Docker container at the bunker?
+    :param model_name: name of the JIT compiled model.
+    """
+    if DOCKER:
+        path_to_parameters = os.path.join(DOCKERPATH, model_name)
+    else:
+        path_to_parameters = os.path.join(MRLPATH, model_name)
+
+    return path_to_parameters
+
+
+def module_memory(module: torch.nn.Module) -> int:
+    """
+    Memory (bytes) taken by the parameters and buffers of a module.
+
+    :param module: the (JIT compiled) module.
+    """
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for tensor in list(module.parameters()) + list(module.buffers())
+    )
+
+
+def set_thread_counts(
+    intra_op_threads: int = None, inter_op_threads: int = None
+) -> None:
+    """
+    Sets the torch thread counts, if given. Both are process-wide settings.
+
+    :param intra_op_threads: threads used within an operator (e.g., a conv).
+    :param inter_op_threads: threads used to run independent operators.
+    """
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+
+    if (
+        inter_op_threads is not None
+        and inter_op_threads != torch.get_num_interop_threads()
+    ):
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as error:  # Only allowed before inter-op work starts.
+            logging.warning(f"Could not set the inter-op thread count: {error}")
+    return None
+
+
+class InferenceModule:
+    """
+    Inference-optimised wrapper of a JIT compiled model: the model is frozen
+    (parameters and attributes folded into constants) and passed through
+    torch.jit.optimize_for_inference (e.g., conv/batch-norm folding, MKLDNN
+    conversion on CPU), and every forward runs under torch.inference_mode.
+    Called like the wrapped model.
+    """
+
+    __slots__ = "model", "channels_last"
+
+    def __init__(
+        self, model: torch.jit.ScriptModule, channels_last: bool = False
+    ) -> None:
+        """
+        :param model: the loaded model, in eval mode.
+        :param channels_last: convert the model and its 4D tensor inputs to the
+            channels-last memory format.
+        """
+        self.channels_last = channels_last
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+
+        self.model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+
+    def __call__(self, *inputs):
+        if self.channels_last:
+            inputs = [
+                (
+                    tensor.contiguous(memory_format=torch.channels_last)
+                    if isinstance(tensor, torch.Tensor) and tensor.dim() == 4
+                    else tensor
+                )
+                for tensor in inputs
+            ]
+
+        with torch.inference_mode():
+            return self.model(*inputs)
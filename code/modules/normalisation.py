@@ -1,26 +1,210 @@
-from abc import ABC, abstractmethod
-import typing
-
-import torch
-import numpy as np
-
-
-class Normalisation(ABC):
-    __slots__ = "unnormalised_data"
-
-    def __init__(
-        self, unnormalised_data: typing.Union[torch.Tensor, np.ndarray]
-    ) -> None:
-        """
-        The unnormalised tensor or array is the input to the constructor
-        of this base class used in each child class.
-        """
-        self.unnormalised_data = unnormalised_data
-
-    @abstractmethod
-    def apply_normalisation(self):
-        pass
-
-    @abstractmethod
-    def apply_inverse_normalisation(self):
-        pass
+from abc import ABC, abstractmethod
+import typing
+
+import torch
+import numpy as np
+
+from modules import normalisation_utils
+
+
+class Normalisation(ABC):
+    __slots__ = "unnormalised_data"
+
+    def __init__(
+        self, unnormalised_data: typing.Union[torch.Tensor, np.ndarray]
+    ) -> None:
+        """
+        The unnormalised tensor or array is the input to the constructor
+        of this base class used in each child class.
+        """
+        self.unnormalised_data = unnormalised_data
+
+    @abstractmethod
+    def apply_normalisation(self):
+        pass
+
+    @abstractmethod
+    def apply_inverse_normalisation(self):
+        pass
+
+
+class PercentileScaleTracker:
+    """
+    Percentile scale of a stream of frames (e.g., a cine series), estimated
+    on the device every refresh_interval frames and, if a momentum is given,
+    smoothed with an exponential moving average across the estimates. The
+    frames in between reuse the current scale and skip the estimate. One
+    tracker is shared by the per-frame normalisation classes of a stream, from
+    a single thread.
+    """
+
+    __slots__ = (
+        "percentile",
+        "method",
+        "bins",
+        "momentum",
+        "refresh_interval",
+        "scale",
+        "frames",
+        "estimates",
+    )
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        method: str = "histogram",
+        bins: int = 2048,
+        momentum: float = None,
+        refresh_interval: int = 1,
+    ) -> None:
+        """
+        :param percentile: the percentile to scale to (typically 95).
+        :param method: "histogram" (within one bin width) or "kthvalue" (see
+            normalisation_utils.retrieve_percentile_scale_tensor).
+        :param bins: the number of histogram bins.
+        :param momentum: weight of a new estimate in the moving average (e.g.,
+            0.1). Every estimate replaces the scale if not given.
+        :param refresh_interval: number of frames between estimates.
+        """
+        self.percentile = percentile
+        self.method = method
+        self.bins = bins
+        self.momentum = momentum
+        self.refresh_interval = refresh_interval
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the scale, e.g., at the start of a new series.
+        """
+        self.scale = None
+        self.frames = 0
+        self.estimates = 0
+        return None
+
+    def update(self, tensor: torch.Tensor) -> torch.Tensor:
+        """
+        Returns the scale for the frame (a 0-dim Tensor on its device),
+        estimating it first if due.
+
+        :param tensor: the unnormalised frame.
+        """
+        if self.scale is None or self.frames % self.refresh_interval == 0:
+            estimate = normalisation_utils.retrieve_percentile_scale_tensor(
+                tensor, self.percentile, self.method, self.bins
+            )
+
+            if self.scale is None or self.momentum is None:
+                self.scale = estimate
+            else:
+                self.scale = torch.lerp(self.scale, estimate, self.momentum)
+
+            self.estimates += 1
+
+        self.frames += 1
+
+        return self.scale
+
+
+class PercentileNormalisation(Normalisation):
+    """
+    Divides a Tensor by its percentile scale (from a tracker shared across
+    frames, or estimated for this frame alone), and multiplies the inferred
+    Tensor back by the same scale.
+    """
+
+    __slots__ = "tracker", "in_place", "scale_val"
+
+    def __init__(
+        self,
+        unnormalised_data: torch.Tensor,
+        tracker: PercentileScaleTracker = None,
+        in_place: bool = False,
+    ) -> None:
+        """
+        :param unnormalised_data: the Tensor to normalise.
+        :param tracker: the scale tracker of the stream. A new tracker (a
+            95th percentile estimate of this frame) is made if not given.
+        :param in_place: normalise the Tensor in place.
+        """
+        super().__init__(unnormalised_data)
+        self.tracker = PercentileScaleTracker() if tracker is None else tracker
+        self.in_place = in_place
+        self.scale_val = None
+
+    def apply_normalisation(self) -> torch.Tensor:
+        self.scale_val = self.tracker.update(self.unnormalised_data)
+
+        if self.in_place:
+            return self.unnormalised_data.div_(self.scale_val)
+
+        return normalisation_utils.divide_tensor_by_scale_val(
+            self.unnormalised_data, self.scale_val
+        )
+
+    def apply_inverse_normalisation(
+        self, normalised_data: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        :param normalised_data: the (inferred) Tensor to scale back.
+        """
+        if self.in_place:
+            return normalised_data.mul_(self.scale_val)
+
+        return normalisation_utils.multiply_tensor_by_scale_val(
+            normalised_data, self.scale_val
+        )
+
+
+class MinMaxNormalisation(Normalisation):
+    """
+    Rescales a Tensor in place to [min_val_desired, max_val_desired] (see
+    normalisation_utils.min_max_scaling_), keeping the measured range for the
+    inverse.
+    """
+
+    __slots__ = "min_val_desired", "max_val_desired", "min_val", "max_val"
+
+    def __init__(
+        self,
+        unnormalised_data: torch.Tensor,
+        min_val_desired: float = 0.0,
+        max_val_desired: float = 1.0,
+    ) -> None:
+        """
+        :param unnormalised_data: the floating point Tensor to normalise (in
+            place).
+        :param min_val_desired: the desired minimum value.
+        :param max_val_desired: the desired maximum value.
+        """
+        super().__init__(unnormalised_data)
+        self.min_val_desired = min_val_desired
+        self.max_val_desired = max_val_desired
+        self.min_val = None
+        self.max_val = None
+
+    def apply_normalisation(self) -> torch.Tensor:
+        self.min_val, self.max_val = torch.aminmax(self.unnormalised_data)
+
+        return normalisation_utils.min_max_scaling_(
+            self.unnormalised_data,
+            self.min_val_desired,
+            self.max_val_desired,
+            self.min_val,
+            self.max_val,
+        )
+
+    def apply_inverse_normalisation(
+        self, normalised_data: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Map the normalised (inferred) Tensor back to the measured range, in
+        place.
+
+        :param normalised_data: the Tensor to scale back.
+        """
+        scale = (self.max_val - self.min_val) / (
+            self.max_val_desired - self.min_val_desired
+        )
+
+        return normalised_data.sub_(self.min_val_desired).mul_(scale).add_(self.min_val)
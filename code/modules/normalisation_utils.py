@@ -1,89 +1,175 @@
-import torch
-import numpy as np
-
-
-def min_max_scaling(
-    tensor: torch.Tensor, min_val_desired: float, max_val_desired: float
-) -> torch.Tensor:
-    """
-    Function to perform min-max scaling.
-
-    :param tensor: A Tensor for this scaling calculation to be based off.
-    :param min_val_desired: The desired minimum value.
-    :param max_val_desired: The desired maximum value.
-    """
-    min_val_measured = torch.min(tensor)
-
-    max_val_measured = torch.max(tensor)
-
-    fraction = torch.div(tensor - min_val_measured, max_val_measured - min_val_measured)
-
-    rescaled_tensor = torch.mul(fraction, max_val_desired - min_val_desired)
-
-    rescaled_tensor = torch.add(rescaled_tensor, min_val_desired)
-
-    return rescaled_tensor
-
-
-def min_max_scaling_numpy(
-    array: np.ndarray, min_val_desired: float, max_val_desired: float
-) -> np.ndarray:
-    """
-    Function to perform min-max scaling.
-
-    :param array: An array for this scaling calculation to be based off.
-    :param min_val_desired: The desired minimum value.
-    :param max_val_desired: The desired maximum value.
-    """
-    min_val_measured = np.amin(array)
-
-    max_val_measured = np.amax(array)
-
-    fraction = np.divide(array - min_val_measured, max_val_measured - min_val_measured)
-
-    rescaled_array = np.multiply(fraction, max_val_desired - min_val_desired)
-
-    rescaled_array = np.add(rescaled_array, min_val_desired)
-
-    return rescaled_array
-
-
-def retrieve_percentile_scale_val(tensor: torch.Tensor, percentile: int) -> float:
-    """
-    Function to retrieve a percentile scaling factor to scale
-    input data between two arbitrary values (typically 0 and 1).
-
-    :param tensor: A Tensor for this scaling calculation to be based off.
-    :param percentile: The percentile to scale to (typically 95).
-    """
-    scale_val = np.percentile(tensor.cpu().detach().numpy(), percentile)
-
-    return scale_val
-
-
-def divide_tensor_by_scale_val(tensor: torch.Tensor, scale_val: float) -> torch.Tensor:
-    """
-    Function to scale a Tensor to a particular scale value.
-
-    :param tensor: A Tensor to be rescaled.
-    :param scale_val: The scale value (could be generate from percentile
-        scaling for example)
-    """
-    rescaled_tensor = torch.div(tensor, scale_val)
-
-    return rescaled_tensor
-
-
-def multiply_tensor_by_scale_val(
-    tensor: torch.Tensor, scale_val: float
-) -> torch.Tensor:
-    """
-    Function to scale a Tensor to a particular scale value.
-
-    :param tensor: A Tensor to be rescaled.
-    :param scale_val: The scale value (could be generate from percentile
-        scaling for example)
-    """
-    rescaled_tensor = torch.mul(tensor, scale_val)
-
-    return rescaled_tensor
+import torch
+import numpy as np
+
+
+def min_max_scaling(
+    tensor: torch.Tensor, min_val_desired: float, max_val_desired: float
+) -> torch.Tensor:
+    """
+    Function to perform min-max scaling.
+
+    :param tensor: A Tensor for this scaling calculation to be based off.
+    :param min_val_desired: The desired minimum value.
+    :param max_val_desired: The desired maximum value.
+    """
+    min_val_measured = torch.min(tensor)
+
+    max_val_measured = torch.max(tensor)
+
+    fraction = torch.div(tensor - min_val_measured, max_val_measured - min_val_measured)
+
+    rescaled_tensor = torch.mul(fraction, max_val_desired - min_val_desired)
+
+    rescaled_tensor = torch.add(rescaled_tensor, min_val_desired)
+
+    return rescaled_tensor
+
+
+def min_max_scaling_(
+    tensor: torch.Tensor,
+    min_val_desired: float,
+    max_val_desired: float,
+    min_val_measured: torch.Tensor = None,
+    max_val_measured: torch.Tensor = None,
+) -> torch.Tensor:
+    """
+    In-place min-max scaling, bit-identical to min_max_scaling: the minimum
+    and maximum are found in a single reduction (unless already measured by
+    the caller) and the tensor is rescaled in place, without temporary
+    tensors. Multiplying by 1 and adding 0 (e.g., scaling to [0, 1]) are
+    skipped.
+
+    :param tensor: A floating point Tensor to rescale in place.
+    :param min_val_desired: The desired minimum value.
+    :param max_val_desired: The desired maximum value.
+    :param min_val_measured: The minimum of the tensor, if already measured.
+    :param max_val_measured: The maximum of the tensor, if already measured.
+    """
+    if min_val_measured is None or max_val_measured is None:
+        min_val_measured, max_val_measured = torch.aminmax(tensor)
+
+    tensor.sub_(min_val_measured).div_(max_val_measured - min_val_measured)
+
+    if max_val_desired - min_val_desired != 1:
+        tensor.mul_(max_val_desired - min_val_desired)
+
+    if min_val_desired != 0:
+        tensor.add_(min_val_desired)
+
+    return tensor
+
+
+def min_max_scaling_numpy(
+    array: np.ndarray, min_val_desired: float, max_val_desired: float
+) -> np.ndarray:
+    """
+    Function to perform min-max scaling.
+
+    :param array: An array for this scaling calculation to be based off.
+    :param min_val_desired: The desired minimum value.
+    :param max_val_desired: The desired maximum value.
+    """
+    min_val_measured = np.amin(array)
+
+    max_val_measured = np.amax(array)
+
+    fraction = np.divide(array - min_val_measured, max_val_measured - min_val_measured)
+
+    rescaled_array = np.multiply(fraction, max_val_desired - min_val_desired)
+
+    rescaled_array = np.add(rescaled_array, min_val_desired)
+
+    return rescaled_array
+
+
+def retrieve_percentile_scale_val(tensor: torch.Tensor, percentile: int) -> float:
+    """
+    Function to retrieve a percentile scaling factor to scale
+    input data between two arbitrary values (typically 0 and 1).
+
+    :param tensor: A Tensor for this scaling calculation to be based off.
+    :param percentile: The percentile to scale to (typically 95).
+    """
+    scale_val = np.percentile(tensor.cpu().detach().numpy(), percentile)
+
+    return scale_val
+
+
+def retrieve_percentile_scale_tensor(
+    tensor: torch.Tensor, percentile: float, method: str = "kthvalue", bins: int = 2048
+) -> torch.Tensor:
+    """
+    Function to retrieve a percentile scaling factor on the device of the
+    tensor, as a 0-dim Tensor, without copying the tensor to the host or
+    waiting for the device.
+
+    "kthvalue" selects the two values around the percentile (no full sort)
+    and interpolates linearly between them, as np.percentile does.
+    "histogram" bins the values between their minimum and maximum and
+    interpolates within the bin holding the percentile: a single pass over
+    the data after the min/max reduction, accurate to within one bin width,
+    i.e. (max - min) / bins.
+
+    :param tensor: A Tensor for this scaling calculation to be based off.
+    :param percentile: The percentile to scale to (typically 95).
+    :param method: "kthvalue" or "histogram".
+    :param bins: The number of histogram bins.
+    """
+    flat_tensor = tensor.detach().reshape(-1).float()
+
+    if method == "kthvalue":
+        position = percentile / 100 * (flat_tensor.numel() - 1)
+        lower = int(position)
+        lower_val = torch.kthvalue(flat_tensor, lower + 1).values
+
+        if position == lower:
+            return lower_val
+
+        upper_val = torch.kthvalue(flat_tensor, lower + 2).values
+
+        return torch.lerp(lower_val, upper_val, position - lower)
+
+    if method == "histogram":
+        min_val, max_val = torch.aminmax(flat_tensor)
+        # min = max = 0 bins between the minimum and maximum of the data.
+        histogram = torch.histc(flat_tensor, bins=bins, min=0, max=0)
+        cumulative = torch.cumsum(histogram, dim=0)
+
+        target = torch.tensor(
+            percentile / 100 * flat_tensor.numel(), device=flat_tensor.device
+        )
+        index = torch.searchsorted(cumulative, target).clamp(max=bins - 1)
+        below = cumulative[index] - histogram[index]
+        fraction = ((target - below) / histogram[index].clamp(min=1)).clamp(0, 1)
+
+        return min_val + (index + fraction) * (max_val - min_val) / bins
+
+    raise ValueError(f"Unknown percentile method: {method}")
+
+
+def divide_tensor_by_scale_val(tensor: torch.Tensor, scale_val: float) -> torch.Tensor:
+    """
+    Function to scale a Tensor to a particular scale value.
+
+    :param tensor: A Tensor to be rescaled.
+    :param scale_val: The scale value (could be generate from percentile
+        scaling for example)
+    """
+    rescaled_tensor = torch.div(tensor, scale_val)
+
+    return rescaled_tensor
+
+
+def multiply_tensor_by_scale_val(
+    tensor: torch.Tensor, scale_val: float
+) -> torch.Tensor:
+    """
+    Function to scale a Tensor to a particular scale value.
+
+    :param tensor: A Tensor to be rescaled.
+    :param scale_val: The scale value (could be generate from percentile
+        scaling for example)
+    """
+    rescaled_tensor = torch.mul(tensor, scale_val)
+
+    return rescaled_tensor
@@ -0,0 +1,201 @@
+"""
+In this module, the ONNX Runtime inference engine is stored. Models exported
+with tools/export_onnx.py (.onnx parameter files) are run in an ONNX Runtime
+CPU session instead of TorchScript. onnxruntime is an optional dependency,
+only imported when an .onnx model is loaded.
+"""
+
+import logging
+import threading
+
+import numpy as np
+import torch
+
+# Graph optimisation levels, as names of onnxruntime.GraphOptimizationLevel.
+GRAPH_OPTIMISATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+# Model metadata key of the upsampling scale written by tools/export_onnx.py.
+SCALE_METADATA = "upsample_scale"
+
+
+class OnnxRuntimeModule:
+    """
+    ONNX Runtime CPU session called like the TorchScript model it replaces
+    (torch tensors in, torch tensor out). Inputs are bound in place and the
+    output is written into preallocated tensors with I/O binding, so no
+    per-frame allocation or copy is made by the session. The output tensors
+    are reused in turn, so buffer_count must exceed the number of inferred
+    frames that can be held at once (e.g., queued in the pipeline).
+    """
+
+    __slots__ = (
+        "session",
+        "binding",
+        "input_names",
+        "output_name",
+        "output_dimensions",
+        "scale",
+        "buffers",
+        "buffer_count",
+        "index",
+        "lock",
+    )
+
+    def __init__(
+        self,
+        path_to_parameters: str,
+        intra_op_threads: int = None,
+        inter_op_threads: int = None,
+        graph_optimisation: str = "all",
+        buffer_count: int = 16,
+    ) -> None:
+        """
+        :param path_to_parameters: path to the .onnx model.
+        :param intra_op_threads: session intra-op thread count (ONNX Runtime
+            default if None).
+        :param inter_op_threads: session inter-op thread count (ONNX Runtime
+            default if None).
+        :param graph_optimisation: graph optimisation level ("disable",
+            "basic", "extended" or "all").
+        :param buffer_count: number of preallocated outputs per output shape.
+        """
+        import onnxruntime
+
+        if graph_optimisation not in GRAPH_OPTIMISATION_LEVELS:
+            raise ValueError(
+                "graph_optimisation must be one of "
+                f"{list(GRAPH_OPTIMISATION_LEVELS)}, got {graph_optimisation}"
+            )
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = getattr(
+            onnxruntime.GraphOptimizationLevel,
+            GRAPH_OPTIMISATION_LEVELS[graph_optimisation],
+        )
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads is not None:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+
+        self.session = onnxruntime.InferenceSession(
+            path_to_parameters, options, providers=["CPUExecutionProvider"]
+        )
+        self.binding = self.session.io_binding()
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.output_name = self.session.get_outputs()[0].name
+        self.output_dimensions = list(self.session.get_outputs()[0].shape)
+        scale = self.session.get_modelmeta().custom_metadata_map.get(SCALE_METADATA)
+        self.scale = None if scale is None else int(scale)
+        self.buffers = {}
+        self.index = 0
+        self.buffer_count = buffer_count
+        self.lock = threading.Lock()  # The binding is shared between calls.
+
+        logging.debug(
+            f"ONNX Runtime session: inputs {self.input_names}, "
+            f"output {self.output_name}, providers {self.session.get_providers()}"
+        )
+
+    def output_buffer(self, shape: tuple) -> torch.Tensor:
+        """
+        Returns the next preallocated output tensor of the given shape.
+
+        :param shape: the shape of the output.
+        """
+        buffers = self.buffers.get(shape)
+        if buffers is None:
+            buffers = [
+                torch.empty(shape, dtype=torch.float32)
+                for _ in range(self.buffer_count)
+            ]
+            self.buffers[shape] = buffers
+
+        self.index = (self.index + 1) % len(buffers)
+
+        return buffers[self.index]
+
+    def __call__(self, *inputs) -> torch.Tensor:
+        inputs = [
+            torch.as_tensor(tensor).detach().cpu().contiguous() for tensor in inputs
+        ]
+        if len(inputs) < len(self.input_names):
+            raise ValueError(
+                f"The ONNX model expects {len(self.input_names)} inputs, "
+                f"got {len(inputs)}"
+            )
+
+        with self.lock:
+            return self.run(inputs)
+
+    def run(self, inputs: list) -> torch.Tensor:
+        """
+        Binds the inputs and the next output buffer, and runs the session.
+
+        :param inputs: contiguous CPU tensors, in the order of the model inputs.
+        """
+        for name, tensor in zip(self.input_names, inputs):
+            self.binding.bind_input(
+                name,
+                "cpu",
+                0,
+                _NUMPY_DTYPES[tensor.dtype],
+                tuple(tensor.shape),
+                tensor.data_ptr(),
+            )
+
+        output_shape = self.output_shape(inputs[0].shape)
+        if output_shape is None:
+            # Output shape depends on input values: let the session allocate it.
+            self.binding.bind_output(self.output_name, "cpu")
+            self.session.run_with_iobinding(self.binding)
+            output = torch.from_numpy(self.binding.copy_outputs_to_cpu()[0])
+        else:
+            output = self.output_buffer(output_shape)
+            self.binding.bind_output(
+                self.output_name,
+                "cpu",
+                0,
+                np.float32,
+                output_shape,
+                output.data_ptr(),
+            )
+            self.session.run_with_iobinding(self.binding)
+
+        self.binding.clear_binding_inputs()
+        self.binding.clear_binding_outputs()
+
+        return output
+
+    def output_shape(self, input_shape: tuple) -> tuple:
+        """
+        The output shape for an input shape, from the model's output shape
+        with the (dynamic) batch dimension taken from the input, and the
+        (dynamic) height and width those of the input times the upsampling
+        scale of the model. None if the output shape cannot be known from the
+        input shape (e.g., other dynamic dimensions, or no scale stored).
+
+        :param input_shape: the shape of the first input.
+        """
+        shape = list(self.output_dimensions)
+        shape[0] = input_shape[0]
+        if self.scale is not None and len(shape) == len(input_shape) == 4:
+            shape[2:] = [dimension * self.scale for dimension in input_shape[2:]]
+
+        if not all(isinstance(dimension, int) for dimension in shape):
+            return None
+
+        return tuple(shape)
+
+
+_NUMPY_DTYPES = {
+    torch.float32: np.float32,
+    torch.float16: np.float16,
+    torch.int64: np.int64,
+    torch.int32: np.int32,
+}
@@ -0,0 +1,63 @@
+"""
+In this module, the synthetic frames used when no recorded stream is
+available are stored: a modified Shepp-Logan phantom, and acquisition data
+of it as received by the gadgets (e.g., for the start-up self-checks, the
+calibration of the quantised model and the benchmarks).
+"""
+
+import numpy as np
+
+# Magnitude of the phantom in acquisition data, roughly the range of the
+# Gadgetron ScaleGadget output received by the gadgets.
+ACQUISITION_SCALE = 1000.0
+
+# Modified Shepp-Logan ellipses: (intensity, a, b, x0, y0, angle in degrees).
+SHEPP_LOGAN_ELLIPSES = (
+    (1.0, 0.69, 0.92, 0.0, 0.0, 0.0),
+    (-0.8, 0.6624, 0.874, 0.0, -0.0184, 0.0),
+    (-0.2, 0.11, 0.31, 0.22, 0.0, -18.0),
+    (-0.2, 0.16, 0.41, -0.22, 0.0, 18.0),
+    (0.1, 0.21, 0.25, 0.0, 0.35, 0.0),
+    (0.1, 0.046, 0.046, 0.0, 0.1, 0.0),
+    (0.1, 0.046, 0.046, 0.0, -0.1, 0.0),
+    (0.1, 0.046, 0.023, -0.08, -0.605, 0.0),
+    (0.1, 0.023, 0.023, 0.0, -0.606, 0.0),
+    (0.1, 0.023, 0.046, 0.06, -0.605, 0.0),
+)
+
+
+def shepp_logan(sdim: int, shift: tuple = (0.0, 0.0)) -> np.ndarray:
+    """
+    Returns a (sdim, sdim) modified Shepp-Logan phantom.
+
+    :param sdim: the matrix size.
+    :param shift: (x, y) shift of the phantom, as a fraction of the FOV.
+    """
+    coordinates = np.linspace(-1.0, 1.0, sdim)
+    x, y = np.meshgrid(coordinates - shift[0], coordinates - shift[1])
+    phantom = np.zeros((sdim, sdim))
+
+    for intensity, a, b, x0, y0, angle in SHEPP_LOGAN_ELLIPSES:
+        theta = np.deg2rad(angle)
+        x_rotated = (x - x0) * np.cos(theta) + (y - y0) * np.sin(theta)
+        y_rotated = -(x - x0) * np.sin(theta) + (y - y0) * np.cos(theta)
+        phantom[(x_rotated / a) ** 2 + (y_rotated / b) ** 2 <= 1.0] += intensity
+
+    return phantom
+
+
+def acquisition_data(sdim: int, repetition: int = 0, motion: float = 0.0) -> np.ndarray:
+    """
+    Returns complex64 acquisition data of shape (sdim, sdim, 1, 1, 1, 1, 1),
+    as received by the gadgets, of the phantom scaled by ACQUISITION_SCALE and
+    moving in a circle over 16 repetitions.
+
+    :param sdim: the matrix size.
+    :param repetition: the repetition, i.e., the position of the phantom.
+    :param motion: amplitude of the shift (fraction of FOV).
+    """
+    phase = 2 * np.pi * repetition / 16
+    phantom = shepp_logan(sdim, (motion * np.sin(phase), motion * np.cos(phase)))
+    data = (ACQUISITION_SCALE * phantom).astype(np.complex64)
+
+    return data.reshape(sdim, sdim, 1, 1, 1, 1, 1)
@@ -0,0 +1,257 @@
+"""
+In this module, the executors used by the gadgets to push each acquisition
+through their processing stages are stored. A stage is simply a named
+callable taking the output of the previous stage (the first stage receives
+the acquisition itself).
+
+SequentialExecutor: runs every stage for a frame before starting the next frame.
+PipelinedExecutor: runs each stage in its own worker thread, joined by bounded
+    queues, so consecutive frames overlap (e.g., frame N+1 is pretransformed
+    and inferred while frame N is packed and sent).
+
+Both executors preserve the order of the frames and return a
+PipelineStatistics object with throughput and per-frame latency.
+"""
+
+from dataclasses import dataclass, field
+import logging
+import queue
+import threading
+import time
+import typing
+
+import numpy as np
+
+_SENTINEL = object()  # Marks the end of the stream between stages.
+
+
+@dataclass
+class PipelineStatistics:
+    """
+    Throughput and per-frame latency (seconds) of an executor run.
+    """
+
+    frames: int = 0
+    elapsed: float = 0.0
+    latencies: list = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Frames processed per second.
+        """
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def latency_percentile(self, percentile: float) -> float:
+        """
+        :param percentile: The percentile of the per-frame latency (e.g., 95).
+        """
+        if not self.latencies:
+            return 0.0
+
+        return float(np.percentile(self.latencies, percentile))
+
+    def summary(self) -> str:
+        return (
+            f"{self.frames} frames in {self.elapsed:.3f} s "
+            f"({self.throughput:.1f} frames/s), latency "
+            f"p50: {1e3 * self.latency_percentile(50):.2f} ms, "
+            f"p95: {1e3 * self.latency_percentile(95):.2f} ms, "
+            f"max: {1e3 * self.latency_percentile(100):.2f} ms"
+        )
+
+
+class SequentialExecutor:
+    """
+    Runs every stage for one frame before starting the next frame. This is the
+    behaviour of the original gadget loops.
+    """
+
+    __slots__ = "stages"
+
+    def __init__(self, stages: typing.Sequence[tuple]) -> None:
+        """
+        :param stages: (name, callable) pairs, in processing order.
+        """
+        self.stages = list(stages)
+
+    @property
+    def max_in_flight(self) -> int:
+        """
+        The most frames between the start of the first stage and the end of
+        the last stage at once.
+        """
+        return 1
+
+    def run(self, source: typing.Iterable) -> PipelineStatistics:
+        """
+        Push every item of the source (e.g., the Gadgetron connection) through
+        all stages.
+
+        :param source: An iterable of frames.
+        """
+        statistics = PipelineStatistics()
+        start_run = time.perf_counter()
+
+        for item in source:
+            start_frame = time.perf_counter()
+
+            for _, function in self.stages:
+                item = function(item)
+
+            statistics.latencies.append(time.perf_counter() - start_frame)
+            statistics.frames += 1
+
+        statistics.elapsed = time.perf_counter() - start_run
+
+        return statistics
+
+
+class PipelinedExecutor:
+    """
+    Runs each stage in its own worker thread. Stages are joined by FIFO
+    queues bounded by queue_depth, so a slow stage back-pressures the ones
+    before it instead of buffering frames without limit. With a single worker
+    per stage and FIFO queues, frames leave the pipeline in arrival order.
+    """
+
+    __slots__ = "stages", "queue_depth"
+
+    def __init__(self, stages: typing.Sequence[tuple], queue_depth: int = 2) -> None:
+        """
+        :param stages: (name, callable) pairs, in processing order.
+        :param queue_depth: Maximum number of frames waiting between two stages.
+        """
+        if queue_depth < 1:
+            raise ValueError(f"queue_depth must be at least 1, got {queue_depth}")
+
+        self.stages = list(stages)
+        self.queue_depth = queue_depth
+
+    @property
+    def max_in_flight(self) -> int:
+        """
+        The most frames between the start of the first stage and the end of
+        the last stage at once: one in every stage (a stage blocked on a full
+        outbox still holds its frame) and queue_depth in every queue between
+        two stages.
+        """
+        return len(self.stages) + (len(self.stages) - 1) * self.queue_depth
+
+    def run(self, source: typing.Iterable) -> PipelineStatistics:
+        """
+        Push every item of the source (e.g., the Gadgetron connection) through
+        all stages. The source is consumed in the calling thread. The first
+        exception raised by any stage stops the pipeline and is re-raised here.
+
+        :param source: An iterable of frames.
+        """
+        statistics = PipelineStatistics()
+        queues = [
+            queue.Queue(maxsize=self.queue_depth) for _ in range(len(self.stages) + 1)
+        ]
+        stop_event = threading.Event()
+        errors = []
+
+        def put(target: queue.Queue, item) -> bool:
+            # Poll so a failed downstream stage cannot leave us blocked forever.
+            while not stop_event.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(name: str, function: typing.Callable, inbox, outbox) -> None:
+            while True:
+                try:
+                    item = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    if stop_event.is_set():
+                        return None
+                    continue
+
+                if item is _SENTINEL:
+                    put(outbox, _SENTINEL)
+                    return None
+
+                start_frame, payload = item
+                try:
+                    payload = function(payload)
+                except BaseException as error:
+                    logging.error(f"Pipeline stage '{name}' failed: {error}")
+                    errors.append(error)
+                    stop_event.set()
+                    return None
+
+                if not put(outbox, (start_frame, payload)):
+                    return None
+
+        def collector(inbox) -> None:
+            while True:
+                try:
+                    item = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    if stop_event.is_set():
+                        return None
+                    continue
+
+                if item is _SENTINEL:
+                    return None
+
+                statistics.latencies.append(time.perf_counter() - item[0])
+                statistics.frames += 1
+
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(name, function, queues[index], queues[index + 1]),
+                name=f"pipeline-{name}",
+                daemon=True,
+            )
+            for index, (name, function) in enumerate(self.stages)
+        ]
+        threads.append(
+            threading.Thread(
+                target=collector, args=(queues[-1],), name="pipeline-collector"
+            )
+        )
+
+        start_run = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in source:
+                if not put(queues[0], (time.perf_counter(), item)):
+                    break
+        except BaseException:
+            stop_event.set()
+            raise
+        finally:
+            put(queues[0], _SENTINEL)
+
+            for thread in threads:
+                thread.join()
+
+        statistics.elapsed = time.perf_counter() - start_run
+
+        if errors:
+            raise errors[0]
+
+        return statistics
+
+
+def create_executor(stages: typing.Sequence[tuple], queue_depth: int):
+    """
+    Returns a PipelinedExecutor, or the SequentialExecutor if queue_depth is 0.
+
+    :param stages: (name, callable) pairs, in processing order.
+    :param queue_depth: Maximum number of frames waiting between two stages.
+    """
+    if queue_depth == 0:
+        return SequentialExecutor(stages)
+
+    return PipelinedExecutor(stages, queue_depth)
@@ -1,24 +1,33 @@
-import torch
-from abc import ABC, abstractmethod
-
-
-class Posttransformations(ABC):
-    """
-    Parent class for pretransformations, abstract methods are
-    defined here.
-    """
-
-    __slots__ = "inferred_tensor"
-
-    def __init__(self, inferred_tensor: torch.Tensor) -> None:
-        """
-        Constructor calls inferred tensor after neural network inference.
-
-        :param inferred_tensor: The inferred tensor.
-        :param device: device to run inference on.
-        """
-        self.inferred_tensor = inferred_tensor
-
-    @abstractmethod
-    def posttransform(self):
-        pass
+import torch
+from abc import ABC, abstractmethod
+
+from modules import staging
+
+
+class Posttransformations(ABC):
+    """
+    Parent class for pretransformations, abstract methods are
+    defined here.
+    """
+
+    __slots__ = "inferred_tensor", "buffer_pool"
+
+    def __init__(
+        self,
+        inferred_tensor: torch.Tensor,
+        buffer_pool: staging.StagingBufferPool = None,
+    ) -> None:
+        """
+        Constructor calls inferred tensor after neural network inference.
+
+        :param inferred_tensor: The inferred tensor.
+        :param buffer_pool: pool of preallocated (pinned) host Tensors to copy
+            the inferred tensor into from the device. A new host Tensor is
+            allocated for every frame if not given.
+        """
+        self.inferred_tensor = inferred_tensor
+        self.buffer_pool = buffer_pool
+
+    @abstractmethod
+    def posttransform(self):
+        pass
@@ -1,46 +1,51 @@
-import numpy as np
-
-from modules import (
-    normalisation,
-    transformations,
-    transformation_utils,
-)
-
-
-class BaseImageArrayNormalisation(normalisation.Normalisation):
-    def apply_normalisation(self) -> np.ndarray:
-        """
-        Apply the normalisation and store the relevant values for inverse
-        normalisation if applicable.
-
-        :param unnormalised_data: The data to be normalised.
-        """
-        normalised_array = self.unnormalised_data
-
-        return normalised_array
-
-    def apply_inverse_normalisation(self) -> None:
-        pass
-
-
-class BaseImageArrayTransformations(transformations.Transformations):
-    def transform(self) -> np.ndarray:
-        """
-        The transformations required to process the data in a form compatible
-        with the struct and the rest of Gadgetron are stored here.
-        """
-        transformed_data = transformation_utils.reshape_numpy(
-            self.gadgetron_array,
-            (
-                self.gadgetron_array.shape[0],
-                self.gadgetron_array.shape[1],
-                self.gadgetron_array.shape[2],
-                self.gadgetron_array.shape[3],
-            ),
-        )
-
-        transformed_data = transformation_utils.rotate_numpy(
-            transformed_data, num_rotation=2, axes=(0, 1)
-        )
-
-        return transformed_data
+import numpy as np
+
+from modules import (
+    normalisation,
+    transformations,
+    transformation_utils,
+)
+
+
+class BaseImageArrayNormalisation(normalisation.Normalisation):
+    def apply_normalisation(self) -> np.ndarray:
+        """
+        Apply the normalisation and store the relevant values for inverse
+        normalisation if applicable.
+
+        :param unnormalised_data: The data to be normalised.
+        """
+        normalised_array = self.unnormalised_data
+
+        return normalised_array
+
+    def apply_inverse_normalisation(self) -> None:
+        pass
+
+
+class BaseImageArrayTransformations(transformations.Transformations):
+    __slots__ = "plan"
+
+    def __init__(self, gadgetron_array: np.ndarray) -> None:
+        """
+        :param gadgetron_array: The numpy array from Gadgetron.
+        """
+        super().__init__(gadgetron_array)
+        # Reshape to the first four dimensions and rotate by 180 degrees,
+        # composed into a single strided view (see TransformationPlan).
+        self.plan = (
+            transformation_utils.TransformationPlan()
+            .reshape(lambda shape: shape[:4])
+            .rotate(2, axes=(0, 1))
+        )
+
+    def transform(self) -> np.ndarray:
+        """
+        The transformations required to process the data in a form compatible
+        with the struct and the rest of Gadgetron are stored here. The result
+        is a view onto the Gadgetron array: nothing is copied until the image
+        is packed (or sent back to Gadgetron).
+        """
+        transformed_data = self.plan.view(self.gadgetron_array)
+
+        return transformed_data
@@ -1,104 +1,152 @@
-import logging
-import time
-
-import numpy as np
-import torch
-
-from modules import (
-    dimensions,
-    model,
-    pretransformations,
-    posttransformations,
-    transformation_utils,
-)
-
-
-class BicubicDimensions(dimensions.Dimensions):
-    """
-    Bicubic dimensions class. Store data here.
-    """
-
-    input_dimensions: tuple = (1, 1, 64, 64)
-    output_dimensions: tuple = (256, 256, 1, 1)
-
-
-class BicubicModel(model.Model):
-    """
-    Child class of Model. Methods specific to application are defined here.
-    """
-
-    def initialise_gpu(self, model: torch.nn.Module) -> None:
-        """
-        Pass through some random input to warm the GPU up for real-time
-        streaming.
-
-        :param model: the loaded in model
-        """
-        logging.info("Warming up GPU.")
-        model(
-            torch.rand(BicubicDimensions.input_dimensions).to(
-                self.device, dtype=torch.float
-            ),
-            torch.tensor(BicubicDimensions.input_dimensions[-1]),
-            torch.tensor(
-                BicubicDimensions.output_dimensions[0]
-            ),  # Additional argument required for bicubic.
-        )
-
-        return None
-
-    def perform_inference(self, input_data: torch.Tensor) -> torch.Tensor:
-        """
-        Perform inference on a pretransformed, normalised input tensor.
-        """
-        start_inference = time.time()
-        image_superresolution = self.model(
-            input_data,
-            torch.tensor(BicubicDimensions.input_dimensions[-1]),
-            torch.tensor(BicubicDimensions.output_dimensions[0]),
-        )
-        logging.info(f"Bicubic inference time: {time.time()-start_inference:.5f}")
-
-        return image_superresolution
-
-
-class BicubicPretransformations(pretransformations.Pretransformations):
-    def pretransform(self) -> torch.Tensor:
-        """
-        This method is responsible for defining the specific pretransformation
-        steps for the application. The helper functions from transformation_utils
-        can be utilised here depending on use-case. Specific, non-transferrable
-        transformations are encouraged to be defined in this child class.
-        """
-        tensor_data = transformation_utils.convert_numpy2tensor(
-            self.gadgetron_array, self.device  # Shape (sdim, sdim, 1, 1, 1, 1, 1)
-        )
-
-        tensor_data = transformation_utils.squeeze(tensor_data)
-
-        tensor_data = transformation_utils.rotate(
-            transformation_utils.get_magnitude_tensor(tensor_data), num_rotation=2
-        )
-
-        tensor_data = transformation_utils.unsqueeze(tensor_data)
-
-        tensor_data = transformation_utils.unsqueeze(tensor_data)
-
-        return tensor_data
-
-
-class BicubicPosttransformations(posttransformations.Posttransformations):
-    def posttransform(self) -> np.ndarray:
-        """
-        This method is responsible for defining the specific posttransformation
-        steps for the application. The helper functions from transformation_utils
-        can be utilised here depending on use-case. Specific, non-transferrable
-        transformations are encouraged to be defined in this child class.
-        """
-        tensor_data = transformation_utils.reshape(
-            self.inferred_tensor, BicubicDimensions.output_dimensions
-        )
-
-        array_data = transformation_utils.convert_tensor2numpy(tensor_data)
-
-        return array_data
+import logging
+import time
+
+import numpy as np
+import torch
+
+from modules import (
+    dimensions,
+    model,
+    pretransformations,
+    posttransformations,
+    transformation_utils,
+)
+
+
+class BicubicDimensions(dimensions.Dimensions):
+    """
+    Bicubic dimensions class. Store data here.
+    """
+
+    input_dimensions: tuple = (1, 1, 64, 64)
+    output_dimensions: tuple = (256, 256, 1, 1)
+
+
+class BicubicModel(model.Model):
+    """
+    Child class of Model. Methods specific to application are defined here.
+    """
+
+    def initialise_gpu(self, model: torch.nn.Module) -> None:
+        """
+        Pass through some random input of the default dimensions to warm the
+        GPU up for real-time streaming.
+
+        :param model: the loaded in model
+        """
+        logging.info("Warming up GPU.")
+        self.prepare(BicubicDimensions.input_dimensions)
+
+        return None
+
+    def allocate_buffers(self, input_dimensions: tuple) -> dict:
+        """
+        The input and output sizes passed to the model with every frame of
+        the input shape (additional arguments required for bicubic).
+
+        :param input_dimensions: the (N, C, H, W) input dimensions.
+        """
+        dimensions = BicubicDimensions.from_matrix_size(input_dimensions[-2:])
+
+        return {
+            "input_size": torch.tensor(dimensions.input_dimensions[-1]),
+            "output_size": torch.tensor(dimensions.output_dimensions[1]),
+        }
+
+    def perform_inference(self, input_data: torch.Tensor) -> torch.Tensor:
+        """
+        Perform inference on a pretransformed, normalised input tensor. A new
+        input shape is warmed up first.
+        """
+        buffers = self.prepare(input_data.shape)
+
+        image_superresolution = self.model(
+            input_data, buffers["input_size"], buffers["output_size"]
+        )
+
+        return image_superresolution
+
+
+# Inference engines of the bicubic model: (model class, parameter file).
+BICUBIC_ENGINES = {
+    "torchscript": (BicubicModel, "64_to_256_bicubic_interpolation_JIT.pt"),
+    "onnxruntime": (BicubicModel, "64_to_256_bicubic_interpolation_JIT.onnx"),
+}
+
+
+class BicubicPretransformations(pretransformations.Pretransformations):
+    # Squeeze, rotation by 180 degrees and batch/channel dimensions of the
+    # pooled path, composed into one view of the Gadgetron array.
+    PLAN = (
+        transformation_utils.TransformationPlan()
+        .reshape(lambda shape: tuple(size for size in shape if size != 1))
+        .rotate(2)
+        .reshape(lambda shape: (1, 1) + shape)
+    )
+
+    def pretransform(self) -> torch.Tensor:
+        """
+        This method is responsible for defining the specific pretransformation
+        steps for the application. The helper functions from transformation_utils
+        can be utilised here depending on use-case. Specific, non-transferrable
+        transformations are encouraged to be defined in this child class.
+        """
+        if self.buffer_pool is not None:
+            return self.pretransform_pooled()
+
+        tensor_data = transformation_utils.convert_numpy2tensor(
+            self.gadgetron_array, self.device  # Shape (sdim, sdim, 1, 1, 1, 1, 1)
+        )
+
+        tensor_data = transformation_utils.squeeze(tensor_data)
+
+        tensor_data = transformation_utils.rotate(
+            transformation_utils.get_magnitude_tensor(tensor_data), num_rotation=2
+        )
+
+        tensor_data = transformation_utils.unsqueeze(tensor_data)
+
+        tensor_data = transformation_utils.unsqueeze(tensor_data)
+
+        return tensor_data
+
+    def pretransform_pooled(self) -> torch.Tensor:
+        """
+        The same steps written into pooled Tensors: the rotated complex frame
+        is materialised once into a (pinned) host Tensor, copied to the device
+        without blocking, and its magnitude is written into a pooled Tensor.
+        """
+        tensor_data = transformation_utils.stage_numpy2tensor(
+            self.gadgetron_array, self.PLAN, self.buffer_pool, self.device
+        )
+
+        magnitude = self.buffer_pool.get(
+            tensor_data.shape, tensor_data.real.dtype, self.device
+        )
+
+        return transformation_utils.get_magnitude_tensor(tensor_data, out=magnitude)
+
+
+class BicubicPosttransformations(posttransformations.Posttransformations):
+    def posttransform(self) -> np.ndarray:
+        """
+        This method is responsible for defining the specific posttransformation
+        steps for the application. The helper functions from transformation_utils
+        can be utilised here depending on use-case. Specific, non-transferrable
+        transformations are encouraged to be defined in this child class.
+        """
+        # The output size follows the input size (e.g., other matrix sizes).
+        tensor_data = transformation_utils.reshape(
+            self.inferred_tensor,
+            tuple(self.inferred_tensor.shape[-2:])
+            + BicubicDimensions.output_dimensions[2:],
+        )
+
+        if self.buffer_pool is None:
+            array_data = transformation_utils.convert_tensor2numpy(tensor_data)
+        else:
+            array_data = transformation_utils.stage_tensor2numpy(
+                tensor_data, self.buffer_pool
+            )
+
+        return array_data
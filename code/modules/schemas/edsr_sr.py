@@ -1,98 +1,183 @@
-from dataclasses import dataclass
-import logging
-import time
-
-import numpy as np
-import torch
-
-from modules import (
-    dimensions,
-    model,
-    pretransformations,
-    posttransformations,
-    transformation_utils,
-)
-
-
-@dataclass
-class EdsrDimensions(dimensions.Dimensions):
-    """
-    Edsr dimensions class. Store data here.
-    """
-
-    input_dimensions: tuple = (1, 1, 64, 64)
-    output_dimensions: tuple = (256, 256, 1, 1)
-
-
-class EdsrModel(model.Model):
-    """
-    Child class of Model. Methods specific to application are defined here.
-    """
-
-    def initialise_gpu(self, model: torch.nn.Module) -> None:
-        """
-        Pass through some random input to warm the GPU up for real-time
-        streaming.
-
-        :param model: the loaded in model
-        """
-        logging.info("Warming up GPU.")
-        model(
-            torch.rand(EdsrDimensions.input_dimensions).to(
-                self.device, dtype=torch.float
-            )
-        )
-
-        return None
-
-    def perform_inference(self, input_data: torch.Tensor) -> torch.Tensor:
-        """
-        Perform inference on a pretransformed, normalised input tensor.
-        """
-        start_inference = time.time()
-        image_superresolution = self.model(input_data)
-        logging.info(f"Edsr inference time: {time.time()-start_inference:.5f}")
-
-        return image_superresolution
-
-
-class EdsrPretransformations(pretransformations.Pretransformations):
-    def pretransform(self) -> torch.Tensor:
-        """
-        This method is responsible for defining the specific pretransformation
-        steps for the application. The helper functions from transformation_utils
-        can be utilised here depending on use-case. Specific, non-transferrable
-        transformations are encouraged to be defined in this child class.
-        """
-        tensor_data = transformation_utils.convert_numpy2tensor(
-            self.gadgetron_array, self.device  # Shape (sdim, sdim, 1, 1, 1, 1, 1)
-        )
-
-        tensor_data = transformation_utils.squeeze(tensor_data)
-
-        tensor_data = transformation_utils.get_magnitude_tensor(tensor_data)
-
-        tensor_data = transformation_utils.rotate(tensor_data, num_rotation=2)
-
-        tensor_data = transformation_utils.unsqueeze(tensor_data)
-
-        tensor_data = transformation_utils.unsqueeze(tensor_data)
-
-        return tensor_data
-
-
-class EdsrPosttransformations(posttransformations.Posttransformations):
-    def posttransform(self) -> np.ndarray:
-        """
-        This method is responsible for defining the specific posttransformation
-        steps for the application. The helper functions from transformation_utils
-        can be utilised here depending on use-case. Specific, non-transferrable
-        transformations are encouraged to be defined in this child class.
-        """
-        tensor_data = transformation_utils.reshape(
-            self.inferred_tensor, EdsrDimensions.output_dimensions
-        )
-
-        array_data = transformation_utils.convert_tensor2numpy(tensor_data)
-
-        return array_data
+from dataclasses import dataclass
+import logging
+import time
+
+import numpy as np
+import torch
+
+from modules import (
+    dimensions,
+    model,
+    phantom,
+    pretransformations,
+    posttransformations,
+    transformation_utils,
+)
+
+
+@dataclass
+class EdsrDimensions(dimensions.Dimensions):
+    """
+    Edsr dimensions class. Store data here.
+    """
+
+    input_dimensions: tuple = (1, 1, 64, 64)
+    output_dimensions: tuple = (256, 256, 1, 1)
+
+
+class EdsrModel(model.Model):
+    """
+    Child class of Model. Methods specific to application are defined here.
+    """
+
+    def initialise_gpu(self, model: torch.nn.Module) -> None:
+        """
+        Pass through some random input of the default dimensions (a batch of
+        tiles if tiling) to warm the GPU up for real-time streaming.
+
+        :param model: the loaded in model
+        """
+        logging.info("Warming up GPU.")
+        self.prepare(self.warm_up_dimensions(EdsrDimensions.input_dimensions))
+
+        return None
+
+    def reference_inputs(self) -> tuple:
+        """
+        A representative frame for the reduced precision self-check: the
+        Shepp-Logan phantom in the range of the acquisition data, pretransformed
+        like the frames of a connection.
+        """
+        data = phantom.acquisition_data(EdsrDimensions.input_dimensions[-1])
+        pretransformation_class = EdsrPretransformations(data, self.inference_device)
+
+        return (pretransformation_class.pretransform(),)
+
+    def perform_inference(self, input_data: torch.Tensor) -> torch.Tensor:
+        """
+        Perform inference on a pretransformed, normalised input tensor, tile by
+        tile if tiling is enabled. A new input shape is warmed up first.
+        """
+        self.prepare(input_data.shape)
+
+        if self.tiler is not None:
+            return self.tiler(self.infer, input_data)
+
+        return self.infer(input_data)
+
+    def infer(self, input_data: torch.Tensor) -> torch.Tensor:
+        """
+        Run the model on an input tensor. In reduced precision, the output is
+        cast back to float32.
+        """
+        with self.autocast():
+            image_superresolution = self.model(input_data)
+
+        return image_superresolution.float()
+
+
+class EdsrQuantisedModel(EdsrModel):
+    """
+    INT8 statically quantised EDSR (made with tools/quantise_edsr.py), a
+    drop-in replacement for EdsrModel. Quantised kernels only run on the CPU,
+    so inputs on another device are moved to the CPU for inference and the
+    output is moved back.
+    """
+
+    @property
+    def inference_device(self) -> torch.device:
+        return torch.device("cpu")
+
+    def infer(self, input_data: torch.Tensor) -> torch.Tensor:
+        """
+        Run the model on an input tensor (on the CPU).
+        """
+        image_superresolution = self.model(input_data.to(self.inference_device))
+
+        return image_superresolution.to(self.device)
+
+
+# Inference engines of the EDSR model: (model class, parameter file).
+EDSR_ENGINES = {
+    "torchscript": (EdsrModel, "2022-09-10_11-22-39_edsr_nonoise.pt"),
+    "int8": (EdsrQuantisedModel, "2022-09-10_11-22-39_edsr_nonoise_int8.pt"),
+    "onnxruntime": (EdsrModel, "2022-09-10_11-22-39_edsr_nonoise.onnx"),
+}
+
+
+class EdsrPretransformations(pretransformations.Pretransformations):
+    # Squeeze, rotation by 180 degrees and batch/channel dimensions of the
+    # pooled path, composed into one view of the Gadgetron array.
+    PLAN = (
+        transformation_utils.TransformationPlan()
+        .reshape(lambda shape: tuple(size for size in shape if size != 1))
+        .rotate(2)
+        .reshape(lambda shape: (1, 1) + shape)
+    )
+
+    def pretransform(self) -> torch.Tensor:
+        """
+        This method is responsible for defining the specific pretransformation
+        steps for the application. The helper functions from transformation_utils
+        can be utilised here depending on use-case. Specific, non-transferrable
+        transformations are encouraged to be defined in this child class.
+        """
+        if self.buffer_pool is not None:
+            return self.pretransform_pooled()
+
+        tensor_data = transformation_utils.convert_numpy2tensor(
+            self.gadgetron_array, self.device  # Shape (sdim, sdim, 1, 1, 1, 1, 1)
+        )
+
+        tensor_data = transformation_utils.squeeze(tensor_data)
+
+        tensor_data = transformation_utils.get_magnitude_tensor(tensor_data)
+
+        tensor_data = transformation_utils.rotate(tensor_data, num_rotation=2)
+
+        tensor_data = transformation_utils.unsqueeze(tensor_data)
+
+        tensor_data = transformation_utils.unsqueeze(tensor_data)
+
+        return tensor_data
+
+    def pretransform_pooled(self) -> torch.Tensor:
+        """
+        The same steps written into pooled Tensors: the rotated complex frame
+        is materialised once into a (pinned) host Tensor, copied to the device
+        without blocking, and its magnitude is written into a pooled Tensor.
+        """
+        tensor_data = transformation_utils.stage_numpy2tensor(
+            self.gadgetron_array, self.PLAN, self.buffer_pool, self.device
+        )
+
+        magnitude = self.buffer_pool.get(
+            tensor_data.shape, tensor_data.real.dtype, self.device
+        )
+
+        return transformation_utils.get_magnitude_tensor(tensor_data, out=magnitude)
+
+
+class EdsrPosttransformations(posttransformations.Posttransformations):
+    def posttransform(self) -> np.ndarray:
+        """
+        This method is responsible for defining the specific posttransformation
+        steps for the application. The helper functions from transformation_utils
+        can be utilised here depending on use-case. Specific, non-transferrable
+        transformations are encouraged to be defined in this child class.
+        """
+        # The output size follows the input size (e.g., tiled larger matrices).
+        tensor_data = transformation_utils.reshape(
+            self.inferred_tensor,
+            tuple(self.inferred_tensor.shape[-2:])
+            + EdsrDimensions.output_dimensions[2:],
+        )
+
+        if self.buffer_pool is None:
+            array_data = transformation_utils.convert_tensor2numpy(tensor_data)
+        else:
+            array_data = transformation_utils.stage_tensor2numpy(
+                tensor_data, self.buffer_pool
+            )
+
+        return array_data
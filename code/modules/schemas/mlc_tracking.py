@@ -1,218 +1,1446 @@
-import logging
-import socket
-import struct
-import socket
-
-import numpy as np
-
-import gadgetron
-
-from modules import parser, socketmaker, structmaker
-
-
-class MLCImageArrayParser(parser.Parser):
-    """
-    Child class for extract relevant meta data from the acquisition/connection that needs
-    to be sent to the Australian MRI-linac MLC tracking software. From the acquisition, this
-    includes the slice position, and width/height of the acquisition. From the connection, this
-    is the voxel (in 2D, pixel) size. These are both returned as dictionaries for use with the
-    structmaker class to be processed in a way appropriate for the software.
-    """
-
-    def retrieve_acquisition_data(self) -> tuple:
-        """
-        Retrieves available data from the acquisition object.
-
-        :param acquisition: the acquisition provided by the Gadgetron
-        connection object.
-        """
-        SlicePositionSagittal = self.acquisition.acq_headers[0][0][0][0][0].position[0]
-        SlicePositionCoronal = self.acquisition.acq_headers[0][0][0][0][0].position[1]
-        SlicePositionTransverse = self.acquisition.acq_headers[0][0][0][0][0].position[
-            2
-        ]
-        Width = self.acquisition.data.shape[0]
-        Height = self.acquisition.data.shape[1]
-
-        acquisition_data_dict = {
-            "SlicePositionSagittal": SlicePositionSagittal,
-            "SlicePositionCoronal": SlicePositionCoronal,
-            "SlicePositionTransverse": SlicePositionTransverse,
-            "Width": Width,
-            "Height": Height,
-        }
-
-        return acquisition_data_dict
-
-    def retrieve_connection_data(self) -> tuple:
-        """
-        Retrieves available data from the connection object.
-
-        :param connection: the connection object provied by Gadgetron.
-        """
-
-        FOVX = self.connection.header.encoding[0].encodedSpace.fieldOfView_mm.x
-        FOVY = self.connection.header.encoding[0].encodedSpace.fieldOfView_mm.y
-        FOVZ = self.connection.header.encoding[0].encodedSpace.fieldOfView_mm.z
-
-        connection_data_dict = {"FOVX": FOVX, "FOVY": FOVY, "FOVZ": FOVZ}
-
-        return connection_data_dict
-
-
-class MLCStructmaker(structmaker.Structmaker):
-    HEADERSIZE = 64
-
-    def __init__(
-        self,
-        acquisition_data: dict,
-        connection_data: dict,
-        image_data: np.ndarray,
-        upsample_ratio: int,
-    ) -> None:
-        self.upsample_ratio = upsample_ratio
-
-        self.acquisition_data = acquisition_data
-        self.process_acquisition_data()
-
-        self.connection_data = connection_data
-        self.process_connection_data()
-
-        self.image_data = image_data
-        self.process_image_data()
-
-        self.prepare_header()
-
-        self.generate_struct()
-
-    def process_acquisition_data(self) -> None:
-        """
-        Converts the acquisition data into the required forms.
-        """
-
-        for keyname in self.acquisition_data:
-            if keyname in ["Width", "Height"]:
-                self.acquisition_data[keyname] = int(
-                    self.acquisition_data[keyname] * self.upsample_ratio
-                )
-            else:
-                self.acquisition_data[keyname] = float(self.acquisition_data[keyname])
-        return None
-
-    def process_connection_data(self) -> None:
-        """
-        Converts the connection data into the required forms.
-        """
-        self.connection_data["VoxelSizeX"] = None
-        self.connection_data["VoxelSizeY"] = None
-        self.connection_data["VoxelSizeZ"] = None
-
-        for keyname in self.connection_data:
-            if keyname in [
-                "FOVX"
-            ]:  # Dividing FOV by width and 2 (to account for 2x RO oversampling).
-                self.connection_data["VoxelSizeX"] = float(
-                    self.connection_data[keyname] / (2 * self.acquisition_data["Width"])
-                )
-            elif keyname in ["FOVY"]:  # Dividing FOV by height.
-                self.connection_data["VoxelSizeY"] = float(
-                    self.connection_data[keyname] / (self.acquisition_data["Height"])
-                )
-            elif keyname in [
-                "FOVZ"
-            ]:  # Single slice data currently, so the slice thickness (i.e. VoxelSizeZ) is the FOVZ.
-                self.connection_data["VoxelSizeZ"] = float(
-                    self.connection_data[keyname]
-                )
-            else:
-                self.connection_data[keyname] = float(self.connection_data[keyname])
-        return None
-
-    def process_image_data(self) -> None:
-        self.image_data = self.image_data.ravel()
-        self.image_data = np.absolute(self.image_data)
-        self.image_data = self.image_data.astype(np.int16)
-        self.image_size = len(self.image_data)
-        return None
-
-    def prepare_header(self) -> None:
-        """
-        Generates a prepared header in format expected by MLC tracking software.
-        The prepared header needs to be a tuple in the following format and order.
-        (SlicePositionSagittal,
-         SlicePositionCoronal,
-         SlicePositionTransverse,
-         SliceThickness(VoxelSizeZ),
-         SpacingBetweenSlices(FOVZ - num_slices*VoxelSizeZ),
-         PixelSizeX(VoxelSizeX),
-         PixelSizeY(VoxelSizeY),
-         Width,
-         Height)
-        """
-        self.header = (
-            self.acquisition_data["SlicePositionSagittal"],
-            self.acquisition_data["SlicePositionCoronal"],
-            self.acquisition_data["SlicePositionTransverse"],
-            self.connection_data["VoxelSizeZ"],
-            0.0,  # Hardcoded here as current MLC tracking is 2D only
-            self.connection_data["VoxelSizeX"],
-            self.connection_data["VoxelSizeY"],
-            self.acquisition_data["Width"],
-            self.acquisition_data["Height"],
-        )
-        return None
-
-    def generate_struct(self) -> None:
-        """
-        Generates a appropriately sized struct.
-        """
-        self._struct = struct.Struct(
-            2 * "I" + 7 * "d" + 2 * "i" + self.image_size * "H"
-        )
-        return None
-
-    def pack_struct(self) -> bytes:
-        """
-        Packs the struct with the data to be sent over socket connection.
-        """
-        self.packed_struct = self._struct.pack(
-            self.HEADERSIZE, 2 * self.image_size, *self.header, *self.image_data
-        )
-
-        return self.packed_struct
-
-
-class MLCSocketmaker(socketmaker.Socketmaker):
-    HOSTNAME = "localhost"
-    PORT = 31000
-
-    def __init__(self) -> None:
-        pass
-
-    def create_socketclient(self) -> None:
-        logging.info(f"Creating socket client")
-        self.socketclient = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        return None
-
-    def connect_socketclient(self) -> None:
-        logging.info(f"Connecting to address: {self.HOSTNAME} on port: {self.PORT}")
-        self.socketclient.connect((self.HOSTNAME, self.PORT))
-        return None
-
-    def send_packed_struct(self, packed_struct: struct.Struct) -> None:
-        self.socketclient.sendall(packed_struct)
-        return None
-
-    def __enter__(self) -> None:
-        return self
-
-    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
-        # Only print error information if an error came through (ignore if no error).
-        if not [x for x in (exc_type, exc_value, exc_traceback) if x is None]:
-            logging.error(f"Error type: {exc_type}")
-            logging.error(f"Error value: {exc_value}")
-            logging.error(f"Error traceback: {exc_traceback}")
-
-        self.socketclient.close()  # Close socketclient.
-        logging.info(f"Closing socket client")
-        return None
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+import logging
+from multiprocessing import resource_tracker, shared_memory
+import os
+import queue
+import socket
+import struct
+import socket
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import gadgetron
+
+from modules import parser, socketmaker, structmaker, transformation_utils
+
+
+class MLCImageArrayParser(parser.Parser):
+    """
+    Child class for extract relevant meta data from the acquisition/connection that needs
+    to be sent to the Australian MRI-linac MLC tracking software. From the acquisition, this
+    includes the slice position, and width/height of the acquisition. From the connection, this
+    is the voxel (in 2D, pixel) size. These are both returned as dictionaries for use with the
+    structmaker class to be processed in a way appropriate for the software.
+    """
+
+    def retrieve_acquisition_data(self) -> tuple:
+        """
+        Retrieves available data from the acquisition object.
+
+        :param acquisition: the acquisition provided by the Gadgetron
+        connection object.
+        """
+        SlicePositionSagittal = self.acquisition.acq_headers[0][0][0][0][0].position[0]
+        SlicePositionCoronal = self.acquisition.acq_headers[0][0][0][0][0].position[1]
+        SlicePositionTransverse = self.acquisition.acq_headers[0][0][0][0][0].position[
+            2
+        ]
+        Width = self.acquisition.data.shape[0]
+        Height = self.acquisition.data.shape[1]
+
+        acquisition_data_dict = {
+            "SlicePositionSagittal": SlicePositionSagittal,
+            "SlicePositionCoronal": SlicePositionCoronal,
+            "SlicePositionTransverse": SlicePositionTransverse,
+            "Width": Width,
+            "Height": Height,
+        }
+
+        return acquisition_data_dict
+
+    def retrieve_connection_data(self) -> tuple:
+        """
+        Retrieves available data from the connection object.
+
+        :param connection: the connection object provied by Gadgetron.
+        """
+
+        FOVX = self.connection.header.encoding[0].encodedSpace.fieldOfView_mm.x
+        FOVY = self.connection.header.encoding[0].encodedSpace.fieldOfView_mm.y
+        FOVZ = self.connection.header.encoding[0].encodedSpace.fieldOfView_mm.z
+
+        connection_data_dict = {"FOVX": FOVX, "FOVY": FOVY, "FOVZ": FOVZ}
+
+        return connection_data_dict
+
+    def retrieve_orientation_data(self) -> dict:
+        """
+        Retrieves the read and phase directions (unit vectors in the patient
+        coordinate system of the slice positions) from the acquisition, used
+        to move the slice position to the centre of a region of interest.
+        """
+        acquisition_header = self.acquisition.acq_headers[0][0][0][0][0]
+
+        orientation_data_dict = {
+            "ReadDirection": tuple(
+                float(value) for value in acquisition_header.read_dir
+            ),
+            "PhaseDirection": tuple(
+                float(value) for value in acquisition_header.phase_dir
+            ),
+        }
+
+        return orientation_data_dict
+
+
+class MLCRegionOfInterest:
+    """
+    Window of the image sent to the MLC tracking software, so only the region
+    around the target is packed and sent: either fixed, or re-centred on every
+    frame on the intensity-weighted centroid of the pixels above threshold
+    (as a fraction of the maximum), optionally smoothed across frames with an
+    exponential moving average. The centroid is located on a subsampled
+    magnitude of the image, so it costs a fraction of packing the full image.
+    The window is clamped to the image. One region of interest is shared by
+    the frames of a connection, from a single thread.
+    """
+
+    # The centroid is located on at most this many pixels per axis.
+    LOCATE_SIZE = 32
+
+    __slots__ = "size", "centre", "recentre", "threshold", "momentum", "tracked_centre"
+
+    def __init__(
+        self,
+        size: tuple,
+        centre: tuple = None,
+        recentre: bool = False,
+        threshold: float = 0.5,
+        momentum: float = None,
+    ) -> None:
+        """
+        :param size: (width, height) of the window in pixels of the image sent,
+            i.e., along its first and second axis (the Width and Height of the
+            header).
+        :param centre: the (first axis, second axis) pixel index of the centre
+            of a fixed window, or of the first window if re-centred (default:
+            the centre of the image).
+        :param recentre: re-centre the window on the target of every frame.
+        :param threshold: pixels below this fraction of the maximum magnitude
+            are ignored when locating the target.
+        :param momentum: weight of a new centroid in the moving average (e.g.,
+            0.5). Every centroid replaces the centre if not given.
+        """
+        self.size = tuple(int(length) for length in size)
+        self.centre = None if centre is None else tuple(centre)
+        self.recentre = recentre
+        self.threshold = threshold
+        self.momentum = momentum
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets the tracked centre (e.g., for a new series).
+        """
+        self.tracked_centre = self.centre
+        return None
+
+    def locate(self, image_data: np.ndarray) -> tuple:
+        """
+        Returns the intensity-weighted centroid (first axis, second axis) of
+        the pixels of the image above threshold, or None for an empty image.
+
+        :param image_data: the image to be sent, of two or more dimensions
+            (the trailing ones of size 1).
+        """
+        step = max(1, -(-max(image_data.shape[:2]) // self.LOCATE_SIZE))
+        subsampled = image_data[::step, ::step]
+        magnitude = np.abs(subsampled.reshape(subsampled.shape[:2])).astype(
+            np.float32, copy=False
+        )
+
+        magnitude -= self.threshold * magnitude.max()
+        np.maximum(magnitude, 0, out=magnitude)
+        row_weights = magnitude.sum(axis=1)
+        total = float(row_weights.sum())
+        if not total > 0:
+            return None
+
+        column_weights = magnitude.sum(axis=0)
+
+        return (
+            step * float(row_weights @ np.arange(row_weights.size)) / total,
+            step * float(column_weights @ np.arange(column_weights.size)) / total,
+        )
+
+    def crop(self, image_data: np.ndarray) -> tuple:
+        """
+        Returns (window, origin): a view of the window of the image, and the
+        pixel index (first axis, second axis) of its first pixel in the image.
+
+        :param image_data: the image to be sent, of two or more dimensions.
+        """
+        rows, columns = image_data.shape[:2]
+        width, height = min(self.size[0], rows), min(self.size[1], columns)
+
+        if self.recentre:
+            centroid = self.locate(image_data)
+            if centroid is None:
+                pass  # Keep the previous window.
+            elif self.tracked_centre is None or self.momentum is None:
+                self.tracked_centre = centroid
+            else:
+                self.tracked_centre = (
+                    self.tracked_centre[0]
+                    + self.momentum * (centroid[0] - self.tracked_centre[0]),
+                    self.tracked_centre[1]
+                    + self.momentum * (centroid[1] - self.tracked_centre[1]),
+                )
+
+        if self.tracked_centre is None:
+            centre_row, centre_column = (rows - 1) / 2, (columns - 1) / 2
+        else:
+            centre_row, centre_column = self.tracked_centre
+
+        row = min(max(round(centre_row - (width - 1) / 2), 0), rows - width)
+        column = min(max(round(centre_column - (height - 1) / 2), 0), columns - height)
+
+        return image_data[row : row + width, column : column + height], (row, column)
+
+    def __repr__(self) -> str:
+        return (
+            f"MLCRegionOfInterest(size={self.size}, centre={self.tracked_centre}, "
+            f"recentre={self.recentre})"
+        )
+
+
+class MLCStructmaker(structmaker.Structmaker):
+    HEADERSIZE = 64
+    # Sign of the read and phase directions along the first and second axis
+    # of the image sent (rotated by 180 degrees from the acquisition).
+    IMAGE_AXIS_DIRECTIONS = (-1.0, -1.0)
+
+    def __init__(
+        self,
+        acquisition_data: dict,
+        connection_data: dict,
+        image_data: np.ndarray,
+        upsample_ratio: int,
+        packer_cache: "MLCPackerCache" = None,
+        region_of_interest: "MLCRegionOfInterest" = None,
+        orientation_data: dict = None,
+    ) -> None:
+        """
+        :param packer_cache: cache to reuse packers (and their buffers) from
+            across frames. A new packer is made for every frame if not given.
+        :param region_of_interest: only send this window of the image. The
+            Width and Height of the header are those of the window and the
+            slice position is moved to its centre.
+        :param orientation_data: the read and phase directions (see
+            MLCImageArrayParser.retrieve_orientation_data), needed to move the
+            slice position with a region of interest.
+        """
+        self.upsample_ratio = upsample_ratio
+        self.packer_cache = packer_cache
+        self.region_of_interest = region_of_interest
+        self.orientation_data = orientation_data
+
+        self.acquisition_data = acquisition_data
+        self.process_acquisition_data()
+
+        self.connection_data = connection_data
+        self.process_connection_data()
+
+        self.image_data = image_data
+        self.process_image_data()
+
+        self.prepare_header()
+
+        self.generate_struct()
+
+    def process_acquisition_data(self) -> None:
+        """
+        Converts the acquisition data into the required forms.
+        """
+
+        for keyname in self.acquisition_data:
+            if keyname in ["Width", "Height"]:
+                self.acquisition_data[keyname] = int(
+                    self.acquisition_data[keyname] * self.upsample_ratio
+                )
+            else:
+                self.acquisition_data[keyname] = float(self.acquisition_data[keyname])
+        return None
+
+    def process_connection_data(self) -> None:
+        """
+        Converts the connection data into the required forms.
+        """
+        self.connection_data["VoxelSizeX"] = None
+        self.connection_data["VoxelSizeY"] = None
+        self.connection_data["VoxelSizeZ"] = None
+
+        for keyname in self.connection_data:
+            if keyname in [
+                "FOVX"
+            ]:  # Dividing FOV by width and 2 (to account for 2x RO oversampling).
+                self.connection_data["VoxelSizeX"] = float(
+                    self.connection_data[keyname] / (2 * self.acquisition_data["Width"])
+                )
+            elif keyname in ["FOVY"]:  # Dividing FOV by height.
+                self.connection_data["VoxelSizeY"] = float(
+                    self.connection_data[keyname] / (self.acquisition_data["Height"])
+                )
+            elif keyname in [
+                "FOVZ"
+            ]:  # Single slice data currently, so the slice thickness (i.e. VoxelSizeZ) is the FOVZ.
+                self.connection_data["VoxelSizeZ"] = float(
+                    self.connection_data[keyname]
+                )
+            else:
+                self.connection_data[keyname] = float(self.connection_data[keyname])
+        return None
+
+    def process_image_data(self) -> None:
+        """
+        The magnitude and int16 conversion of the image is fused into the
+        packing (see MLCFramePacker), only the image size is needed here.
+        """
+        self.image_origin = (0, 0)  # Of the pixels sent, in the image.
+        if self.region_of_interest is not None:
+            self.crop_image_data()
+
+        self.image_size = self.image_data.size
+        return None
+
+    def crop_image_data(self) -> None:
+        """
+        Crops the image to the region of interest (a view, copied only when
+        packed) and moves the slice position by the offset of the window
+        centre from the image centre, so the tracker's geometry is kept. The
+        pixel sizes are those of the full image.
+        """
+        if self.orientation_data is None:
+            raise ValueError("A region of interest needs the orientation data")
+
+        rows, columns = self.image_data.shape[:2]
+        self.image_data, self.image_origin = self.region_of_interest.crop(
+            self.image_data
+        )
+        width, height = self.image_data.shape[:2]
+
+        sign_x, sign_y = self.IMAGE_AXIS_DIRECTIONS
+        offset_x = (
+            sign_x
+            * (self.image_origin[0] + (width - rows) / 2)
+            * self.connection_data["VoxelSizeX"]
+        )
+        offset_y = (
+            sign_y
+            * (self.image_origin[1] + (height - columns) / 2)
+            * self.connection_data["VoxelSizeY"]
+        )
+        for keyname, read_direction, phase_direction in zip(
+            [
+                "SlicePositionSagittal",
+                "SlicePositionCoronal",
+                "SlicePositionTransverse",
+            ],
+            self.orientation_data["ReadDirection"],
+            self.orientation_data["PhaseDirection"],
+        ):
+            self.acquisition_data[keyname] += (
+                offset_x * read_direction + offset_y * phase_direction
+            )
+
+        self.acquisition_data["Width"], self.acquisition_data["Height"] = width, height
+        return None
+
+    def prepare_header(self) -> None:
+        """
+        Generates a prepared header in format expected by MLC tracking software.
+        The prepared header needs to be a tuple in the following format and order.
+        (SlicePositionSagittal,
+         SlicePositionCoronal,
+         SlicePositionTransverse,
+         SliceThickness(VoxelSizeZ),
+         SpacingBetweenSlices(FOVZ - num_slices*VoxelSizeZ),
+         PixelSizeX(VoxelSizeX),
+         PixelSizeY(VoxelSizeY),
+         Width,
+         Height)
+        """
+        self.header = (
+            self.acquisition_data["SlicePositionSagittal"],
+            self.acquisition_data["SlicePositionCoronal"],
+            self.acquisition_data["SlicePositionTransverse"],
+            self.connection_data["VoxelSizeZ"],
+            0.0,  # Hardcoded here as current MLC tracking is 2D only
+            self.connection_data["VoxelSizeX"],
+            self.connection_data["VoxelSizeY"],
+            self.acquisition_data["Width"],
+            self.acquisition_data["Height"],
+        )
+        return None
+
+    def generate_struct(self) -> None:
+        """
+        Generates a appropriately sized packer (fixed header struct followed
+        by the image payload), taken from the packer cache when available.
+        """
+        if self.packer_cache is None:
+            self._packer = MLCFramePacker(self.image_size)
+        else:
+            self._packer = self.packer_cache.get(
+                self.acquisition_data["Width"],
+                self.acquisition_data["Height"],
+                self.upsample_ratio,
+                self.image_data.dtype,
+                self.image_size,
+            )
+        return None
+
+    def pack_struct(self) -> memoryview:
+        """
+        Packs the struct with the data to be sent over socket connection.
+        The returned memoryview is byte-identical to packing the header and
+        image with a single struct of format 2I7d2i followed by image_size H.
+        """
+        self.packed_struct = self._packer.pack(self.header, self.image_data)
+
+        return self.packed_struct
+
+    def pack_struct_parts(self) -> tuple:
+        """
+        Packs the struct as separate (header, image payload) buffers, for
+        sending with a vectored send (see MLCSocketmaker scatter_gather).
+        """
+        self.packed_struct = self._packer.pack_parts(self.header, self.image_data)
+
+        return self.packed_struct
+
+
+class MLCFramePacker:
+    """
+    Packs MLC tracking frames straight into a preallocated bytearray: the
+    header with a fixed struct and the image as a uint16 numpy view onto the
+    same buffer, so no per-pixel Python objects are created. Frames are packed
+    round-robin into buffer_count buffers, so a packed frame stays valid until
+    buffer_count more frames have been packed (e.g., while queued for sending).
+    """
+
+    HEADER = struct.Struct(2 * "I" + 7 * "d" + 2 * "i")
+
+    __slots__ = "image_size", "buffers", "frames", "payloads", "payload_plan", "index"
+
+    def __init__(self, image_size: int, buffer_count: int = 1) -> None:
+        """
+        :param image_size: number of pixels in the image.
+        :param buffer_count: number of frame buffers to rotate through.
+        """
+        self.image_size = image_size
+        self.buffers = [
+            bytearray(self.HEADER.size + 2 * image_size) for _ in range(buffer_count)
+        ]
+        self.frames = [memoryview(buffer) for buffer in self.buffers]
+        # Written as int16 (the original conversion) and sent as H (uint16).
+        self.payloads = [
+            np.frombuffer(
+                buffer, dtype=np.int16, count=image_size, offset=self.HEADER.size
+            )
+            for buffer in self.buffers
+        ]
+        # Magnitude and int16 conversion of the (strided) image in one pass.
+        # Per packer, as the plan keeps a scratch array for strided frames.
+        self.payload_plan = transformation_utils.TransformationPlan(magnitude=True)
+        self.index = 0
+
+    def pack(self, header: tuple, image_data: np.ndarray) -> memoryview:
+        """
+        Packs the header and the magnitude of the image into the next buffer
+        and returns a view onto it.
+
+        :param header: the prepared header (see MLCStructmaker.prepare_header).
+        :param image_data: the image to be sent, of any shape with image_size
+            elements. Flattened in C order.
+        """
+        index = self.pack_header(header)
+
+        self.payload_plan.materialise(image_data, out=self.payloads[index])
+
+        return self.frames[index]
+
+    def pack_parts(self, header: tuple, image_data: np.ndarray) -> tuple:
+        """
+        Packs the frame as two views, (header, payload), for a vectored send.
+        A C-contiguous uint16 image is already in the payload format, so it is
+        returned as the payload without being copied into the frame buffer.
+
+        :param header: the prepared header (see MLCStructmaker.prepare_header).
+        :param image_data: the image to be sent, of any shape with image_size
+            elements. Flattened in C order.
+        """
+        if image_data.dtype == np.uint16 and image_data.flags.c_contiguous:
+            index = self.pack_header(header)
+
+            return (
+                self.frames[index][: self.HEADER.size],
+                memoryview(image_data).cast("B"),
+            )
+
+        frame = self.pack(header, image_data)
+
+        return frame[: self.HEADER.size], frame[self.HEADER.size :]
+
+    def pack_header(self, header: tuple) -> int:
+        """
+        Packs the header into the next buffer and returns the buffer index.
+
+        :param header: the prepared header (see MLCStructmaker.prepare_header).
+        """
+        index = self.index
+        self.index = (index + 1) % len(self.buffers)
+
+        self.HEADER.pack_into(
+            self.buffers[index],
+            0,
+            MLCStructmaker.HEADERSIZE,
+            2 * self.image_size,
+            *header,
+        )
+
+        return index
+
+
+class MLCPackerCache:
+    """
+    LRU cache of MLCFramePackers keyed by (width, height, upsample_ratio,
+    dtype), so steady-state frames reuse the compiled header layout and the
+    preallocated frame buffers. Hits and misses are counted for monitoring.
+    """
+
+    __slots__ = "maxsize", "buffer_count", "packers", "hits", "misses"
+
+    def __init__(self, maxsize: int = 8, buffer_count: int = 4) -> None:
+        """
+        :param maxsize: maximum number of packers kept.
+        :param buffer_count: frame buffers per packer. Must exceed the number
+            of packed frames that can be waiting to be sent at once (e.g., the
+            pipeline queue depth + 2).
+        """
+        self.maxsize = maxsize
+        self.buffer_count = buffer_count
+        self.packers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        width: int,
+        height: int,
+        upsample_ratio: int,
+        dtype: np.dtype,
+        image_size: int,
+    ) -> "MLCFramePacker":
+        """
+        Returns the packer for this frame layout, creating it on a miss.
+
+        :param width: width of the frame sent (after upsampling).
+        :param height: height of the frame sent (after upsampling).
+        :param upsample_ratio: the super-resolution upsample ratio.
+        :param dtype: dtype of the image to be packed.
+        :param image_size: number of pixels in the image to be packed.
+        """
+        key = (width, height, upsample_ratio, np.dtype(dtype))
+        packer = self.packers.get(key)
+
+        if packer is not None and packer.image_size == image_size:
+            self.hits += 1
+            self.packers.move_to_end(key)
+            return packer
+
+        self.misses += 1
+        packer = MLCFramePacker(image_size, self.buffer_count)
+        self.packers[key] = packer
+        self.packers.move_to_end(key)
+
+        while len(self.packers) > self.maxsize:
+            self.packers.popitem(last=False)
+
+        return packer
+
+    def clear(self) -> None:
+        self.packers.clear()
+        self.hits = 0
+        self.misses = 0
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            f"MLCPackerCache(size={len(self.packers)}, hits={self.hits}, "
+            f"misses={self.misses})"
+        )
+
+
+@dataclass
+class MLCSenderStatistics:
+    """
+    Counters of the asynchronous MLC sender. Queue wait times (seconds) are
+    kept for the most recent frames only.
+    """
+
+    enqueued: int = 0
+    sent: int = 0
+    dropped: int = 0
+    queue_wait_times: deque = field(default_factory=lambda: deque(maxlen=1024))
+
+    def summary(self) -> str:
+        wait_times = np.asarray(self.queue_wait_times)
+        if wait_times.size:
+            waits = (
+                f"queue wait p50: {1e3 * np.percentile(wait_times, 50):.2f} ms, "
+                f"max: {1e3 * wait_times.max():.2f} ms"
+            )
+        else:
+            waits = "no queue wait times"
+
+        return (
+            f"{self.enqueued} enqueued, {self.sent} sent, {self.dropped} dropped, "
+            f"{waits}"
+        )
+
+
+@dataclass
+class MLCConnectionStatistics:
+    """
+    State and counters of the connection to the MLC tracking software.
+    """
+
+    state: str = "disconnected"
+    connects: int = 0
+    disconnects: int = 0
+    failed_attempts: int = 0
+    dropped_while_disconnected: int = 0
+    downtime: float = 0.0  # Seconds spent disconnected after first connecting.
+    disconnected_since: float = None
+
+    def summary(self) -> str:
+        return (
+            f"{self.state}, {self.connects} connects, {self.disconnects} "
+            f"disconnects, {self.failed_attempts} failed attempts, "
+            f"{self.dropped_while_disconnected} frames dropped while disconnected, "
+            f"downtime: {self.downtime:.1f} s"
+        )
+
+
+@dataclass
+class MLCCompressionStatistics:
+    """
+    Counters of the compressed MLC feed (see MLCFrameEncoder). Encode times
+    (seconds) are kept for the most recent frames only.
+    """
+
+    frames: int = 0
+    keyframes: int = 0
+    raw_bytes: int = 0
+    encoded_bytes: int = 0
+    encode_times: deque = field(default_factory=lambda: deque(maxlen=1024))
+
+    @property
+    def ratio(self) -> float:
+        """
+        Raw frame bytes per encoded frame byte.
+        """
+        return self.raw_bytes / self.encoded_bytes if self.encoded_bytes else 0.0
+
+    def summary(self) -> str:
+        encode_times = np.asarray(self.encode_times)
+        if encode_times.size:
+            encodes = (
+                f"encode p50: {1e3 * np.percentile(encode_times, 50):.2f} ms, "
+                f"max: {1e3 * encode_times.max():.2f} ms"
+            )
+        else:
+            encodes = "no encode times"
+
+        return (
+            f"{self.frames} frames ({self.keyframes} keyframes), "
+            f"{self.raw_bytes} bytes compressed to {self.encoded_bytes} "
+            f"({self.ratio:.2f}x), {encodes}"
+        )
+
+
+class MLCFrameEncoder:
+    """
+    Encodes packed MLC frames for a compressed feed: a keyframe (the image
+    payload) at the start of a connection and every keyframe_interval frames,
+    and in between the int16 delta with the previous frame sent (a wrapping
+    uint16 subtraction, so the image is recovered exactly), compressed with
+    zlib. The encoding is flagged in the upper 16 bits of the HEADERSIZE word
+    of the prefix, and the payload size is that of the compressed payload, so
+    a receiver without support drops the frames (unexpected HEADERSIZE)
+    instead of misreading them. Frames must be encoded in the order they are
+    sent, on one connection: one encoder per connection.
+    """
+
+    ENCODING_RAW = 0
+    ENCODING_KEYFRAME = 1
+    ENCODING_DELTA = 2
+    ENCODING_SHIFT = 16
+    PREFIX = struct.Struct("2I")
+
+    __slots__ = (
+        "keyframe_interval",
+        "level",
+        "statistics",
+        "header",
+        "previous",
+        "delta",
+        "deltas_since_keyframe",
+    )
+
+    def __init__(
+        self,
+        keyframe_interval: int = 30,
+        level: int = 1,
+        statistics: MLCCompressionStatistics = None,
+    ) -> None:
+        """
+        :param keyframe_interval: frames from one keyframe to the next (1 sends
+            only keyframes, i.e., every frame compressed on its own).
+        :param level: the zlib compression level (1 is the fastest).
+        :param statistics: counters to update (e.g., shared across the
+            connections of a socketmaker).
+        """
+        if keyframe_interval < 1:
+            raise ValueError(
+                f"keyframe_interval must be at least 1, got {keyframe_interval}"
+            )
+
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.statistics = (
+            statistics if statistics is not None else MLCCompressionStatistics()
+        )
+        self.header = bytearray(MLCFramePacker.HEADER.size)
+        self.previous = None
+        self.delta = None
+        self.deltas_since_keyframe = 0
+
+    def encode(self, packed_struct) -> tuple:
+        """
+        Encodes a packed frame and returns it as (header, compressed payload).
+        The header is a view of a buffer reused by the next frame.
+
+        :param packed_struct: the packed frame (bytes-like, or the (header,
+            payload) tuple of MLCStructmaker.pack_struct_parts).
+        """
+        start = time.perf_counter()
+        if isinstance(packed_struct, tuple):
+            header, payload = packed_struct
+        else:
+            packed_struct = memoryview(packed_struct)
+            header = packed_struct[: MLCFramePacker.HEADER.size]
+            payload = packed_struct[MLCFramePacker.HEADER.size :]
+        image = np.frombuffer(payload, dtype=np.uint16)
+
+        if (
+            self.previous is None
+            or self.previous.size != image.size
+            or self.deltas_since_keyframe >= self.keyframe_interval - 1
+        ):
+            encoding = self.ENCODING_KEYFRAME
+            if self.previous is None or self.previous.size != image.size:
+                self.previous = np.empty_like(image)
+                self.delta = np.empty_like(image)
+            np.copyto(self.previous, image)
+            compressed = zlib.compress(self.previous, self.level)
+            self.deltas_since_keyframe = 0
+        else:
+            encoding = self.ENCODING_DELTA
+            np.subtract(image, self.previous, out=self.delta)
+            np.copyto(self.previous, image)
+            compressed = zlib.compress(self.delta, self.level)
+            self.deltas_since_keyframe += 1
+
+        self.header[:] = header
+        self.PREFIX.pack_into(
+            self.header,
+            0,
+            MLCStructmaker.HEADERSIZE | encoding << self.ENCODING_SHIFT,
+            len(compressed),
+        )
+
+        statistics = self.statistics
+        statistics.frames += 1
+        statistics.keyframes += encoding == self.ENCODING_KEYFRAME
+        statistics.raw_bytes += len(self.header) + image.nbytes
+        statistics.encoded_bytes += len(self.header) + len(compressed)
+        statistics.encode_times.append(time.perf_counter() - start)
+
+        return memoryview(self.header), compressed
+
+
+class MLCSocketmaker(socketmaker.Socketmaker):
+    HOSTNAME = "localhost"
+    PORT = 31000
+
+    OVERFLOW_POLICIES = ("block", "drop-oldest", "drop-newest")
+    BLOCK_POLL_INTERVAL = 0.1  # Seconds between sender checks when blocked.
+    # Sent by a receiver accepting compressed frames when a client connects:
+    # a magic and the bitmask of the compressions it decodes.
+    ENCODING_OFFER = struct.Struct("=4sI")
+    ENCODING_MAGIC = b"MLCE"
+    COMPRESSIONS = {"zlib": 1}
+
+    def __init__(
+        self,
+        hostname: str = None,
+        port: int = None,
+        scatter_gather: bool = False,
+        asynchronous: bool = False,
+        queue_size: int = 2,
+        overflow_policy: str = "drop-oldest",
+        reconnect: bool = False,
+        backoff_initial: float = 0.1,
+        backoff_max: float = 5.0,
+        connect_timeout: float = 0.5,
+        keepalive: tuple = (1, 1, 3),
+        socket_path: str = None,
+        compression: str = None,
+        compression_level: int = 1,
+        keyframe_interval: int = 30,
+        negotiation_timeout: float = 0.5,
+    ) -> None:
+        """
+        :param hostname: host of the MLC tracking software (default HOSTNAME).
+        :param port: port of the MLC tracking software (default PORT).
+        :param scatter_gather: send frames given as several buffers (e.g.,
+            header and image payload) with a single vectored send instead of
+            one send per buffer.
+        :param asynchronous: send frames from a background thread fed by a
+            bounded queue, so a slow MLC tracking consumer does not block the
+            acquisition loop.
+        :param queue_size: maximum number of frames waiting to be sent.
+        :param overflow_policy: what to do with a frame when the queue is full:
+            "block" until there is room (raising if the sender stops),
+            "drop-oldest" (keep the freshest frames, preferred for tracking)
+            or "drop-newest".
+        :param reconnect: keep the connection alive across restarts of the MLC
+            tracking software. Failed connects and sends are not raised: the
+            frame is dropped and reconnects are attempted with exponential
+            backoff, so the reconstruction keeps flowing while it is away.
+        :param backoff_initial: first reconnect delay (seconds).
+        :param backoff_max: maximum reconnect delay (seconds).
+        :param connect_timeout: timeout of a single connect attempt (seconds).
+        :param keepalive: TCP keepalive (idle, interval, count) in seconds, to
+            detect a dead peer quickly. None disables keepalive.
+        :param socket_path: connect to an AF_UNIX stream socket at this path
+            instead of hostname:port, when the MLC tracking software runs on
+            the same host. The frames are unchanged.
+        :param compression: compress the frames ("zlib", see MLCFrameEncoder)
+            if the receiver offers it when connecting. Frames are sent raw to
+            a receiver that does not (e.g., without support for it).
+        :param compression_level: the zlib compression level.
+        :param keyframe_interval: frames from one keyframe to the next, the
+            frames in between being sent as deltas of the previous frame.
+        :param negotiation_timeout: time to wait for the receiver's offer of
+            compressed frames after connecting (seconds).
+        """
+        if scatter_gather and not hasattr(socket.socket, "sendmsg"):
+            logging.warning("socket.sendmsg unavailable, scatter-gather disabled.")
+            scatter_gather = False
+
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow_policy must be one of {self.OVERFLOW_POLICIES}, "
+                f"got {overflow_policy}"
+            )
+
+        if compression is not None and compression not in self.COMPRESSIONS:
+            raise ValueError(
+                f"compression must be one of {tuple(self.COMPRESSIONS)}, "
+                f"got {compression}"
+            )
+
+        self.hostname = hostname if hostname is not None else self.HOSTNAME
+        self.port = port if port is not None else self.PORT
+        self.socket_path = socket_path
+        self.scatter_gather = scatter_gather
+        self.asynchronous = asynchronous
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.statistics = MLCSenderStatistics()
+        self._send_queue = queue.Queue(maxsize=queue_size)
+        self._sender = None
+        self._sender_error = None
+        self.reconnect = reconnect
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.connection_statistics = MLCConnectionStatistics()
+        self._backoff = backoff_initial
+        self._next_attempt = 0.0
+        self.compression = compression
+        self.compression_level = compression_level
+        self.keyframe_interval = keyframe_interval
+        self.negotiation_timeout = negotiation_timeout
+        self.compression_statistics = MLCCompressionStatistics()
+        self.frame_encoder = None  # Of the current connection, if negotiated.
+
+    @property
+    def address(self):
+        """
+        The address to connect to: the Unix socket path or (hostname, port).
+        """
+        if self.socket_path is not None:
+            return self.socket_path
+
+        return (self.hostname, self.port)
+
+    def create_socketclient(self) -> None:
+        logging.info(f"Creating socket client")
+        if self.socket_path is not None:
+            self.socketclient = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            return None
+
+        self.socketclient = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socketclient.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        if self.keepalive is not None:
+            self.socketclient.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for option, value in zip(
+                ("TCP_KEEPIDLE", "TCP_KEEPINTVL", "TCP_KEEPCNT"), self.keepalive
+            ):
+                if hasattr(socket, option):  # Not available on every platform.
+                    self.socketclient.setsockopt(
+                        socket.IPPROTO_TCP, getattr(socket, option), value
+                    )
+        return None
+
+    def connect_socketclient(self) -> None:
+        logging.info(f"Connecting to address: {self.address}")
+
+        if self.reconnect:
+            self.try_connect()
+        else:
+            self.socketclient.connect(self.address)
+            self.negotiate_compression()
+            self.mark_connected()
+
+        if self.asynchronous and self._sender is None:
+            self._sender = threading.Thread(
+                target=self.run_sender, name="mlc-sender", daemon=True
+            )
+            self._sender.start()
+        return None
+
+    def send_packed_struct(self, packed_struct: struct.Struct) -> None:
+        """
+        Sends a packed frame. The frame can be a single bytes-like object or a
+        tuple of bytes-like objects sent back to back (e.g., from
+        MLCStructmaker.pack_struct_parts). When asynchronous, the frame is only
+        queued and must stay valid until sent (see MLCPackerCache buffer_count).
+
+        :param packed_struct: the packed frame.
+        """
+        if not self.asynchronous:
+            self.send_now(packed_struct)
+            return None
+
+        if self._sender_error is not None:
+            raise self._sender_error
+
+        item = (time.perf_counter(), packed_struct)
+        self.statistics.enqueued += 1
+
+        if self.overflow_policy == "block":
+            # Poll so a sender that died cannot leave the caller blocked forever.
+            while True:
+                try:
+                    self._send_queue.put(item, timeout=self.BLOCK_POLL_INTERVAL)
+                    break
+                except queue.Full:
+                    if self._sender_error is not None:
+                        raise self._sender_error
+                    if self._sender is None or not self._sender.is_alive():
+                        raise RuntimeError("MLC sender stopped with frames queued")
+        elif self.overflow_policy == "drop-newest":
+            try:
+                self._send_queue.put_nowait(item)
+            except queue.Full:
+                self.statistics.dropped += 1
+        else:
+            while True:
+                try:
+                    self._send_queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self._send_queue.get_nowait()
+                        self.statistics.dropped += 1
+                    except queue.Empty:
+                        pass
+        return None
+
+    def try_connect(self) -> bool:
+        """
+        Attempts a single connect with a timeout. On failure, the next attempt
+        is scheduled after the current backoff, which then doubles (up to
+        backoff_max). Returns whether the connection is up.
+        """
+        try:
+            self.socketclient.settimeout(self.connect_timeout)
+            self.socketclient.connect(self.address)
+            self.socketclient.settimeout(None)
+            self.negotiate_compression()
+        except OSError as error:
+            statistics = self.connection_statistics
+            if self._backoff == self.backoff_initial:  # First attempt of an outage.
+                logging.warning(
+                    f"MLC tracking software unavailable at {self.address} "
+                    f"({error}), retrying in {self._backoff:.1f} s"
+                )
+            statistics.failed_attempts += 1
+            self.mark_disconnected()
+            self._next_attempt = time.monotonic() + self._backoff
+            self._backoff = min(2 * self._backoff, self.backoff_max)
+            return False
+
+        self.mark_connected()
+        return True
+
+    def reconnect_socketclient(self) -> bool:
+        """
+        Replaces the socket client with a new one and attempts to connect it,
+        if the backoff delay has passed. Returns whether the connection is up.
+        """
+        if time.monotonic() < self._next_attempt:
+            return False
+
+        self.socketclient.close()
+        self.create_socketclient()
+
+        return self.try_connect()
+
+    def negotiate_compression(self) -> None:
+        """
+        Waits up to negotiation_timeout for the receiver's offer of compressed
+        frames (ENCODING_OFFER) on a new connection, and compresses the frames
+        of the connection with a new MLCFrameEncoder (starting on a keyframe)
+        if the configured compression is offered.
+        """
+        self.frame_encoder = None
+        if self.compression is None:
+            return None
+
+        offer = b""
+        self.socketclient.settimeout(self.negotiation_timeout)
+        try:
+            while len(offer) < self.ENCODING_OFFER.size:
+                received = self.socketclient.recv(self.ENCODING_OFFER.size - len(offer))
+                if not received:
+                    break
+                offer += received
+        except socket.timeout:
+            pass
+        finally:
+            self.socketclient.settimeout(None)
+
+        if len(offer) == self.ENCODING_OFFER.size:
+            magic, compressions = self.ENCODING_OFFER.unpack(offer)
+            if (
+                magic == self.ENCODING_MAGIC
+                and compressions & self.COMPRESSIONS[self.compression]
+            ):
+                self.frame_encoder = MLCFrameEncoder(
+                    self.keyframe_interval,
+                    self.compression_level,
+                    self.compression_statistics,
+                )
+                logging.info(f"Sending {self.compression} compressed MLC frames.")
+                return None
+
+        logging.warning(
+            f"MLC receiver at {self.address} did not offer {self.compression} "
+            "compression, sending raw frames."
+        )
+        return None
+
+    def mark_connected(self) -> None:
+        statistics = self.connection_statistics
+        if statistics.disconnected_since is not None:
+            statistics.downtime += time.monotonic() - statistics.disconnected_since
+            statistics.disconnected_since = None
+
+        if statistics.connects:
+            logging.info(
+                f"Reconnected to MLC tracking software: {statistics.summary()}"
+            )
+
+        statistics.state = "connected"
+        statistics.connects += 1
+        self._backoff = self.backoff_initial
+        return None
+
+    def mark_disconnected(self) -> None:
+        statistics = self.connection_statistics
+        if statistics.state == "connected":
+            statistics.disconnects += 1
+            statistics.disconnected_since = time.monotonic()
+            self._next_attempt = 0.0  # Retry straight away after a lost connection.
+
+        statistics.state = "disconnected"
+        return None
+
+    def send_now(self, packed_struct: struct.Struct) -> bool:
+        """
+        Sends a packed frame on the calling thread. With reconnect enabled, a
+        frame that cannot be sent is dropped instead of raising. Returns
+        whether the frame was sent.
+
+        :param packed_struct: the packed frame (bytes-like or tuple of them).
+        """
+        if not self.reconnect:
+            self.send_frame(packed_struct)
+            return True
+
+        if self.connection_statistics.state != "connected":
+            if not self.reconnect_socketclient():
+                self.connection_statistics.dropped_while_disconnected += 1
+                return False
+
+        try:
+            self.send_frame(packed_struct)
+        except OSError as error:
+            logging.warning(f"Lost connection to MLC tracking software: {error}")
+            self.mark_disconnected()
+            self.connection_statistics.dropped_while_disconnected += 1
+            return False
+
+        return True
+
+    def send_frame(self, packed_struct: struct.Struct) -> None:
+        """
+        Writes a packed frame to the socket client, encoded if compression was
+        negotiated for the connection.
+
+        :param packed_struct: the packed frame (bytes-like or tuple of them).
+        """
+        if self.frame_encoder is not None:
+            packed_struct = self.frame_encoder.encode(packed_struct)
+
+        if not isinstance(packed_struct, tuple):
+            self.socketclient.sendall(packed_struct)
+        elif self.scatter_gather:
+            self.sendmsg_all(packed_struct)
+        else:
+            for buffer in packed_struct:
+                self.socketclient.sendall(buffer)
+        return None
+
+    def run_sender(self) -> None:
+        """
+        Background sender loop: sends queued frames until a None is queued.
+        """
+        while True:
+            item = self._send_queue.get()
+            if item is None:
+                return None
+
+            enqueue_time, packed_struct = item
+            self.statistics.queue_wait_times.append(time.perf_counter() - enqueue_time)
+
+            try:
+                sent = self.send_now(packed_struct)
+            except Exception as error:
+                logging.error(f"MLC sender stopped: {error}")
+                self._sender_error = error
+                return None
+
+            self.statistics.sent += sent
+
+    def stop_sender(self, timeout: float = 1.0) -> None:
+        """
+        Lets the background sender finish the queued frames (within the timeout)
+        and stops it.
+
+        :param timeout: maximum time (seconds) to wait for the queue to drain.
+        """
+        if self._sender is None:
+            return None
+
+        try:
+            self._send_queue.put(None, timeout=timeout)
+        except queue.Full:
+            logging.warning("MLC send queue did not drain before closing.")
+
+        self._sender.join(timeout)
+        self._sender = None
+        logging.info(f"MLC sender: {self.statistics.summary()}")
+        return None
+
+    def sendmsg_all(self, buffers: tuple) -> None:
+        """
+        Sends all buffers with vectored sends, resuming after partial sends
+        until every byte is written.
+
+        :param buffers: bytes-like objects to send in order.
+        """
+        buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+
+        while buffers:
+            sent = self.socketclient.sendmsg(buffers)
+
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+
+            if buffers and sent:
+                buffers[0] = buffers[0][sent:]
+        return None
+
+    def discard_received(self) -> None:
+        """
+        Reads what the receiver sent and was not read (e.g., an offer of
+        compressed frames with compression off), so closing the socket ends
+        the connection instead of resetting it, which can discard the frames
+        the receiver has not read yet.
+        """
+        try:
+            while self.socketclient.recv(4096, socket.MSG_DONTWAIT):
+                pass
+        except OSError:  # Nothing left to read, or not connected.
+            pass
+        return None
+
+    def __enter__(self) -> None:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        # Only print error information if an error came through (ignore if no error).
+        if not [x for x in (exc_type, exc_value, exc_traceback) if x is None]:
+            logging.error(f"Error type: {exc_type}")
+            logging.error(f"Error value: {exc_value}")
+            logging.error(f"Error traceback: {exc_traceback}")
+
+        self.stop_sender()
+        self.discard_received()
+        self.socketclient.close()  # Close socketclient.
+        logging.info(f"Closing socket client")
+        logging.info(f"MLC connection: {self.connection_statistics.summary()}")
+        if self.compression is not None:
+            logging.info(f"MLC compression: {self.compression_statistics.summary()}")
+        return None
+
+
+class MLCSharedMemorySocketmaker(socketmaker.Socketmaker):
+    """
+    Writes the MLC tracking frames into a shared memory ring created by the
+    MLC tracking software on the same host (see test/mlc_receiver.py
+    MLCSharedMemoryReceiver), instead of sending them over a socket. Each
+    frame keeps the socket format (prefix, header and image payload) in a
+    fixed-size slot stamped with the frame's sequence number:
+
+    ring header: magic, version, slot_count, slot_size, then the sequence
+        number of the last published frame (RING_HEADER, at offset 0).
+    slot n % slot_count (at SLOTS_OFFSET + slot * slot stride): the sequence
+        number n and length of the frame (SLOT_HEADER), then the frame.
+
+    A slot's sequence number is cleared while the frame is written and set
+    once it is complete, then the ring sequence number is published, so a
+    reader detects frames overwritten or torn while copying them. Writing
+    never blocks: a reader that falls more than slot_count frames behind
+    misses the oldest frames, like the "drop-oldest" overflow policy.
+
+    A restart of the MLC tracking software recreates the ring under the same
+    name, leaving the attached one orphaned: every CHECK_INTERVAL frames, the
+    ring published under the name is compared with the attached one (by its
+    inode in SHM_DIRECTORY, and its header), and re-attached if it changed.
+    """
+
+    NAME = "mlc_tracking"
+    MAGIC = b"MLCR"
+    VERSION = 1
+    RING_HEADER = struct.Struct("=4sIIIQ")
+    SLOT_HEADER = struct.Struct("=QQ")
+    SLOTS_OFFSET = 64
+    # Where POSIX shared memory is published (Linux). Without it, only a ring
+    # rewritten in place is noticed.
+    SHM_DIRECTORY = "/dev/shm"
+    CHECK_INTERVAL = 16
+
+    # Frames are copied into the ring when sent: nothing is queued, and the
+    # header and payload are written as separate parts.
+    queue_size = 0
+    scatter_gather = True
+
+    def __init__(self, name: str = None, reconnect: bool = True) -> None:
+        """
+        :param name: name of the shared memory ring (default NAME).
+        :param reconnect: drop frames (instead of raising) while the ring does
+            not exist yet, attaching to it once the MLC tracking software has
+            created it.
+        """
+        self.name = name if name is not None else self.NAME
+        self.reconnect = reconnect
+        self.shm = None
+        self.ring_id = None
+        self.slot_count = None
+        self.slot_size = None
+        self.slot_stride = None
+        self.sequence = 0
+        self.statistics = MLCSenderStatistics()
+        self.connection_statistics = MLCConnectionStatistics()
+
+    def create_socketclient(self) -> None:
+        return None
+
+    def connect_socketclient(self) -> None:
+        logging.info(f"Attaching to MLC shared memory ring: {self.name}")
+
+        if not self.try_connect() and not self.reconnect:
+            raise FileNotFoundError(f"No MLC shared memory ring named {self.name}")
+        return None
+
+    def try_connect(self) -> bool:
+        """
+        Attaches to the ring if it exists and has the expected layout.
+        Returns whether the ring is attached.
+        """
+        # Before attaching, so a ring recreated in between is noticed later.
+        ring_id = self.published_ring_id()
+        try:
+            if sys.version_info >= (3, 13):
+                shm = shared_memory.SharedMemory(name=self.name, track=False)
+            else:
+                shm = shared_memory.SharedMemory(name=self.name)
+                # Attaching registers the ring with this process's resource
+                # tracker, which would unlink it when the gadget exits. The ring
+                # belongs to the MLC tracking software.
+                resource_tracker.unregister(f"/{shm.name}", "shared_memory")
+        except FileNotFoundError:
+            if self.connection_statistics.failed_attempts == 0:
+                logging.warning(f"MLC shared memory ring {self.name} unavailable.")
+            self.connection_statistics.failed_attempts += 1
+            return False
+        except ValueError:  # Just created (empty), not sized yet.
+            self.connection_statistics.failed_attempts += 1
+            return False
+
+        magic, version, slot_count, slot_size, sequence = self.RING_HEADER.unpack_from(
+            shm.buf, 0
+        )
+        if magic == bytes(len(self.MAGIC)):  # Header not written yet.
+            shm.close()
+            self.connection_statistics.failed_attempts += 1
+            return False
+        if magic != self.MAGIC or version != self.VERSION:
+            shm.close()
+            raise ValueError(f"{self.name} is not an MLC shared memory ring")
+
+        self.shm = shm
+        self.ring_id = ring_id
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.slot_stride = self.SLOT_HEADER.size + slot_size
+        self.sequence = sequence
+        self.connection_statistics.state = "connected"
+        self.connection_statistics.connects += 1
+        return True
+
+    def published_ring_id(self) -> tuple:
+        """
+        The (device, inode) of the ring published under the name, None if
+        there is none (or no SHM_DIRECTORY on this platform).
+        """
+        try:
+            status = os.stat(os.path.join(self.SHM_DIRECTORY, self.name))
+        except FileNotFoundError:
+            return None
+
+        return status.st_dev, status.st_ino
+
+    def ring_changed(self) -> bool:
+        """
+        Whether the attached ring is no longer the one the MLC tracking
+        software reads: it was unlinked or recreated under the name, or its
+        header was rewritten (the published sequence number is only written
+        here).
+        """
+        if self.published_ring_id() != self.ring_id:
+            return True
+
+        magic, version, _, _, sequence = self.RING_HEADER.unpack_from(self.shm.buf, 0)
+
+        return (
+            magic != self.MAGIC or version != self.VERSION or sequence != self.sequence
+        )
+
+    def detach(self) -> None:
+        self.shm.close()
+        self.shm = None
+        self.ring_id = None
+        self.connection_statistics.state = "disconnected"
+        self.connection_statistics.disconnects += 1
+        return None
+
+    def send_packed_struct(self, packed_struct: struct.Struct) -> None:
+        """
+        Copies a packed frame into the next slot and publishes it.
+
+        :param packed_struct: the packed frame (bytes-like or tuple of them).
+        """
+        self.statistics.enqueued += 1
+
+        if (
+            self.shm is not None
+            and self.sequence % self.CHECK_INTERVAL == 0
+            and self.ring_changed()
+        ):
+            logging.warning(
+                f"MLC shared memory ring {self.name} was recreated or removed, "
+                f"attaching again."
+            )
+            self.detach()
+            self.try_connect()
+        elif self.shm is None and self.reconnect:
+            self.try_connect()
+
+        if self.shm is None:
+            if not self.reconnect:
+                raise FileNotFoundError(f"No MLC shared memory ring named {self.name}")
+            self.connection_statistics.dropped_while_disconnected += 1
+            return None
+
+        if not isinstance(packed_struct, tuple):
+            packed_struct = (packed_struct,)
+        parts = [memoryview(part).cast("B") for part in packed_struct]
+        length = sum(len(part) for part in parts)
+        if length > self.slot_size:
+            raise ValueError(
+                f"Frame of {length} bytes does not fit in the {self.slot_size} "
+                f"byte slots of {self.name}"
+            )
+
+        sequence = self.sequence + 1
+        offset = self.SLOTS_OFFSET + (sequence % self.slot_count) * self.slot_stride
+        buffer = self.shm.buf
+
+        self.SLOT_HEADER.pack_into(buffer, offset, 0, length)  # Being written.
+        position = offset + self.SLOT_HEADER.size
+        for part in parts:
+            buffer[position : position + len(part)] = part
+            position += len(part)
+        self.SLOT_HEADER.pack_into(buffer, offset, sequence, length)
+        struct.pack_into("=Q", buffer, self.RING_HEADER.size - 8, sequence)
+
+        self.sequence = sequence
+        self.statistics.sent += 1
+        return None
+
+    def __enter__(self) -> None:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+        logging.info(f"MLC shared memory ring: {self.statistics.summary()}")
+        return None
@@ -0,0 +1,130 @@
+"""
+In this module, the staging buffer pool is stored. Every frame used to
+allocate its input tensor (numpy to torch, host to device), its magnitude and
+rotation and, on a device, its host output. The pool hands out preallocated
+tensors instead, which the pre/posttransformations fill in place with copy_
+or out=, so steady-state frames allocate no staging memory.
+"""
+
+import threading
+
+import torch
+
+
+class StagingBufferPool:
+    """
+    Preallocated tensors keyed by (shape, dtype, device), handed out
+    round-robin. Host tensors are pinned when CUDA is available, so host to
+    device copies can be non-blocking. A tensor stays valid until buffer_count
+    more tensors of the same key have been handed out. Each frame takes at
+    most one tensor of a key, so buffer_count must be at least the number of
+    frames that can be in flight at once (e.g., queued in the pipeline).
+    Callers marking their frames with start_frame and finish_frame get a
+    RuntimeError instead of a silently overwritten tensor when it is not.
+    """
+
+    __slots__ = (
+        "buffer_count",
+        "pin_memory",
+        "buffers",
+        "indices",
+        "lock",
+        "requests",
+        "allocations",
+        "frames_in_flight",
+    )
+
+    def __init__(self, buffer_count: int = 4, pin_memory: bool = None) -> None:
+        """
+        :param buffer_count: number of tensors to rotate through per key.
+        :param pin_memory: pin the host tensors (default: if CUDA is available).
+        """
+        self.buffer_count = buffer_count
+        self.pin_memory = (
+            torch.cuda.is_available() if pin_memory is None else pin_memory
+        )
+        self.buffers = {}
+        self.indices = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.allocations = 0
+        self.frames_in_flight = 0
+
+    def get(
+        self, shape: tuple, dtype: torch.dtype, device: torch.device = None
+    ) -> torch.Tensor:
+        """
+        Returns the next tensor of the shape, dtype and device (on the host if
+        no device is given), allocating it the first buffer_count times.
+
+        :param shape: the shape of the tensor.
+        :param dtype: the dtype of the tensor.
+        :param device: the device of the tensor.
+        """
+        device = torch.device("cpu") if device is None else torch.device(device)
+        key = (tuple(shape), dtype, str(device))
+
+        with self.lock:
+            self.requests += 1
+            buffers = self.buffers.setdefault(key, [])
+            index = self.indices.get(key, 0)
+            self.indices[key] = (index + 1) % self.buffer_count
+
+            if index == len(buffers):
+                buffers.append(
+                    torch.empty(
+                        shape,
+                        dtype=dtype,
+                        device=device,
+                        pin_memory=self.pin_memory and device.type == "cpu",
+                    )
+                )
+                self.allocations += 1
+
+            return buffers[index]
+
+    def start_frame(self) -> None:
+        """
+        Marks a frame as in flight before its first tensor is handed out.
+        Raises a RuntimeError if more than buffer_count frames would then be in
+        flight, i.e., if a tensor still in use could be handed out again.
+        """
+        with self.lock:
+            if self.frames_in_flight >= self.buffer_count:
+                raise RuntimeError(
+                    f"{self.frames_in_flight + 1} frames in flight with "
+                    f"{self.buffer_count} staging buffers per key: a tensor "
+                    f"still in use would be reused"
+                )
+            self.frames_in_flight += 1
+        return None
+
+    def finish_frame(self) -> None:
+        """
+        Marks a frame as done with its tensors (e.g., once it is sent).
+        """
+        with self.lock:
+            self.frames_in_flight = max(self.frames_in_flight - 1, 0)
+        return None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.buffers.clear()
+            self.indices.clear()
+            self.requests = 0
+            self.allocations = 0
+            self.frames_in_flight = 0
+        return None
+
+    def __repr__(self) -> str:
+        memory = sum(
+            buffer.numel() * buffer.element_size()
+            for buffers in self.buffers.values()
+            for buffer in buffers
+        )
+
+        return (
+            f"StagingBufferPool(keys={len(self.buffers)}, "
+            f"memory={memory / 2**20:.1f} MiB, pinned={self.pin_memory}, "
+            f"requests={self.requests}, allocations={self.allocations})"
+        )
@@ -0,0 +1,165 @@
+"""
+In this module, tiled inference is stored. An input larger than the tile size
+(e.g., a 192x192 matrix for a model trained on 64x64 patches) is split into
+overlapping tiles, the tiles are inferred in batches of at most batch_size and
+the outputs are blended back with feathered weights, so the activation memory
+is bounded by the tile batch instead of growing with the matrix size.
+"""
+
+import typing
+
+import torch
+
+
+def tile_starts(length: int, tile_size: int, overlap: int) -> list:
+    """
+    Start positions of the fewest tiles covering length with at least overlap
+    between neighbours, spread evenly from the start to the end.
+
+    :param length: the size of the dimension to cover.
+    :param tile_size: the size of the tiles (at most length).
+    :param overlap: the minimum overlap between neighbouring tiles.
+    """
+    if length <= tile_size:
+        return [0]
+
+    count = -(-(length - overlap) // (tile_size - overlap))  # Ceiling division.
+
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+
+def feather_weights(tile_size: int, overlap: int) -> torch.Tensor:
+    """
+    1D blending weights of a tile: ramping up linearly over the overlap at
+    both ends and flat in between. Every weight is positive, so the borders of
+    the image (covered by a single tile) are kept once normalised.
+
+    :param tile_size: the size of the tile (output pixels).
+    :param overlap: the size of the ramp (output pixels).
+    """
+    position = torch.arange(tile_size, dtype=torch.float32) + 0.5
+    ramp = torch.minimum(position, tile_size - position) / max(overlap, 1)
+
+    return ramp.clamp(max=1.0)
+
+
+class TiledInference:
+    """
+    Splits (N, C, H, W) inputs into overlapping tile_size x tile_size tiles,
+    infers them in batches and blends the outputs back together. Inputs that
+    fit in a single tile are inferred directly. The scale of the model (e.g.,
+    4 for 64x64 to 256x256) is taken from the first inferred tile batch.
+    """
+
+    __slots__ = "tile_size", "overlap", "batch_size", "weights"
+
+    def __init__(
+        self, tile_size: int = 64, overlap: int = 8, batch_size: int = 4
+    ) -> None:
+        """
+        :param tile_size: size of the (square) input tiles.
+        :param overlap: overlap between neighbouring tiles (input pixels).
+        :param batch_size: maximum number of tiles inferred in one call, which
+            bounds the peak memory.
+        """
+        if not 0 <= overlap < tile_size:
+            raise ValueError(
+                f"overlap must be in [0, tile_size), got {overlap} for tile_size "
+                f"{tile_size}"
+            )
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.weights = {}  # (tile height, tile width, scale, device) to weights.
+
+    def __call__(
+        self, infer: typing.Callable, input_data: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Infers the input tile by tile and returns the blended output.
+
+        :param infer: runs the model on a (batch, C, h, w) tensor of tiles.
+        :param input_data: the (N, C, H, W) input tensor.
+        """
+        height, width = input_data.shape[-2:]
+        if height <= self.tile_size and width <= self.tile_size:
+            return infer(input_data)
+
+        tile_height = min(self.tile_size, height)
+        tile_width = min(self.tile_size, width)
+        tiles = [
+            (index, top, left)
+            for index in range(input_data.shape[0])
+            for top in tile_starts(height, tile_height, self.overlap)
+            for left in tile_starts(width, tile_width, self.overlap)
+        ]
+
+        output = weight_sum = None
+        for start in range(0, len(tiles), self.batch_size):
+            batch = tiles[start : start + self.batch_size]
+            inferred = infer(
+                torch.stack(
+                    [
+                        input_data[
+                            index, :, top : top + tile_height, left : left + tile_width
+                        ]
+                        for index, top, left in batch
+                    ]
+                )
+            )
+
+            scale = inferred.shape[-1] // tile_width
+            weights = self.tile_weights(tile_height, tile_width, scale, inferred.device)
+            if output is None:
+                output = inferred.new_zeros(
+                    (
+                        input_data.shape[0],
+                        inferred.shape[1],
+                        height * scale,
+                        width * scale,
+                    )
+                )
+                weight_sum = weights.new_zeros((height * scale, width * scale))
+
+            for (index, top, left), tile in zip(batch, inferred):
+                region = (
+                    slice(top * scale, (top + tile_height) * scale),
+                    slice(left * scale, (left + tile_width) * scale),
+                )
+                output[(index, slice(None)) + region].addcmul_(tile, weights)
+                if index == 0:
+                    weight_sum[region] += weights
+
+        return output.div_(weight_sum)
+
+    def tile_weights(
+        self, tile_height: int, tile_width: int, scale: int, device: torch.device
+    ) -> torch.Tensor:
+        """
+        Returns the cached 2D blending weights of an output tile.
+
+        :param tile_height: the height of the input tile.
+        :param tile_width: the width of the input tile.
+        :param scale: the upsampling factor of the model.
+        :param device: the device of the model output.
+        """
+        key = (tile_height, tile_width, scale, str(device))
+        weights = self.weights.get(key)
+        if weights is None:
+            overlap = self.overlap * scale
+            weights = torch.outer(
+                feather_weights(tile_height * scale, overlap),
+                feather_weights(tile_width * scale, overlap),
+            ).to(device)
+            self.weights[key] = weights
+
+        return weights
+
+    def __repr__(self) -> str:
+        return (
+            f"TiledInference(tile_size={self.tile_size}, overlap={self.overlap}, "
+            f"batch_size={self.batch_size})"
+        )
@@ -1,116 +1,393 @@
-import torch
-import numpy as np
-
-
-def convert_numpy2tensor(array: np.ndarray, device: torch.device) -> torch.Tensor:
-    """
-    Performs conversion of Numpy array on the CPU to Torch Tensor
-    on the GPU.
-
-    :param array: A Numpy array.
-    :param device: device to run inference on.
-    """
-    return torch.from_numpy(array).to(device)
-
-
-def convert_tensor2numpy(tensor: torch.Tensor) -> torch.Tensor:
-    """
-    Performs conversion of Torch Tensor on the GPU to Numpy array
-    on the CPU.
-
-    :param tensor: A torch Tensor.
-    """
-    return tensor.cpu().detach().numpy()
-
-
-def convert2rgb(tensor: torch.Tensor) -> torch.Tensor:
-    """
-    Method to convert an initially grayscale tensor to RGB.
-
-    :param tensor: A torch Tensor.
-    """
-    rgb_tensor = torch.stack((0.33 * tensor, 0.33 * tensor, 0.33 * tensor), dim=1)
-
-    return rgb_tensor
-
-
-def squeeze(tensor: torch.Tensor) -> torch.Tensor:
-    """
-    Remove all singleton dimensions.
-
-    :param tensor: A torch Tensor with singleton dimensions.
-    """
-    return torch.squeeze(tensor)
-
-
-def unsqueeze(tensor: torch.Tensor) -> torch.Tensor:
-    """
-    Add a singleton dimension at the first position.
-
-    :param tensor: A torch Tensor of any shape.
-    """
-    return torch.unsqueeze(tensor, 0)
-
-
-def rotate(tensor: torch.Tensor, num_rotation: int) -> torch.Tensor:
-    """
-    Rotate a tensor 90 degrees a number of times.
-    Works most intuitively with 2D tensors.
-
-    :param tensor: A torch Tensor of any shape.
-    :param num_rotation: Number of 90 degree rotations.
-    """
-    return torch.rot90(tensor, num_rotation)
-
-
-def get_magnitude_tensor(
-    tensor: torch.Tensor,
-) -> torch.Tensor:
-    """
-    Retrieves the magnitude Tensors, caution if doing this
-    to k-space. Required for most neural network applications
-    as data is sometimes saved in Gadgetron as complex data.
-
-    :param tensor: A torch Tensor.
-    """
-    return torch.abs(tensor)
-
-
-def reshape(tensor: torch.Tensor, shape: tuple) -> torch.Tensor:
-    """
-    Reshaped a tensor to a specified shape.
-
-    :param tensor: A torch Tensor.
-    :param shape: A shape to be reshaped to.
-    """
-
-    tensor_reshaped = torch.reshape(tensor, shape)
-
-    return tensor_reshaped
-
-
-def reshape_numpy(array: np.ndarray, shape: tuple) -> np.ndarray:
-    """
-    Reshaped an array to a specified shape.
-
-    :param array: A numpy array.
-    :param shape: A shape to be reshaped to.
-    """
-
-    array_reshaped = np.reshape(array, shape)
-
-    return array_reshaped
-
-
-def rotate_numpy(array: np.ndarray, num_rotation: int, axes: tuple) -> np.ndarray:
-    """
-    Rotate an array 90 degrees a number of times over specified axes.
-
-    :param array: A numpy array.
-    :param num_rotation: Number of 90 degree rotations.
-    :param axes: The axes to rotate over.
-    """
-
-    array_rotated = np.rot90(array, num_rotation, axes)
-
-    return array_rotated
+import torch
+import numpy as np
+
+from modules import staging
+
+
+def convert_numpy2tensor(array: np.ndarray, device: torch.device) -> torch.Tensor:
+    """
+    Performs conversion of Numpy array on the CPU to Torch Tensor
+    on the GPU.
+
+    :param array: A Numpy array.
+    :param device: device to run inference on.
+    """
+    return torch.from_numpy(array).to(device)
+
+
+def convert_tensor2numpy(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Performs conversion of Torch Tensor on the GPU to Numpy array
+    on the CPU.
+
+    :param tensor: A torch Tensor.
+    """
+    return tensor.cpu().detach().numpy()
+
+
+def stage_numpy2tensor(
+    array: np.ndarray,
+    plan: "TransformationPlan",
+    buffer_pool: staging.StagingBufferPool,
+    device: torch.device,
+) -> torch.Tensor:
+    """
+    Materialises the planned transformation of a Numpy array into a pooled
+    host Tensor (pinned when CUDA is available) and copies it to a pooled
+    Tensor on the device with a non-blocking copy. On the CPU, the host
+    Tensor is returned.
+
+    :param array: A Numpy array.
+    :param plan: The transformations to apply (see TransformationPlan).
+    :param buffer_pool: The pool of preallocated Tensors.
+    :param device: device to run inference on.
+    """
+    view = plan.view(array)
+    host_tensor = buffer_pool.get(
+        view.shape, _torch_dtype(plan.output_dtype(view.dtype))
+    )
+    plan.materialise_view(view, out=host_tensor.numpy())
+
+    if torch.device(device).type == "cpu":
+        return host_tensor
+
+    return buffer_pool.get(host_tensor.shape, host_tensor.dtype, device).copy_(
+        host_tensor, non_blocking=True
+    )
+
+
+def _torch_dtype(dtype: np.dtype) -> torch.dtype:
+    """
+    The torch dtype of a numpy dtype (cached).
+    """
+    torch_dtype = _TORCH_DTYPES.get(dtype)
+    if torch_dtype is None:
+        torch_dtype = torch.from_numpy(np.empty(0, dtype)).dtype
+        _TORCH_DTYPES[dtype] = torch_dtype
+
+    return torch_dtype
+
+
+_TORCH_DTYPES = {}
+
+
+def stage_tensor2numpy(
+    tensor: torch.Tensor, buffer_pool: staging.StagingBufferPool
+) -> np.ndarray:
+    """
+    Performs conversion of Torch Tensor on the GPU to Numpy array on the CPU
+    through a pooled (pinned) host Tensor. Tensors on the CPU are converted
+    without copying.
+
+    :param tensor: A torch Tensor.
+    :param buffer_pool: The pool of preallocated Tensors.
+    """
+    tensor = tensor.detach()
+    if tensor.device.type == "cpu":
+        return tensor.numpy()
+
+    host_tensor = buffer_pool.get(tensor.shape, tensor.dtype)
+    host_tensor.copy_(tensor, non_blocking=True)
+    torch.cuda.current_stream(tensor.device).synchronize()
+
+    return host_tensor.numpy()
+
+
+def convert2rgb(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Method to convert an initially grayscale tensor to RGB.
+
+    :param tensor: A torch Tensor.
+    """
+    rgb_tensor = torch.stack((0.33 * tensor, 0.33 * tensor, 0.33 * tensor), dim=1)
+
+    return rgb_tensor
+
+
+def squeeze(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Remove all singleton dimensions.
+
+    :param tensor: A torch Tensor with singleton dimensions.
+    """
+    return torch.squeeze(tensor)
+
+
+def unsqueeze(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Add a singleton dimension at the first position.
+
+    :param tensor: A torch Tensor of any shape.
+    """
+    return torch.unsqueeze(tensor, 0)
+
+
+def rotate(tensor: torch.Tensor, num_rotation: int) -> torch.Tensor:
+    """
+    Rotate a tensor 90 degrees a number of times.
+    Works most intuitively with 2D tensors.
+
+    :param tensor: A torch Tensor of any shape.
+    :param num_rotation: Number of 90 degree rotations.
+    """
+    return torch.rot90(tensor, num_rotation)
+
+
+def get_magnitude_tensor(
+    tensor: torch.Tensor,
+    out: torch.Tensor = None,
+) -> torch.Tensor:
+    """
+    Retrieves the magnitude Tensors, caution if doing this
+    to k-space. Required for most neural network applications
+    as data is sometimes saved in Gadgetron as complex data.
+
+    :param tensor: A torch Tensor.
+    :param out: An optional (real) Tensor to write the magnitude into.
+    """
+    return torch.abs(tensor, out=out)
+
+
+def reshape(tensor: torch.Tensor, shape: tuple) -> torch.Tensor:
+    """
+    Reshaped a tensor to a specified shape.
+
+    :param tensor: A torch Tensor.
+    :param shape: A shape to be reshaped to.
+    """
+
+    tensor_reshaped = torch.reshape(tensor, shape)
+
+    return tensor_reshaped
+
+
+def reshape_numpy(array: np.ndarray, shape: tuple) -> np.ndarray:
+    """
+    Reshaped an array to a specified shape.
+
+    :param array: A numpy array.
+    :param shape: A shape to be reshaped to.
+    """
+
+    array_reshaped = np.reshape(array, shape)
+
+    return array_reshaped
+
+
+def rotate_numpy(array: np.ndarray, num_rotation: int, axes: tuple) -> np.ndarray:
+    """
+    Rotate an array 90 degrees a number of times over specified axes.
+
+    :param array: A numpy array.
+    :param num_rotation: Number of 90 degree rotations.
+    :param axes: The axes to rotate over.
+    """
+
+    array_rotated = np.rot90(array, num_rotation, axes)
+
+    return array_rotated
+
+
+class TransformationPlan:
+    """
+    Composes array transformations (reshape, rotations, flips and transposes)
+    into one strided view of the input, without copying any data, and
+    materialises the view (optionally with its magnitude and a dtype
+    conversion) with a single ufunc call writing into a preallocated
+    destination. Steps are added by chaining, e.g.:
+
+    plan = TransformationPlan(magnitude=True).reshape(shape).rotate(2, (0, 1))
+
+    view (and materialise_view into an out, without magnitude) only reads the
+    steps, so such a plan can be shared, e.g., as a class attribute. Otherwise
+    the plan writes into its own buffers, so it must have a single owner.
+    """
+
+    __slots__ = (
+        "steps",
+        "magnitude",
+        "dtype",
+        "buffer_count",
+        "buffers",
+        "scratch",
+        "index",
+    )
+
+    def __init__(
+        self, magnitude: bool = False, dtype: np.dtype = None, buffer_count: int = 1
+    ) -> None:
+        """
+        :param magnitude: materialise the magnitude of the (complex) view.
+        :param dtype: dtype of the materialised array (converted with unsafe
+            casting, as astype). Defaults to the dtype of the (magnitude of
+            the) input.
+        :param buffer_count: number of destinations materialise rotates
+            through when no out is given, so a materialised array stays valid
+            until buffer_count more arrays have been materialised.
+        """
+        self.steps = []
+        self.magnitude = magnitude
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.buffer_count = buffer_count
+        self.buffers = {}
+        self.scratch = None
+        self.index = 0
+
+    def reshape(self, shape) -> "TransformationPlan":
+        """
+        Adds a reshape, which must be possible without copying.
+
+        :param shape: the new shape, or a callable mapping the current shape to
+            the new shape (e.g., lambda shape: shape[:4]).
+        """
+        self.steps.append(("reshape", shape))
+        return self
+
+    def rotate(self, num_rotation: int, axes: tuple = (0, 1)) -> "TransformationPlan":
+        """
+        Adds rotations by 90 degrees over the axes (as numpy.rot90).
+
+        :param num_rotation: Number of 90 degree rotations.
+        :param axes: The axes to rotate over.
+        """
+        self.steps.append(("rotate", (num_rotation, axes)))
+        return self
+
+    def flip(self, axis: int) -> "TransformationPlan":
+        """
+        Adds a flip of the axis (as numpy.flip).
+
+        :param axis: The axis to flip.
+        """
+        self.steps.append(("flip", axis))
+        return self
+
+    def transpose(self, axes: tuple = None) -> "TransformationPlan":
+        """
+        Adds a permutation of the axes (as numpy.transpose).
+
+        :param axes: The permutation, reversing the axes if None.
+        """
+        self.steps.append(("transpose", axes))
+        return self
+
+    def view(self, array: np.ndarray) -> np.ndarray:
+        """
+        Returns the transformed array as a view onto the input array.
+
+        :param array: A numpy array.
+        """
+        view = array
+        for step, argument in self.steps:
+            if step == "reshape":
+                shape = argument(view.shape) if callable(argument) else argument
+                view = view.view()
+                try:
+                    view.shape = shape  # Only possible without copying.
+                except AttributeError as error:
+                    raise ValueError(
+                        f"Reshaping a view of shape {view.shape} and strides "
+                        f"{view.strides} to {shape} would copy: {error}"
+                    ) from None
+            elif step == "rotate":
+                view = _rotate_view(view, *argument)
+            elif step == "flip":
+                view = np.flip(view, argument)
+            else:
+                view = np.transpose(view, argument)
+
+        return view
+
+    def output_dtype(self, input_dtype: np.dtype) -> np.dtype:
+        """
+        The dtype of the materialised array for an input dtype.
+
+        :param input_dtype: the dtype of the input array.
+        """
+        if self.dtype is not None:
+            return self.dtype
+        if self.magnitude:
+            return np.empty(0, dtype=input_dtype).real.dtype
+
+        return np.dtype(input_dtype)
+
+    def materialise(self, array: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        Writes the transformed (magnitude of the) array into out, or into the
+        next preallocated destination, and returns it (in the transformed
+        shape).
+
+        :param array: A numpy array.
+        :param out: A C-contiguous destination with as many elements as the
+            array, of any shape and of the output dtype.
+        """
+        return self.materialise_view(self.view(array), out)
+
+    def materialise_view(self, view: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        As materialise, for a view already returned by view.
+
+        :param view: the transformed view (see view).
+        :param out: A C-contiguous destination with as many elements as the
+            view, of any shape and of the output dtype.
+        """
+        if out is None:
+            out = self.buffer(view.shape, self.output_dtype(view.dtype))
+        else:
+            out = out.reshape(view.shape)
+
+        if self.magnitude:
+            if np.iscomplexobj(view) and not view.flags.c_contiguous:
+                # The magnitude of contiguous complex arrays is computed by a
+                # vectorised loop which can round differently from the strided
+                # one, so gather the view first to stay bit-identical.
+                # Only the latest scratch array is kept.
+                scratch = self.scratch
+                if (
+                    scratch is None
+                    or scratch.shape != view.shape
+                    or scratch.dtype != view.dtype
+                ):
+                    scratch = self.scratch = np.empty(view.shape, view.dtype)
+                np.copyto(scratch, view)
+                view = scratch
+            np.absolute(view, out=out, casting="unsafe")
+        else:
+            np.copyto(out, view, casting="unsafe")
+
+        return out
+
+    def buffer(self, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        """
+        Returns the next preallocated destination of the shape and dtype.
+
+        :param shape: the shape of the destination.
+        :param dtype: the dtype of the destination.
+        """
+        buffers = self.buffers.get((shape, dtype))
+        if buffers is None:
+            buffers = [np.empty(shape, dtype) for _ in range(self.buffer_count)]
+            self.buffers[(shape, dtype)] = buffers
+
+        self.index = (self.index + 1) % len(buffers)
+
+        return buffers[self.index]
+
+
+def _rotate_view(array: np.ndarray, num_rotation: int, axes: tuple) -> np.ndarray:
+    """
+    numpy.rot90 with the flips indexed directly, which is several times
+    faster for small arrays.
+    """
+    num_rotation %= 4
+    if num_rotation == 0:
+        return array
+
+    index = [slice(None)] * array.ndim
+    if num_rotation == 2:
+        index[axes[0]] = index[axes[1]] = slice(None, None, -1)
+        return array[tuple(index)]
+
+    index[axes[1] if num_rotation == 1 else axes[0]] = slice(None, None, -1)
+
+    return array[tuple(index)].swapaxes(*axes)
@@ -0,0 +1,396 @@
+"""
+In this module, the out-of-process inference worker pool is stored. The
+gadget process iterates the Gadgetron connection, pretransforms, packs and
+sends, while N worker processes each load the model and run
+perform_inference, so inference no longer competes with the rest of the
+gadget for the GIL (and several frames can be inferred at once on a
+multi-core machine).
+
+Frames are exchanged through a multiprocessing.shared_memory ring of fixed
+slots sized from the model's Dimensions: the gadget writes the pretransformed
+tensor into a free input slot, a worker writes the inferred tensor into the
+same slot of the output ring, and only (sequence number, slot) pairs and the
+output shape cross the process boundary. Results are yielded in submission
+order whichever worker finishes first.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+import typing
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from modules import dimensions, model
+
+_STOP = None  # Task telling a worker to exit.
+
+
+class InferenceWorkerError(RuntimeError):
+    """
+    Raised in the gadget process when a worker failed to load its model or to
+    infer a frame, or exited unexpectedly.
+    """
+
+
+class SharedMemoryRing:
+    """
+    slot_count fixed input and output slots of float32 in one shared memory
+    block: created by the gadget process and attached to by name in the
+    workers.
+    """
+
+    __slots__ = "shm", "input_dimensions", "output_size", "inputs", "outputs"
+
+    def __init__(
+        self,
+        slot_count: int,
+        input_dimensions: tuple,
+        output_size: int,
+        name: str = None,
+    ) -> None:
+        """
+        :param slot_count: the number of slots.
+        :param input_dimensions: the shape of an input frame.
+        :param output_size: the number of elements of an output slot.
+        :param name: the shared memory block to attach to (created if not
+            given).
+        """
+        input_size = int(np.prod(input_dimensions))
+        size = slot_count * (input_size + output_size) * np.dtype(np.float32).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.input_dimensions = tuple(input_dimensions)
+        self.output_size = output_size
+        slots = np.ndarray(
+            (slot_count, input_size + output_size), np.float32, self.shm.buf
+        )
+        self.inputs = slots[:, :input_size].reshape(
+            (slot_count,) + self.input_dimensions
+        )
+        self.outputs = slots[:, input_size:]
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self, unlink: bool = False) -> None:
+        """
+        :param unlink: also free the block (gadget process only).
+        """
+        self.inputs = self.outputs = None  # Release the exported buffer first.
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        return None
+
+
+def _worker(
+    worker_index: int,
+    ring_arguments: tuple,
+    model_arguments: tuple,
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+) -> None:
+    """
+    Loads the model, prepares it for the input slots, and infers the frames of
+    the slots taken from the task queue until told to stop. Failures are reported on the result queue.
+    """
+    ring = None
+    try:
+        model_class, device, model_name, engine_options, parameter_paths = (
+            model_arguments
+        )
+        # The parameter location as configured in the gadget process.
+        model.Model.DOCKER, model.Model.DOCKERPATH, model.Model.MRLPATH = (
+            parameter_paths
+        )
+        ring = SharedMemoryRing(*ring_arguments)
+        inference_model = model_class(
+            torch.device(device), model_name, **engine_options
+        )
+        # Allocated and warmed up for the connection's matrix size before the
+        # first frame, which would otherwise pay for both.
+        inference_model.prepare(ring.input_dimensions)
+        results.put(("ready", worker_index, None, None))
+    except BaseException:
+        results.put(("error", worker_index, None, traceback.format_exc()))
+        if ring is not None:
+            ring.close()
+        return None
+
+    with torch.no_grad():
+        while True:
+            task = tasks.get()
+            if task is _STOP:
+                break
+
+            sequence, slot = task
+            try:
+                output = inference_model.perform_inference(
+                    torch.from_numpy(ring.inputs[slot]).to(inference_model.device)
+                )
+                if output.numel() > ring.output_size:
+                    raise ValueError(
+                        f"Output of shape {tuple(output.shape)} does not fit in "
+                        f"an output slot of {ring.output_size} elements"
+                    )
+                torch.from_numpy(ring.outputs[slot, : output.numel()]).view(
+                    output.shape
+                ).copy_(output)
+                results.put((sequence, slot, tuple(output.shape), None))
+            except BaseException:
+                results.put((sequence, slot, None, traceback.format_exc()))
+
+    ring.close()
+    return None
+
+
+class InferenceWorkerPool:
+    """
+    worker_count processes running perform_inference on frames exchanged
+    through a SharedMemoryRing. Intended to work in a context manager, which
+    stops the workers and frees the ring. The workers load the model when
+    the pool is constructed, which waits until every worker is ready.
+    """
+
+    __slots__ = (
+        "worker_count",
+        "slot_count",
+        "ring",
+        "tasks",
+        "results",
+        "processes",
+        "next_sequence",
+        "pending",
+    )
+
+    def __init__(
+        self,
+        model_class: type,
+        model_name: str,
+        model_dimensions: dimensions.Dimensions,
+        worker_count: int = 2,
+        slot_count: int = None,
+        device: str = "cpu",
+        engine_options: dict = None,
+        timeout: float = 60.0,
+    ) -> None:
+        """
+        :param model_class: the Model child class (e.g., EdsrModel).
+        :param model_name: the name of the parameter file.
+        :param model_dimensions: the dimensions of the connection: inputs must
+            have the shape input_dimensions and the output slots hold as many
+            elements as output_dimensions.
+        :param worker_count: the number of worker processes.
+        :param slot_count: the number of slots, i.e., the maximum number of
+            frames in flight (default: two per worker).
+        :param device: the device the workers infer on.
+        :param engine_options: the engine options of the model. Unless
+            intra_op_threads is given, the workers share the cores equally.
+        :param timeout: seconds to wait for a worker to load its model.
+        """
+        if worker_count < 1:
+            raise ValueError(f"worker_count must be at least 1, got {worker_count}")
+
+        engine_options = dict(engine_options or {})
+        if engine_options.get("intra_op_threads") is None:
+            engine_options["intra_op_threads"] = max(
+                1, (os.cpu_count() or 1) // worker_count
+            )
+
+        self.worker_count = worker_count
+        self.slot_count = 2 * worker_count if slot_count is None else slot_count
+        ring_arguments = (
+            self.slot_count,
+            model_dimensions.input_dimensions,
+            int(np.prod(model_dimensions.output_dimensions)),
+        )
+        self.ring = SharedMemoryRing(*ring_arguments)
+
+        # Spawned, not forked: forking a process that already runs torch
+        # threads (or CUDA) is unsafe.
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        # Sequence numbers run on across runs, and pending counts the frames
+        # submitted whose results have not been collected yet.
+        self.next_sequence = 0
+        self.pending = 0
+        model_arguments = (
+            model_class,
+            str(device),
+            model_name,
+            engine_options,
+            (model.Model.DOCKER, model.Model.DOCKERPATH, model.Model.MRLPATH),
+        )
+        self.processes = [
+            context.Process(
+                target=_worker,
+                args=(
+                    worker_index,
+                    ring_arguments + (self.ring.name,),
+                    model_arguments,
+                    self.tasks,
+                    self.results,
+                ),
+                name=f"inference-worker-{worker_index}",
+                daemon=True,
+            )
+            for worker_index in range(worker_count)
+        ]
+
+        start = time.perf_counter()
+        for process in self.processes:
+            process.start()
+
+        try:
+            for _ in range(worker_count):
+                status, worker_index, _, message = self.get_result(timeout)
+                if status == "error":
+                    raise InferenceWorkerError(
+                        f"Inference worker {worker_index} failed to start:\n{message}"
+                    )
+        except BaseException:
+            self.close()
+            raise
+
+        logging.info(
+            f"Started {worker_count} inference workers in "
+            f"{time.perf_counter() - start:.3f} s ({self.slot_count} slots of "
+            f"{model_dimensions.input_dimensions} in shared memory)."
+        )
+
+    @property
+    def max_in_flight(self) -> int:
+        """
+        The most frames taken from the source of run and not yet consumed at
+        once: one in every slot, and the next frame waiting for a free slot.
+        """
+        return self.slot_count + 1
+
+    def get_result(self, timeout: float = None) -> tuple:
+        """
+        Returns the next message of the result queue, checking the workers
+        are still alive while waiting.
+
+        :param timeout: seconds to wait (forever if not given).
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            try:
+                return self.results.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+            for process in self.processes:
+                if not process.is_alive():
+                    raise InferenceWorkerError(
+                        f"{process.name} exited with code {process.exitcode}"
+                    )
+
+            if deadline is not None and time.perf_counter() > deadline:
+                raise InferenceWorkerError(
+                    "Timed out waiting for the inference workers"
+                )
+
+    def run(self, source: typing.Iterable[tuple]) -> typing.Iterator[tuple]:
+        """
+        Yields (key, inferred_tensor) for every (key, tensor) of the source,
+        in order. The inferred tensor is a view of its output slot: it stays
+        valid until the next item is requested, so posttransform (or copy) it
+        before then. Runs must not overlap: a run starts by waiting for the
+        frames still in flight from a previous run stopped early (whose slots
+        the workers may still write), and discards their results.
+
+        :param source: An iterable of (key, pretransformed tensor) pairs, the
+            tensors of shape input_dimensions.
+        """
+        while self.pending:
+            self.get_result()
+            self.pending -= 1
+
+        free_slots = list(range(self.slot_count))
+        in_flight = {}  # sequence: key
+        finished = {}  # sequence: (slot, output shape, error)
+        next_yield = self.next_sequence
+
+        def collect(block: bool) -> None:
+            while True:
+                if not block and self.results.empty():
+                    return None
+                sequence, slot, shape, message = self.get_result()
+                self.pending -= 1
+                if sequence in in_flight:  # Not a stale result.
+                    finished[sequence] = (slot, shape, message)
+                block = False
+
+        def ready():
+            # The finished frames next in submission order.
+            nonlocal next_yield
+            while next_yield in finished:
+                slot, shape, message = finished.pop(next_yield)
+                key = in_flight.pop(next_yield)
+                next_yield += 1
+                if message is not None:
+                    raise InferenceWorkerError(f"Inference failed:\n{message}")
+
+                output = torch.from_numpy(self.ring.outputs[slot, : np.prod(shape)])
+                yield key, output.view(shape)
+                free_slots.append(slot)
+
+        for key, tensor in source:
+            if tuple(tensor.shape) != self.ring.input_dimensions:
+                raise ValueError(
+                    f"Frame of shape {tuple(tensor.shape)} does not match the "
+                    f"input slots of shape {self.ring.input_dimensions}"
+                )
+
+            while not free_slots:
+                collect(block=True)
+                yield from ready()
+
+            slot = free_slots.pop()
+            torch.from_numpy(self.ring.inputs[slot]).copy_(tensor)
+            self.tasks.put((self.next_sequence, slot))
+            self.pending += 1
+            in_flight[self.next_sequence] = key
+            self.next_sequence += 1
+
+            collect(block=False)
+            yield from ready()
+
+        while in_flight:
+            collect(block=True)
+            yield from ready()
+
+    def close(self) -> None:
+        """
+        Stops the workers and frees the shared memory.
+        """
+        for _ in self.processes:
+            self.tasks.put(_STOP)
+
+        for process in self.processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+        self.ring.close(unlink=True)
+        return None
+
+    def __enter__(self) -> "InferenceWorkerPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+        return None
@@ -1,36 +1,47 @@
-import time
-import logging
-
-import torch
-import numpy as np
-
-import ismrmrd
-import gadgetron
-
-from modules.schemas.base_image_array import (
-    BaseImageArrayNormalisation,
-    BaseImageArrayTransformations,
-)
-
-
-def main(connection):
-    logging.basicConfig(level=logging.DEBUG)
-
-    for acquisition in connection:
-        data = acquisition.data
-
-        data_cp = np.copy(data)
-
-        transformation_class = BaseImageArrayTransformations(data_cp)
-
-        image = transformation_class.transform()
-
-        normalisation_class = BaseImageArrayNormalisation(image)
-
-        image = normalisation_class.apply_normalisation()
-
-        image_to_send = ismrmrd.image.Image.from_array(
-            image, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
-        )
-
-        connection.send(image_to_send)
+import time
+import logging
+
+import torch
+import numpy as np
+
+import ismrmrd
+import gadgetron
+
+from modules import instrumentation
+
+from modules.schemas.base_image_array import (
+    BaseImageArrayNormalisation,
+    BaseImageArrayTransformations,
+)
+
+# Per-stage latency histograms are written here every METRICS_EXPORT_INTERVAL
+# seconds ("prometheus" text or "json"). Set the path to None to disable.
+METRICS_EXPORT_PATH = "/tmp/passthroughGadget_metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+METRICS_EXPORT_FORMAT = "prometheus"
+
+
+def main(connection):
+    logging.basicConfig(level=logging.DEBUG)
+
+    metrics = instrumentation.METRICS
+
+    with instrumentation.MetricsExporter(
+        METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL, METRICS_EXPORT_FORMAT
+    ):
+        for acquisition in connection:
+            with metrics.time("pretransform"):
+                transformation_class = BaseImageArrayTransformations(acquisition.data)
+
+                image = transformation_class.transform()
+
+                normalisation_class = BaseImageArrayNormalisation(image)
+
+                image = normalisation_class.apply_normalisation()
+
+            with metrics.time("gadgetron_send"):
+                image_to_send = ismrmrd.image.Image.from_array(
+                    image, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
+                )
+
+                connection.send(image_to_send)
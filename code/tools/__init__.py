@@ -0,0 +1,6 @@
+"""
+Offline tools producing alternative model artifacts (e.g., quantised models)
+from the trained parameters. Run from the code/ directory, e.g.:
+
+python -m tools.quantise_edsr --parameters modules/parameters/
+"""
@@ -0,0 +1,155 @@
+"""
+Exports the EDSR and bicubic TorchScript models to ONNX, for the ONNX
+Runtime engine (INFERENCE_ENGINE = "onnxruntime" in the gadgets). Each
+exported model is checked against its TorchScript model with ONNX Runtime.
+Requires onnx and onnxruntime.
+
+python -m tools.export_onnx --parameters modules/parameters/
+"""
+
+import argparse
+import inspect
+import logging
+import os
+
+import onnx
+import torch
+
+from modules import onnx_engine
+from modules.schemas.bicubic_sr import BICUBIC_ENGINES, BicubicDimensions
+from modules.schemas.edsr_sr import EDSR_ENGINES, EdsrDimensions
+
+from tools import stand_in_models
+
+# (model, engines, dimensions, example inputs for dimensions, input names)
+MODELS = {
+    "edsr": (
+        EDSR_ENGINES,
+        EdsrDimensions,
+        lambda dimensions: (torch.rand(dimensions.input_dimensions),),
+        ["input"],
+    ),
+    "bicubic": (
+        BICUBIC_ENGINES,
+        BicubicDimensions,
+        lambda dimensions: (
+            torch.rand(dimensions.input_dimensions),
+            torch.tensor(dimensions.input_dimensions[-1]),
+            torch.tensor(dimensions.output_dimensions[0]),
+        ),
+        ["input", "input_size", "output_size"],
+    ),
+}
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Export the models to ONNX.")
+    parser.add_argument(
+        "--parameters",
+        default="",
+        help="Directory with the real parameter files (stand-ins if not given). "
+        "The ONNX models are written there.",
+    )
+    parser.add_argument(
+        "--models", nargs="+", default=list(MODELS), choices=list(MODELS)
+    )
+    parser.add_argument("--opset", type=int, default=16)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def export(name: str, directory: str, opset: int = 16) -> str:
+    """
+    Exports a TorchScript model to ONNX (with dynamic batch, height and width
+    dimensions) and returns the path of the ONNX model. The upsampling scale
+    of a model whose output shape follows from its input shape alone (e.g.,
+    EDSR) is stored in the model metadata, so OnnxRuntimeModule can
+    preallocate its outputs.
+
+    :param name: the model (a key of MODELS).
+    :param directory: directory with the TorchScript model, written to.
+    :param opset: the ONNX opset version.
+    """
+    engines, dimensions, example_inputs, input_names = MODELS[name]
+    _, model_name = engines["torchscript"]
+    _, onnx_name = engines["onnxruntime"]
+    model = torch.jit.load(os.path.join(directory, model_name)).eval()
+    onnx_path = os.path.join(directory, onnx_name)
+
+    options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        options["dynamo"] = False  # ScriptModules need the TorchScript exporter.
+
+    torch.onnx.export(
+        model,
+        example_inputs(dimensions),
+        onnx_path,
+        input_names=input_names,
+        output_names=["output"],
+        dynamic_axes={
+            "input": {0: "batch", 2: "height", 3: "width"},
+            "output": {0: "batch", 2: "output_height", 3: "output_width"},
+        },
+        opset_version=opset,
+        **options,
+    )
+
+    if len(input_names) == 1:
+        inputs = example_inputs(dimensions)
+        with torch.no_grad():
+            scale = model(*inputs).shape[-1] // inputs[0].shape[-1]
+
+        onnx_model = onnx.load(onnx_path)
+        onnx.helper.set_model_props(
+            onnx_model, {onnx_engine.SCALE_METADATA: str(scale)}
+        )
+        onnx.save(onnx_model, onnx_path)
+
+    return onnx_path
+
+
+def check(name: str, directory: str, frames: int = 8) -> float:
+    """
+    Returns the maximum absolute difference between the ONNX Runtime and
+    TorchScript outputs of a model, for frames of the trained matrix size and
+    of twice that size.
+
+    :param name: the model (a key of MODELS).
+    :param directory: directory with the TorchScript and ONNX models.
+    :param frames: the number of random frames compared per matrix size.
+    """
+    engines, dimensions, example_inputs, _ = MODELS[name]
+    _, model_name = engines["torchscript"]
+    _, onnx_name = engines["onnxruntime"]
+    model = torch.jit.load(os.path.join(directory, model_name)).eval()
+    session = onnx_engine.OnnxRuntimeModule(os.path.join(directory, onnx_name))
+
+    matrix_size = dimensions.input_dimensions[-2:]
+    max_error = 0.0
+    with torch.no_grad():
+        for scale in (1, 2):
+            resized = dimensions.from_matrix_size([scale * n for n in matrix_size])
+            for _ in range(frames):
+                inputs = example_inputs(resized)
+                error = (session(*inputs) - model(*inputs)).abs().max()
+                max_error = max(max_error, float(error))
+
+    return max_error
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)
+    directory = stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+
+    for name in args_dict["models"]:
+        onnx_path = export(name, directory, args_dict["opset"])
+        print(
+            f"Exported {name} to {onnx_path}, max abs difference to TorchScript: "
+            f"{check(name, directory):.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Image quality metrics comparing the output of an alternative inference
+engine with the full-precision reference output.
+"""
+
+import numpy as np
+import torch
+
+
+def psnr(image: np.ndarray, reference: np.ndarray, data_range: float) -> float:
+    """
+    Peak signal-to-noise ratio (dB) of an image against the reference.
+
+    :param image: the image to assess.
+    :param reference: the reference image.
+    :param data_range: the range of the reference intensities (max - min).
+    """
+    mse = np.mean(
+        (np.asarray(image, np.float64) - np.asarray(reference, np.float64)) ** 2
+    )
+    if mse == 0:
+        return float("inf")
+
+    return float(10 * np.log10(data_range**2 / mse))
+
+
+def ssim(
+    image: np.ndarray,
+    reference: np.ndarray,
+    data_range: float,
+    window_size: int = 11,
+    sigma: float = 1.5,
+) -> float:
+    """
+    Mean structural similarity of a 2D image against the reference, with a
+    Gaussian window (Wang et al., 2004).
+
+    :param image: the image to assess.
+    :param reference: the reference image.
+    :param data_range: the range of the reference intensities (max - min).
+    :param window_size: size of the Gaussian window.
+    :param sigma: standard deviation of the Gaussian window.
+    """
+    x = torch.as_tensor(np.asarray(image, np.float64)).reshape(
+        1, 1, *np.shape(image)[:2]
+    )
+    y = torch.as_tensor(np.asarray(reference, np.float64)).reshape(x.shape)
+
+    coordinates = torch.arange(window_size, dtype=torch.float64) - window_size // 2
+    gaussian = torch.exp(-(coordinates**2) / (2 * sigma**2))
+    gaussian = gaussian / gaussian.sum()
+    window = (gaussian[:, None] * gaussian[None, :]).reshape(
+        1, 1, window_size, window_size
+    )
+
+    def filtered(tensor):
+        return torch.nn.functional.conv2d(tensor, window)
+
+    mu_x, mu_y = filtered(x), filtered(y)
+    sigma_xx = filtered(x * x) - mu_x**2
+    sigma_yy = filtered(y * y) - mu_y**2
+    sigma_xy = filtered(x * y) - mu_x * mu_y
+
+    c1, c2 = (0.01 * data_range) ** 2, (0.03 * data_range) ** 2
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / (
+        (mu_x**2 + mu_y**2 + c1) * (sigma_xx + sigma_yy + c2)
+    )
+
+    return float(ssim_map.mean())
@@ -0,0 +1,184 @@
+"""
+Produces the INT8 quantised EDSR artifact loaded by EdsrQuantisedModel, and
+reports its image quality (PSNR/SSIM against the FP32 model) and CPU latency.
+
+Static post-training quantisation (the default) quantises the weights and
+activations of the conv layers, with activation ranges calibrated on frames
+from a recorded stream (--calibration, a .npy stack of acquisition data as
+received by the gadget) or, if not given, a moving Shepp-Logan phantom.
+Dynamic quantisation is offered for completeness, but PyTorch only
+dynamically quantises linear and recurrent layers, so it leaves a conv-only
+network like EDSR unchanged. Its output is written under a separate name
+(never as the INT8 artifact), and a model without any quantised layer is not
+saved at all.
+
+python -m tools.quantise_edsr --parameters modules/parameters/
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+from torch.ao import quantization
+
+from modules import model, phantom
+from modules.schemas.edsr_sr import (
+    EDSR_ENGINES,
+    EdsrDimensions,
+    EdsrPosttransformations,
+    EdsrPretransformations,
+)
+
+from tools import image_quality, stand_in_models
+
+
+def parse_cmd_args() -> dict:
+    parser = argparse.ArgumentParser(description="Quantise the EDSR model to INT8.")
+    parser.add_argument(
+        "--parameters",
+        default="",
+        help="Directory with the real parameter files (stand-ins if not given). "
+        "The quantised model is written there.",
+    )
+    parser.add_argument("--mode", choices=("static", "dynamic"), default="static")
+    parser.add_argument(
+        "--backend",
+        default="fbgemm",
+        help="Quantised engine to calibrate for (fbgemm/x86 or qnnpack on ARM).",
+    )
+    parser.add_argument(
+        "--calibration",
+        default="",
+        help=".npy stack of recorded acquisition data (phantom frames if not given).",
+    )
+    parser.add_argument("--calibration-frames", type=int, default=32)
+    parser.add_argument("--evaluation-frames", type=int, default=16)
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+def load_frames(path: str, count: int, offset: int = 0) -> list:
+    """
+    Returns acquisition data arrays (as received by the gadget) from a
+    recorded .npy stack, or from the phantom if no path is given.
+
+    :param path: the .npy stack of acquisition data (optional).
+    :param count: the number of frames.
+    :param offset: the first phantom repetition (evaluation frames differ
+        from calibration frames).
+    """
+    if path:
+        stack = np.load(path)
+        return [stack[index % len(stack)] for index in range(offset, offset + count)]
+
+    sdim = EdsrDimensions.input_dimensions[-1]
+
+    return [
+        phantom.acquisition_data(sdim, repetition, motion=0.1)
+        for repetition in range(offset, offset + count)
+    ]
+
+
+def pretransform(data: np.ndarray) -> torch.Tensor:
+    return EdsrPretransformations(np.copy(data), torch.device("cpu")).pretransform()
+
+
+def main():
+    args_dict = parse_cmd_args()
+    logging.basicConfig(level=logging.WARNING)
+    directory = stand_in_models.use_stand_in_parameters(args_dict["parameters"])
+    model.Model.REGISTRY = None
+    torch.backends.quantized.engine = args_dict["backend"]
+
+    _, model_name = EDSR_ENGINES["torchscript"]
+    _, quantised_name = EDSR_ENGINES["int8"]
+    fp32_model = torch.jit.load(os.path.join(directory, model_name)).eval()
+
+    if args_dict["mode"] == "static":
+        calibration = [
+            pretransform(data)
+            for data in load_frames(
+                args_dict["calibration"], args_dict["calibration_frames"]
+            )
+        ]
+
+        def calibrate(module, frames):
+            with torch.no_grad():
+                for frame in frames:
+                    module(frame)
+
+        quantised_model = quantization.quantize_jit(
+            fp32_model,
+            {"": quantization.get_default_qconfig(args_dict["backend"])},
+            calibrate,
+            [calibration],
+        )
+    else:
+        quantised_model = quantization.quantize_dynamic_jit(
+            fp32_model, {"": quantization.default_dynamic_qconfig}
+        )
+
+    quantised_ops = sum(
+        len(quantised_model.graph.findAllNodes(kind))
+        for kind in (
+            "quantized::conv2d",
+            "quantized::conv2d_relu",
+            "quantized::linear_dynamic",
+        )
+    )
+    print(f"{args_dict['mode']} quantisation: {quantised_ops} quantised layers")
+
+    if quantised_ops == 0:
+        print("No layer was quantised: the model is unchanged and not saved.")
+        return None
+
+    if args_dict["mode"] == "dynamic":
+        # Not the artifact EdsrQuantisedModel loads, which is statically quantised.
+        root, extension = os.path.splitext(quantised_name)
+        quantised_name = f"{root}_dynamic{extension}"
+
+    output_path = os.path.join(directory, quantised_name)
+    torch.jit.save(quantised_model, output_path)
+    print(f"Saved {output_path}")
+
+    psnrs, ssims, latencies = [], [], {"fp32": [], "int8": []}
+    evaluation = load_frames(
+        args_dict["calibration"],
+        args_dict["evaluation_frames"],
+        offset=args_dict["calibration_frames"],
+    )
+    with torch.no_grad():
+        for data in evaluation:
+            frame = pretransform(data)
+            images = {}
+            for engine, module in (("fp32", fp32_model), ("int8", quantised_model)):
+                start = time.perf_counter()
+                output = module(frame)
+                latencies[engine].append(time.perf_counter() - start)
+                images[engine] = EdsrPosttransformations(output).posttransform()[
+                    :, :, 0, 0
+                ]
+
+            data_range = float(images["fp32"].max() - images["fp32"].min())
+            psnrs.append(image_quality.psnr(images["int8"], images["fp32"], data_range))
+            ssims.append(image_quality.ssim(images["int8"], images["fp32"], data_range))
+
+    fp32_latency = 1e3 * np.median(latencies["fp32"][1:])
+    int8_latency = 1e3 * np.median(latencies["int8"][1:])
+    print(
+        f"INT8 vs FP32 over {len(evaluation)} frames: "
+        f"PSNR mean {np.mean(psnrs):.2f} dB (min {np.min(psnrs):.2f} dB), "
+        f"SSIM mean {np.mean(ssims):.4f} (min {np.min(ssims):.4f})"
+    )
+    print(
+        f"CPU latency p50: FP32 {fp32_latency:.2f} ms, INT8 {int8_latency:.2f} ms "
+        f"(speedup {fp32_latency / int8_latency:.2f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
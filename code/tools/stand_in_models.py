@@ -0,0 +1,86 @@
+"""
+TorchScript stand-ins for the trained models, so the tools and benchmarks can
+run on machines without the released parameter files. The EDSR stand-in follows the
+EDSR layout (head, residual body, x4 pixel-shuffle tail) at a reduced width,
+and the bicubic stand-in has the same call signature as the bicubic model.
+The stand-ins are saved under the names of the released parameter files, so
+the gadgets load them unchanged. If the real parameter files are present in modules/parameters/, use those
+instead by passing --parameters modules/parameters/.
+"""
+
+import os
+import tempfile
+
+import torch
+
+from modules import model
+
+EDSR_STAND_IN = "2022-09-10_11-22-39_edsr_nonoise.pt"
+BICUBIC_STAND_IN = "64_to_256_bicubic_interpolation_JIT.pt"
+
+
+class _ResidualBlock(torch.nn.Module):
+    def __init__(self, features: int) -> None:
+        super().__init__()
+        self.body = torch.nn.Sequential(
+            torch.nn.Conv2d(features, features, 3, padding=1),
+            torch.nn.ReLU(),
+            torch.nn.Conv2d(features, features, 3, padding=1),
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x + 0.1 * self.body(x)
+
+
+class _EdsrStandIn(torch.nn.Module):
+    def __init__(self, features: int = 32, blocks: int = 4) -> None:
+        super().__init__()
+        self.head = torch.nn.Conv2d(1, features, 3, padding=1)
+        self.body = torch.nn.Sequential(
+            *[_ResidualBlock(features) for _ in range(blocks)]
+        )
+        self.tail = torch.nn.Sequential(
+            torch.nn.Conv2d(features, 4 * features, 3, padding=1),
+            torch.nn.PixelShuffle(2),
+            torch.nn.Conv2d(features, 4 * features, 3, padding=1),
+            torch.nn.PixelShuffle(2),
+            torch.nn.Conv2d(features, 1, 3, padding=1),
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = self.head(x)
+        x = x + self.body(x)
+        return self.tail(x)
+
+
+class _BicubicStandIn(torch.nn.Module):
+    def forward(
+        self, x: torch.Tensor, input_size: torch.Tensor, output_size: torch.Tensor
+    ) -> torch.Tensor:
+        scale = float(output_size) / float(input_size)
+        return torch.nn.functional.interpolate(
+            x, scale_factor=scale, mode="bicubic", align_corners=False
+        )
+
+
+def use_stand_in_parameters(directory: str = "") -> str:
+    """
+    Points Model at a directory of parameter files, writing the TorchScript
+    stand-ins there first when no directory is given. Returns the directory.
+
+    :param directory: directory holding the parameter files (optional).
+    """
+    if not directory:
+        directory = tempfile.mkdtemp(prefix="sr_stand_in_")
+        torch.manual_seed(0)
+        torch.jit.script(_EdsrStandIn().eval()).save(
+            os.path.join(directory, EDSR_STAND_IN)
+        )
+        torch.jit.script(_BicubicStandIn().eval()).save(
+            os.path.join(directory, BICUBIC_STAND_IN)
+        )
+
+    model.Model.DOCKER = False
+    model.Model.MRLPATH = directory
+
+    return directory
@@ -1,62 +1,170 @@
-import time
-import logging
-
-import torch
-import numpy as np
-
-import ismrmrd
-import gadgetron
-
-from modules.schemas.base_image_array import (
-    BaseImageArrayNormalisation,
-    BaseImageArrayTransformations,
-)
-
-from modules.schemas.mlc_tracking import (
-    MLCImageArrayParser,
-    MLCSocketmaker,
-    MLCStructmaker,
-)
-
-
-def main(connection):
-    logging.basicConfig(level=logging.DEBUG)
-
-    with MLCSocketmaker() as MLCsm:
-        MLCsm.create_socketclient()
-        MLCsm.connect_socketclient()
-
-        for acquisition in connection:
-            data = acquisition.data
-
-            data_cp = np.copy(data)
-
-            transformation_class = BaseImageArrayTransformations(data_cp)
-
-            image = transformation_class.transform()
-
-            normalisation_class = BaseImageArrayNormalisation(image)
-
-            image = normalisation_class.apply_normalisation()
-
-            parser_class = MLCImageArrayParser(acquisition, connection)
-
-            acquisition_data = parser_class.retrieve_acquisition_data()
-
-            connection_data = parser_class.retrieve_connection_data()
-
-            structmaker_class = MLCStructmaker(
-                acquisition_data, connection_data, image, upsample_ratio=1
-            )
-
-            packed_struct = structmaker_class.pack_struct()
-
-            logging.info(f"{structmaker_class.header}")
-
-            MLCsm.send_packed_struct(packed_struct)
-
-            image_to_send = ismrmrd.image.Image.from_array(
-                image, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
-            )
-
-            connection.send(image_to_send)
+import time
+import logging
+
+import torch
+import numpy as np
+
+import ismrmrd
+import gadgetron
+
+from modules import instrumentation, pipeline
+
+from modules.schemas.base_image_array import (
+    BaseImageArrayNormalisation,
+    BaseImageArrayTransformations,
+)
+
+from modules.schemas.mlc_tracking import (
+    MLCImageArrayParser,
+    MLCPackerCache,
+    MLCRegionOfInterest,
+    MLCSharedMemorySocketmaker,
+    MLCSocketmaker,
+    MLCStructmaker,
+)
+
+# Maximum number of frames queued between stages. Set to 0 to run the stages
+# strictly one after another for each acquisition.
+PIPELINE_QUEUE_DEPTH = 2
+
+# MLCSocketmaker options. hostname/port: address of the MLC tracking
+# software. scatter_gather: send the header and image payload as separate
+# buffers with one vectored send. asynchronous: send from a background thread
+# so a slow MLC tracking consumer does not block the reconstruction, keeping
+# at most queue_size frames and applying the overflow_policy ("block",
+# "drop-oldest" or "drop-newest") beyond that. reconnect: drop frames and
+# reconnect with backoff while the MLC tracking software is unavailable,
+# instead of stopping the reconstruction. socket_path: connect to an AF_UNIX
+# stream socket at this path instead of hostname:port (MLC tracking software
+# on the same host). compression: "zlib" to send a keyframe every
+# keyframe_interval frames and compressed deltas in between, if the receiver
+# offers it when connecting (raw frames otherwise).
+MLC_SOCKET_OPTIONS = {
+    "hostname": "localhost",
+    "port": 31000,
+    "scatter_gather": False,
+    "asynchronous": True,
+    "queue_size": 2,
+    "overflow_policy": "drop-oldest",
+    "reconnect": True,
+    "socket_path": None,
+    "compression": None,
+    "keyframe_interval": 30,
+}
+
+# Name of a shared memory ring, created by the MLC tracking software on the
+# same host, to write the frames to instead of sending them over a socket (see
+# MLCSharedMemorySocketmaker). None sends with MLC_SOCKET_OPTIONS.
+MLC_SHARED_MEMORY_RING = None
+
+# MLCRegionOfInterest options, to send only a window of the image around the
+# target instead of the full image. size: (width, height) of the window in
+# pixels of the image sent. centre: pixel index of a fixed window (default:
+# the image centre). recentre: move the window to the centroid of the pixels
+# above threshold (a fraction of the maximum) on every frame, smoothed with
+# momentum. The slice position sent is that of the window centre. None sends
+# the full image. E.g., {"size": (96, 96), "recentre": True, "momentum": 0.5}.
+MLC_REGION_OF_INTEREST = None
+
+# Per-stage latency histograms are written here every METRICS_EXPORT_INTERVAL
+# seconds ("prometheus" text or "json"). Set the path to None to disable.
+METRICS_EXPORT_PATH = "/tmp/trackingGadget_metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+METRICS_EXPORT_FORMAT = "prometheus"
+
+
+def main(connection):
+    logging.basicConfig(level=logging.DEBUG)
+
+    metrics = instrumentation.METRICS
+
+    if MLC_SHARED_MEMORY_RING is None:
+        mlc_socketmaker = MLCSocketmaker(**MLC_SOCKET_OPTIONS)
+    else:
+        mlc_socketmaker = MLCSharedMemorySocketmaker(MLC_SHARED_MEMORY_RING)
+
+    with mlc_socketmaker as MLCsm, instrumentation.MetricsExporter(
+        METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL, METRICS_EXPORT_FORMAT
+    ):
+        MLCsm.create_socketclient()
+        MLCsm.connect_socketclient()
+
+        # Frames packed into a cached buffer stay queued until sent, so keep
+        # enough buffers for every frame that can be in flight.
+        packer_cache = MLCPackerCache(
+            buffer_count=PIPELINE_QUEUE_DEPTH + MLCsm.queue_size + 3
+        )
+
+        # The window sent, tracked across the frames of this connection.
+        region_of_interest = None
+        if MLC_REGION_OF_INTEREST is not None:
+            region_of_interest = MLCRegionOfInterest(**MLC_REGION_OF_INTEREST)
+
+        def transform(acquisition):
+            with metrics.time("pretransform"):
+                transformation_class = BaseImageArrayTransformations(acquisition.data)
+
+                image = transformation_class.transform()
+
+                normalisation_class = BaseImageArrayNormalisation(image)
+
+                image = normalisation_class.apply_normalisation()
+
+            return acquisition, image
+
+        def pack(frame):
+            acquisition, image = frame
+
+            with metrics.time("parse"):
+                parser_class = MLCImageArrayParser(acquisition, connection)
+
+                acquisition_data = parser_class.retrieve_acquisition_data()
+
+                connection_data = parser_class.retrieve_connection_data()
+
+                orientation_data = None
+                if region_of_interest is not None:
+                    orientation_data = parser_class.retrieve_orientation_data()
+
+            with metrics.time("pack"):
+                structmaker_class = MLCStructmaker(
+                    acquisition_data,
+                    connection_data,
+                    image,
+                    upsample_ratio=1,
+                    packer_cache=packer_cache,
+                    region_of_interest=region_of_interest,
+                    orientation_data=orientation_data,
+                )
+
+                if MLCsm.scatter_gather:
+                    packed_struct = structmaker_class.pack_struct_parts()
+                else:
+                    packed_struct = structmaker_class.pack_struct()
+
+            logging.info(f"{structmaker_class.header}")
+
+            return image, packed_struct
+
+        def send(frame):
+            image, packed_struct = frame
+
+            with metrics.time("mlc_send"):
+                MLCsm.send_packed_struct(packed_struct)
+
+            with metrics.time("gadgetron_send"):
+                image_to_send = ismrmrd.image.Image.from_array(
+                    image, image_type=ismrmrd.IMTYPE_MAGNITUDE, transpose=True
+                )
+
+                connection.send(image_to_send)
+
+        executor = pipeline.create_executor(
+            [("transform", transform), ("pack", pack), ("send", send)],
+            queue_depth=PIPELINE_QUEUE_DEPTH,
+        )
+
+        statistics = executor.run(connection)
+
+        logging.info(f"Tracking pipeline: {statistics.summary()}")
+        logging.info(f"{packer_cache}")
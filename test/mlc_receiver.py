@@ -0,0 +1,550 @@
+"""
+Reusable stand-in for the MLC tracking software, receiving the frames sent
+by MLCSocketmaker (over TCP or an AF_UNIX stream socket, MLCReceiver) or
+written by MLCSharedMemorySocketmaker (MLCSharedMemoryReceiver). Each frame
+is a prefix of two unsigned ints (HEADERSIZE, the size of the header in
+bytes, and the size of the image payload in bytes), the header (slice
+positions, voxel sizes, width and height) and the uint16 image payload.
+Frames are delimited using the prefix of each frame, so the image size does
+not need to be known in advance.
+
+Data is read with recv_into a preallocated buffer and decoded in place with
+numpy.frombuffer. The receiver accepts new connections after a client
+disconnects (e.g., when the gadget restarts or reconnects) and keeps
+inter-arrival, throughput and validation statistics across them.
+
+On every connection, MLCReceiver offers compressed frames (ENCODING_OFFER,
+see MLCSocketmaker compression). A compressed frame is flagged by the
+encoding in the upper 16 bits of its HEADERSIZE word and its payload is a
+zlib compressed keyframe, or the int16 delta with the previous frame of the
+connection, decoded by MLCFrameDecoder.
+
+The shared memory ring is created by the receiver: a RING_HEADER (magic,
+version, slot count, slot size and the sequence number of the last frame
+written) followed by fixed-size slots, each a SLOT_HEADER (sequence number
+and length of the frame) and the frame in the same format as on a socket.
+Frames are copied out of their slot and kept only if the slot's sequence
+number is unchanged after the copy. Frames overwritten before they were read
+are counted as missed.
+"""
+
+from dataclasses import dataclass, field
+from array import array
+import logging
+from multiprocessing import shared_memory
+import os
+import socket
+import struct
+import time
+import typing
+import zlib
+
+import numpy as np
+
+PREFIX = struct.Struct("2I")
+HEADER_DTYPE = np.dtype(
+    [
+        ("SlicePositionSagittal", "=f8"),
+        ("SlicePositionCoronal", "=f8"),
+        ("SlicePositionTransverse", "=f8"),
+        ("SliceThickness", "=f8"),
+        ("SpacingBetweenSlices", "=f8"),
+        ("PixelSizeX", "=f8"),
+        ("PixelSizeY", "=f8"),
+        ("Width", "=i4"),
+        ("Height", "=i4"),
+    ]
+)
+HEADERSIZE = HEADER_DTYPE.itemsize
+
+RING_MAGIC = b"MLCR"
+RING_VERSION = 1
+RING_HEADER = struct.Struct("=4sIIIQ")
+SLOT_HEADER = struct.Struct("=QQ")
+SLOTS_OFFSET = 64
+
+ENCODING_RAW = 0
+ENCODING_KEYFRAME = 1
+ENCODING_DELTA = 2
+ENCODING_SHIFT = 16
+ENCODING_OFFER = struct.Struct("=4sI")
+ENCODING_MAGIC = b"MLCE"
+COMPRESSION_ZLIB = 1
+
+
+@dataclass
+class ReceiverStatistics:
+    """
+    Counters of the receiver. Inter-arrival intervals (seconds) are measured
+    between consecutive frames of the same connection.
+    """
+
+    connections: int = 0
+    frames: int = 0
+    invalid_frames: int = 0
+    missed_frames: int = 0  # Overwritten in the shared memory ring before read.
+    compressed_frames: int = 0
+    bytes_received: int = 0
+    first_arrival: float = None
+    last_arrival: float = None
+    intervals: array = field(default_factory=lambda: array("d"))
+
+    @property
+    def throughput(self) -> float:
+        """
+        Frames received per second, between the first and last frame.
+        """
+        elapsed = 0.0 if self.frames < 2 else self.last_arrival - self.first_arrival
+        if elapsed <= 0.0:  # Also when every frame came in one receive.
+            return 0.0
+
+        return (self.frames - 1) / elapsed
+
+    def summary(self) -> str:
+        intervals = np.frombuffer(self.intervals, dtype=np.float64)
+        if intervals.size:
+            elapsed = self.last_arrival - self.first_arrival
+            timing = (
+                f"{self.throughput:.1f} frames/s, "
+                f"{self.bytes_received / 2**20 / max(elapsed, 1e-9):.1f} MiB/s, "
+                f"inter-arrival p50: {1e3 * np.percentile(intervals, 50):.2f} ms, "
+                f"p99: {1e3 * np.percentile(intervals, 99):.2f} ms, "
+                f"max: {1e3 * intervals.max():.2f} ms, "
+                f"jitter (std): {1e3 * intervals.std():.2f} ms"
+            )
+        else:
+            timing = "no inter-arrival times"
+
+        missed = f", {self.missed_frames} missed" if self.missed_frames else ""
+        if self.compressed_frames:
+            missed += f", {self.compressed_frames} compressed"
+
+        return (
+            f"{self.connections} connections, {self.frames} frames "
+            f"({self.invalid_frames} invalid{missed}), {self.bytes_received} "
+            f"bytes, {timing}"
+        )
+
+
+class MLCFrameDecoder:
+    """
+    Decodes the compressed frames of one connection (see MLCFrameEncoder):
+    keyframes are decompressed, and deltas decompressed and added to the
+    previous image (a wrapping uint16 addition, so the image is exact).
+    """
+
+    def __init__(self) -> None:
+        self.image = None
+
+    def decode(self, encoding: int, payload: bytes) -> np.ndarray:
+        """
+        Returns the decoded image, a buffer reused by the next frame. Raises
+        ValueError for an unknown encoding or a delta without a keyframe of
+        the same size before it, and zlib.error for a corrupt payload.
+
+        :param encoding: the encoding from the frame prefix.
+        :param payload: the compressed image payload.
+        """
+        data = np.frombuffer(zlib.decompress(payload), dtype=np.uint16)
+
+        if encoding == ENCODING_KEYFRAME:
+            if self.image is None or self.image.size != data.size:
+                self.image = np.empty_like(data)
+            np.copyto(self.image, data)
+        elif encoding == ENCODING_DELTA:
+            if self.image is None or self.image.size != data.size:
+                raise ValueError("Delta frame without a keyframe before it")
+            np.add(self.image, data, out=self.image)
+        else:
+            raise ValueError(f"Unknown frame encoding {encoding}")
+
+        return self.image
+
+
+class BaseMLCReceiver:
+    """
+    Decoding, validation and statistics of the MLC frames, shared by the
+    socket and shared memory receivers. Intended to work in a context manager.
+    """
+
+    def __init__(
+        self, sdim: int = None, on_frame: typing.Callable = None, buffer_size: int = 0
+    ) -> None:
+        """
+        :param sdim: the expected image size (e.g., 64 or 256). Frames of any
+            size consistent with their header are accepted if not given.
+        :param on_frame: called with (frame number, header, image) for every
+            valid frame. The header and image are views into the receive
+            buffer, so copy them to keep them beyond the call.
+        :param buffer_size: initial size of the receive buffer in bytes.
+        """
+        self.sdim = sdim
+        self.on_frame = on_frame
+        self.buffer = bytearray(buffer_size)
+        self.statistics = ReceiverStatistics()
+        self.previous_arrival = None  # Of the previous frame of the connection.
+        self.decoder = MLCFrameDecoder()  # Of the connection.
+
+    def handle_frame(
+        self,
+        offset: int,
+        headersize: int,
+        imagesize: int,
+        arrival: float,
+        encoding: int = ENCODING_RAW,
+    ) -> None:
+        """
+        Decodes, validates and records a complete frame of the receive buffer.
+
+        :param offset: the offset of the frame (its prefix) in the buffer.
+        :param headersize: the header size from the frame prefix (bytes).
+        :param imagesize: the image payload size from the frame prefix (bytes).
+        :param arrival: the time the frame was received (time.perf_counter).
+        :param encoding: the encoding from the frame prefix.
+        """
+        statistics = self.statistics
+        header = np.frombuffer(self.buffer, HEADER_DTYPE, 1, offset + PREFIX.size)[0]
+        start = offset + PREFIX.size + headersize
+
+        if encoding == ENCODING_RAW:
+            image = np.frombuffer(self.buffer, np.uint16, imagesize // 2, start)
+        else:
+            try:
+                image = self.decoder.decode(
+                    encoding, self.buffer[start : start + imagesize]
+                )
+            except (ValueError, zlib.error) as error:
+                logging.warning(f"Could not decode a compressed frame: {error}")
+                statistics.invalid_frames += 1
+                return None
+            imagesize = image.nbytes
+
+        if not self.validate(header, imagesize):
+            statistics.invalid_frames += 1
+            return None
+
+        statistics.compressed_frames += encoding != ENCODING_RAW
+
+        if statistics.first_arrival is None:
+            statistics.first_arrival = arrival
+        if self.previous_arrival is not None:
+            statistics.intervals.append(arrival - self.previous_arrival)
+        self.previous_arrival = statistics.last_arrival = arrival
+
+        if self.on_frame is not None:
+            image = image.reshape(header["Width"], header["Height"])
+            self.on_frame(statistics.frames, header, image)
+        statistics.frames += 1
+        return None
+
+    def validate(self, header: np.void, imagesize: int) -> bool:
+        """
+        Checks the image payload size against the header width and height, and
+        against the expected image size if given.
+
+        :param header: the decoded header.
+        :param imagesize: the image payload size from the frame prefix (bytes).
+        """
+        width, height = int(header["Width"]), int(header["Height"])
+
+        if imagesize != 2 * width * height:
+            logging.warning(
+                f"Image payload of {imagesize} bytes does not match the "
+                f"{width}x{height} image in the header."
+            )
+            return False
+
+        if self.sdim is not None and (width, height) != (self.sdim, self.sdim):
+            logging.warning(
+                f"Received a {width}x{height} image, expected {self.sdim}x{self.sdim}."
+            )
+            return False
+
+        return True
+
+    def close(self) -> None:
+        return None
+
+    def __enter__(self) -> "BaseMLCReceiver":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+        return None
+
+
+class MLCReceiver(BaseMLCReceiver):
+    """
+    Listens for MLCSocketmaker connections, over TCP or an AF_UNIX stream
+    socket, and decodes the frames sent on them, one connection at a time.
+    """
+
+    def __init__(
+        self,
+        hostname: str = "localhost",
+        port: int = 31000,
+        sdim: int = None,
+        on_frame: typing.Callable = None,
+        buffer_size: int = 1 << 22,
+        socket_path: str = None,
+        accept_compression: bool = True,
+    ) -> None:
+        """
+        :param hostname: the address to listen on.
+        :param port: the port to listen on (0: any free port, see self.port).
+        :param sdim: the expected image size (e.g., 64 or 256). Frames of any
+            size consistent with their header are accepted if not given.
+        :param on_frame: called with (frame number, header, image) for every
+            valid frame. The header and image are views into the receive
+            buffer, so copy them to keep them beyond the call.
+        :param buffer_size: initial size of the receive buffer in bytes (grown
+            if a frame does not fit).
+        :param socket_path: listen on an AF_UNIX stream socket at this path
+            instead of hostname:port (MLCSocketmaker socket_path).
+        :param accept_compression: offer compressed frames to every client.
+        """
+        super().__init__(sdim, on_frame, buffer_size)
+        self.socket_path = socket_path
+        self.accept_compression = accept_compression
+
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)  # Left behind by a previous receiver.
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(socket_path)
+            self.hostname, self.port = socket_path, None
+        else:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((hostname, port))
+            self.hostname, self.port = self.server.getsockname()
+
+        self.server.listen()
+
+    def serve(self, max_connections: int = None, max_frames: int = None) -> None:
+        """
+        Accepts connections and receives frames until max_connections clients
+        have disconnected or max_frames frames have been received (forever if
+        neither is given).
+
+        :param max_connections: number of connections to serve.
+        :param max_frames: number of frames to receive.
+        """
+        while max_connections is None or self.statistics.connections < max_connections:
+            client, address = self.server.accept()
+            self.statistics.connections += 1
+            logging.info(f"Connected by {address or self.socket_path}.")
+
+            with client:
+                self.receive(client, max_frames)
+
+            logging.info(f"Connection from {address or self.socket_path} closed.")
+
+            if max_frames is not None and self.statistics.frames >= max_frames:
+                break
+
+        return None
+
+    def receive(self, client: socket.socket, max_frames: int = None) -> None:
+        """
+        Receives frames from one connection until it is closed. A frame with an
+        unexpected header size cannot be delimited, so the connection is
+        dropped.
+
+        :param client: the connected socket.
+        :param max_frames: number of frames (in total) after which to stop.
+        """
+        statistics = self.statistics
+        view = memoryview(self.buffer)
+        start = end = 0
+        self.previous_arrival = None
+        self.decoder = MLCFrameDecoder()
+
+        if self.accept_compression:
+            client.sendall(ENCODING_OFFER.pack(ENCODING_MAGIC, COMPRESSION_ZLIB))
+
+        while True:
+            if end == len(self.buffer):
+                # Move the incomplete frame to the front, growing the buffer if
+                # the frame is larger than the buffer.
+                pending = end - start
+                if start == 0:
+                    view.release()
+                    self.buffer = self.buffer + bytearray(len(self.buffer))
+                    view = memoryview(self.buffer)
+                else:
+                    view[:pending] = view[start:end]
+                start, end = 0, pending
+
+            received = client.recv_into(view[end:])
+            if not received:
+                break
+
+            arrival = time.perf_counter()
+            end += received
+            statistics.bytes_received += received
+
+            while end - start >= PREFIX.size:
+                headersize, imagesize = PREFIX.unpack_from(self.buffer, start)
+                encoding = headersize >> ENCODING_SHIFT
+                headersize &= (1 << ENCODING_SHIFT) - 1
+                if headersize != HEADERSIZE:
+                    statistics.invalid_frames += 1
+                    logging.error(
+                        f"Unexpected HEADERSIZE {headersize} (expected "
+                        f"{HEADERSIZE}), dropping the connection."
+                    )
+                    view.release()
+                    return None
+
+                frame_size = PREFIX.size + headersize + imagesize
+                if end - start < frame_size:
+                    break
+
+                self.handle_frame(start, headersize, imagesize, arrival, encoding)
+                start += frame_size
+
+                if max_frames is not None and statistics.frames >= max_frames:
+                    view.release()
+                    return None
+
+            if start == end:
+                start = end = 0
+
+        view.release()
+        return None
+
+    def close(self) -> None:
+        self.server.close()
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        return None
+
+
+class MLCSharedMemoryReceiver(BaseMLCReceiver):
+    """
+    Creates the shared memory ring written by MLCSharedMemorySocketmaker and
+    decodes the frames published in it, polling for new frames.
+    """
+
+    def __init__(
+        self,
+        name: str = "mlc_tracking",
+        sdim: int = None,
+        on_frame: typing.Callable = None,
+        slot_count: int = 8,
+        slot_size: int = PREFIX.size + HEADERSIZE + 2 * 512 * 512,
+        poll_interval: float = 1e-4,
+    ) -> None:
+        """
+        :param name: the name of the shared memory ring.
+        :param sdim: the expected image size (e.g., 64 or 256). Frames of any
+            size consistent with their header are accepted if not given.
+        :param on_frame: called with (frame number, header, image) for every
+            valid frame. The header and image are views into the receive
+            buffer, so copy them to keep them beyond the call.
+        :param slot_count: the number of slots, i.e., how many frames the
+            receiver can fall behind before missing frames.
+        :param slot_size: the largest frame in bytes (default: 512x512 images).
+        :param poll_interval: sleep (seconds) between polls of an empty ring. 0
+            spins, for the lowest latency at the cost of a busy core.
+        """
+        slot_size = -(-slot_size // 64) * 64  # Keep the slots aligned.
+        super().__init__(sdim, on_frame, slot_size)
+        self.name = name
+        self.poll_interval = poll_interval
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.slot_stride = SLOT_HEADER.size + slot_size
+        self.next_sequence = 1
+
+        try:
+            shared_memory.SharedMemory(name=name).unlink()  # Left behind.
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=True, size=SLOTS_OFFSET + slot_count * self.slot_stride
+        )
+        RING_HEADER.pack_into(
+            self.shm.buf, 0, RING_MAGIC, RING_VERSION, slot_count, slot_size, 0
+        )
+
+    def serve(self, max_frames: int = None, timeout: float = None) -> None:
+        """
+        Receives frames until max_frames frames have been received or no frame
+        has been written for timeout seconds (forever if neither is given).
+
+        :param max_frames: number of frames to receive.
+        :param timeout: seconds without a new frame after which to stop.
+        """
+        last_frame = time.perf_counter()
+
+        while max_frames is None or self.statistics.frames < max_frames:
+            if self.receive_available(max_frames):
+                last_frame = time.perf_counter()
+            elif timeout is not None and time.perf_counter() - last_frame > timeout:
+                break
+            elif self.poll_interval:
+                time.sleep(self.poll_interval)
+
+        return None
+
+    def receive_available(self, max_frames: int = None) -> int:
+        """
+        Receives the frames written since the last call, skipping (and
+        counting) those already overwritten. Returns the number of frames read.
+
+        :param max_frames: number of frames (in total) after which to stop.
+        """
+        statistics = self.statistics
+        buffer = self.shm.buf
+        sequence = struct.unpack_from("=Q", buffer, RING_HEADER.size - 8)[0]
+        frames_read = 0
+
+        if sequence < self.next_sequence:
+            return 0
+
+        if sequence - self.next_sequence >= self.slot_count:
+            # The oldest unread frames were overwritten (keep one slot of margin
+            # for the frame being written).
+            oldest = sequence - self.slot_count + 2
+            statistics.missed_frames += oldest - self.next_sequence
+            self.next_sequence = oldest
+
+        while self.next_sequence <= sequence:
+            if max_frames is not None and statistics.frames >= max_frames:
+                break
+
+            expected = self.next_sequence
+            self.next_sequence += 1
+            offset = SLOTS_OFFSET + (expected % self.slot_count) * self.slot_stride
+            slot_sequence, length = SLOT_HEADER.unpack_from(buffer, offset)
+            if slot_sequence != expected:
+                statistics.missed_frames += 1
+                continue
+
+            start = offset + SLOT_HEADER.size
+            self.buffer[:length] = buffer[start : start + length]
+            if SLOT_HEADER.unpack_from(buffer, offset)[0] != expected:
+                statistics.missed_frames += 1  # Overwritten while copying.
+                continue
+
+            arrival = time.perf_counter()
+            statistics.bytes_received += length
+            headersize, imagesize = PREFIX.unpack_from(self.buffer, 0)
+            if (
+                headersize != HEADERSIZE
+                or length != PREFIX.size + headersize + imagesize
+            ):
+                statistics.invalid_frames += 1
+                continue
+
+            self.handle_frame(0, headersize, imagesize, arrival)
+            frames_read += 1
+
+        return frames_read
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+        return None